@@ -0,0 +1,124 @@
+import argparse
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+from models.detection.face.face_detectors import FACE_DETECTORS
+from models.detection.face.face_detectors import ErrorFaceDetectorUnavailable
+from models.tello_drone import FRAME_X
+from models.tello_drone import FRAME_Y
+
+# ラベル付きの画像で顔検出器ごとの処理時間と検出率 (recall) を比較する。画像はドローンの映像と同じ大きさに縮小する
+# 使い方: python -m benchmarks.bench_face_detectors faces/ [--detectors haar yunet] [--repeat 3]
+# faces/labels.json は {"画像のファイル名": [[x, y, w, h], ...], ...} (元の画像の座標)
+
+LABELS_FILE = 'labels.json'
+DEFAULT_IOU_THRESHOLD = 0.5
+
+
+def load_dataset(directory):
+    """
+    Returns:
+        (FRAME_Y, FRAME_X, 3) に縮小した画像と、同じ倍率に縮小した正解の矩形の組のリスト
+    """
+    with open(os.path.join(directory, LABELS_FILE)) as f:
+        labels = json.load(f)
+    samples = []
+    for filename, boxes in sorted(labels.items()):
+        image = cv2.imread(os.path.join(directory, filename))
+        if image is None:
+            print(f'{filename}: could not read. skip it')
+            continue
+        height, width = image.shape[:2]
+        scale_x, scale_y = FRAME_X / width, FRAME_Y / height
+        image = cv2.resize(image, (FRAME_X, FRAME_Y), interpolation=cv2.INTER_AREA)
+        boxes = [(x * scale_x, y * scale_y, w * scale_x, h * scale_y) for x, y, w, h in boxes]
+        samples.append((image, boxes))
+    return samples
+
+
+def iou(box1, box2):
+    x1, y1, w1, h1 = box1
+    x2, y2, w2, h2 = box2
+    inter_w = max(0.0, min(x1 + w1, x2 + w2) - max(x1, x2))
+    inter_h = max(0.0, min(y1 + h1, y2 + h2) - max(y1, y2))
+    inter = inter_w * inter_h
+    union = w1 * h1 + w2 * h2 - inter
+    return inter / union if union > 0 else 0.0
+
+
+def match(detections, labels, iou_threshold):
+    """
+    IoUの大きい組から順に検出結果と正解を1対1で対応付ける
+    Returns:
+        正解と対応付けられた検出結果の数
+    """
+    pairs = sorted(((iou(detection, label), i, j) for i, detection in enumerate(detections)
+                    for j, label in enumerate(labels)), reverse=True)
+    used_detections, used_labels = set(), set()
+    for overlap, i, j in pairs:
+        if overlap < iou_threshold:
+            break
+        if i in used_detections or j in used_labels:
+            continue
+        used_detections.add(i)
+        used_labels.add(j)
+    return len(used_labels)
+
+
+def measure(detector, samples, repeat, iou_threshold):
+    """
+    Returns:
+        (処理時間(ms)の配列, 正解の数, 検出できた正解の数, 検出結果の数)
+    """
+    latencies = []
+    labels = matched = detections = 0
+    for image, boxes in samples:
+        input_image = image if detector.uses_color else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            faces = detector.detect(input_image)
+            latencies.append((time.perf_counter() - start_time) * 1000)
+        labels += len(boxes)
+        matched += match(faces, boxes, iou_threshold)
+        detections += len(faces)
+    return np.array(latencies), labels, matched, detections
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare face detector backends on labelled frames')
+    parser.add_argument('directory', help=f'directory with images and {LABELS_FILE}')
+    parser.add_argument('--detectors', nargs='+', default=list(FACE_DETECTORS), choices=list(FACE_DETECTORS))
+    parser.add_argument('--repeat', type=int, default=3, help='times to run each image for the latency')
+    parser.add_argument('--iou', type=float, default=DEFAULT_IOU_THRESHOLD,
+                        help='minimum IoU to count a detection as the labelled face')
+    args = parser.parse_args()
+
+    samples = load_dataset(args.directory)
+    if not samples:
+        print('no labelled images')
+        return
+    print(f'{args.directory}: {len(samples)} images of {FRAME_X}x{FRAME_Y}, '
+          f'{sum(len(boxes) for _, boxes in samples)} faces')
+
+    for name in args.detectors:
+        # フォールバックせず、使えない検出器は飛ばす
+        try:
+            detector = FACE_DETECTORS[name]()
+        except ErrorFaceDetectorUnavailable as ex:
+            print(f'{name:>8}: skipped ({ex})')
+            continue
+        # 初回の呼び出しの初期化を計測に含めない
+        detector.detect(samples[0][0] if detector.uses_color else cv2.cvtColor(samples[0][0], cv2.COLOR_BGR2GRAY))
+        latencies, labels, matched, detections = measure(detector, samples, args.repeat, args.iou)
+        detector.close()
+        print('{:>8}: p50 {:.2f} / p90 {:.2f} / p99 {:.2f} ms, recall {:.3f} ({}/{}), precision {:.3f}'.format(
+            name, *np.percentile(latencies, [50, 90, 99]), matched / labels if labels else 0.0, matched, labels,
+            matched / detections if detections else 0.0))
+
+
+if __name__ == '__main__':
+    main()
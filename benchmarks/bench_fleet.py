@@ -0,0 +1,92 @@
+import argparse
+import threading
+import time
+
+import numpy as np
+
+from benchmarks.tello_simulator import TelloSimulator
+from benchmarks.tello_simulator import load_access_units
+from models.command_channel import MIN_COMMAND_INTERVAL
+
+# シミュレーターのTelloを複数台起動してTelloFleetで操作し、
+# 全台へのコマンドの往復時間、ドローンごとのデコードのフレームレート、スレッド数を計測する
+# シミュレーターは 127.0.0.10, 127.0.0.11, ... で待ち受け、送信元のIPで見分けられるようにする
+# 使い方: python -m benchmarks.bench_fleet [--drones 4] [--duration 10]
+
+HOST_IP = '127.0.0.1'
+HOST_COMMAND_PORT = 18890
+STATE_PORT = 18891
+DRONE_COMMAND_PORT = 18889
+FIRST_DRONE_IP = 10
+FIRST_VIDEO_PORT = 21111
+
+
+def format_percentiles(values):
+    if len(values) == 0:
+        return 'no samples'
+    return 'p50 {:.1f} / p90 {:.1f} / p99 {:.1f} ms'.format(*np.percentile(values, [50, 90, 99]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure a fleet of simulated Tellos')
+    parser.add_argument('--drones', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds to decode video')
+    parser.add_argument('--commands', type=int, default=20, help='broadcast commands to measure')
+    parser.add_argument('--fps', type=float, default=30.0)
+    parser.add_argument('--command-delay', type=float, default=0.0)
+    parser.add_argument('--video', help='raw H.264 (Annex B) file to stream instead of the synthetic video')
+    args = parser.parse_args()
+
+    access_units, has_frame_code = load_access_units(args.video)
+    threads_before = threading.active_count()
+    simulators = []
+    for index in range(args.drones):
+        simulator = TelloSimulator(access_units, f'127.0.0.{FIRST_DRONE_IP + index}', DRONE_COMMAND_PORT,
+                                   FIRST_VIDEO_PORT + index, fps=args.fps, command_delay=args.command_delay,
+                                   has_frame_code=has_frame_code, state_port=STATE_PORT)
+        simulator.start()
+        simulators.append(simulator)
+    simulator_threads = threading.active_count() - threads_before
+
+    from models.fleet import TelloFleet
+    threads_before = threading.active_count()
+    fleet = TelloFleet(drones=[], host_ip=HOST_IP, host_port=HOST_COMMAND_PORT, state_port=STATE_PORT)
+    for index, simulator in enumerate(simulators):
+        drone = fleet.add_drone(f'tello{index}', simulator.command_address[0], drone_port=DRONE_COMMAND_PORT,
+                                video_port=FIRST_VIDEO_PORT + index)
+        drone.start_video_receiver()
+
+    try:
+        # 起動時に送った初期化コマンドの応答を待ってから計測する
+        fleet.broadcast(lambda drone: drone.send_command('command'))
+        rtts = []
+        for _ in range(args.commands):
+            time.sleep(MIN_COMMAND_INTERVAL)
+            start_time = time.perf_counter()
+            responses = fleet.broadcast(lambda drone: drone.send_command('command'))
+            if all(response is not None for response in responses.values()):
+                rtts.append((time.perf_counter() - start_time) * 1000)
+        print(f'broadcast RTT ({args.drones} drones): {len(rtts)}/{args.commands} answered by all, '
+              f'{format_percentiles(rtts)}')
+
+        drones = fleet.drones()
+        published_before = {drone_id: drone.frame_ring.stats()['published_frames']
+                            for drone_id, drone in drones.items()}
+        packets_before = {drone_id: drone.state_receiver.packets for drone_id, drone in drones.items()}
+        start_time = time.perf_counter()
+        time.sleep(args.duration)
+        elapsed = time.perf_counter() - start_time
+        for drone_id, drone in drones.items():
+            decoded = drone.frame_ring.stats()['published_frames'] - published_before[drone_id]
+            states = drone.state_receiver.packets - packets_before[drone_id]
+            print(f'{drone_id}: decode {decoded / elapsed:.1f} fps, state {states / elapsed:.1f} Hz')
+        print(f'threads: {threading.active_count() - threads_before} for the fleet '
+              f'(+{simulator_threads} for the simulators)')
+    finally:
+        fleet.stop()
+        for simulator in simulators:
+            simulator.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+import argparse
+import threading
+import time
+import urllib.request
+
+import cv2
+import numpy as np
+
+from benchmarks.tello_simulator import TelloSimulator
+from benchmarks.tello_simulator import load_access_units
+from benchmarks.tello_simulator import read_frame_code
+from models.command_channel import MIN_COMMAND_INTERVAL
+
+# シミュレーターのTelloに対してアプリを起動し、コマンドの往復時間、デコードのフレームレート、
+# フレームの送信からHTTPで配信されるまでの遅延 (glass-to-glass) を計測する
+# 使い方: python -m benchmarks.bench_glass_to_glass [--duration 10] [--command-delay 0.02]
+
+LOCAL_IP = '127.0.0.1'
+DRONE_COMMAND_PORT = 18889
+HOST_COMMAND_PORT = 18890
+VIDEO_PORT = 21111
+STATE_PORT = 18891
+HTTP_PORT = 15000
+# MJPEGの1フレームは JPEGの末尾(FFD9) + 空行 で終わる
+JPEG_END = b'\xff\xd9\r\n\r\n'
+
+
+def measure_command_rtt(drone, count):
+    """
+    Returns:
+        往復時間(ms)の配列。応答がなかったコマンドは含まない
+    """
+    rtts = []
+    for _ in range(count):
+        # 送信間隔の制限で待たされた時間を含めないように間を空ける
+        time.sleep(MIN_COMMAND_INTERVAL)
+        start_time = time.perf_counter()
+        response = drone.send_command('command')
+        if response is not None:
+            rtts.append((time.perf_counter() - start_time) * 1000)
+    return np.array(rtts)
+
+
+def read_mjpeg_stream(url, simulator, duration):
+    """
+    MJPEGの配信を読み、フレーム番号から送信時刻を引いて遅延を求める
+    Returns:
+        (遅延(ms)の配列, 受信したフレーム数)
+    """
+    latencies = []
+    frames = 0
+    buffer = b''
+    end_time = time.perf_counter() + duration
+    with urllib.request.urlopen(url, timeout=5) as stream:
+        while time.perf_counter() < end_time:
+            chunk = stream.read1(65536)
+            if not chunk:
+                break
+            buffer += chunk
+            while True:
+                jpeg_start = buffer.find(b'\xff\xd8')
+                jpeg_end = buffer.find(JPEG_END, jpeg_start)
+                if jpeg_start < 0 or jpeg_end < 0:
+                    break
+                received_time = time.perf_counter()
+                image = cv2.imdecode(np.frombuffer(buffer[jpeg_start:jpeg_end + 2], dtype=np.uint8),
+                                     cv2.IMREAD_COLOR)
+                buffer = buffer[jpeg_end + len(JPEG_END):]
+                frames += 1
+                send_time = simulator.frame_send_times.get(read_frame_code(image))
+                if send_time is not None:
+                    latencies.append((received_time - send_time) * 1000)
+    return np.array(latencies), frames
+
+
+def format_percentiles(values):
+    if len(values) == 0:
+        return 'n/a'
+    return 'p50 {:.1f} / p90 {:.1f} / p99 {:.1f} ms'.format(*np.percentile(values, [50, 90, 99]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure command RTT and glass-to-glass latency against a simulator')
+    parser.add_argument('--video', help='raw H.264 (Annex B) file. Latency needs the synthetic video')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds to read the MJPEG stream')
+    parser.add_argument('--commands', type=int, default=50, help='number of commands for the RTT measurement')
+    parser.add_argument('--fps', type=float, default=30.0)
+    parser.add_argument('--command-delay', type=float, default=0.0)
+    parser.add_argument('--command-jitter', type=float, default=0.0)
+    parser.add_argument('--drop-rate', type=float, default=0.0)
+    parser.add_argument('--video-drop-rate', type=float, default=0.0)
+    parser.add_argument('--decoder', default=None, help='video decoder backend (default: settings.VIDEO_DECODER)')
+    args = parser.parse_args()
+
+    access_units, has_frame_code = load_access_units(args.video)
+    simulator = TelloSimulator(access_units, LOCAL_IP, DRONE_COMMAND_PORT, VIDEO_PORT, fps=args.fps,
+                               command_delay=args.command_delay, command_jitter=args.command_jitter,
+                               drop_rate=args.drop_rate, video_drop_rate=args.video_drop_rate,
+                               has_frame_code=has_frame_code, state_port=STATE_PORT)
+    simulator.start()
+
+    # TelloFleetはSingletonのため、サーバーより先にシミュレーター向けの設定で生成する
+    from models.fleet import TelloFleet
+    import settings
+    fleet = TelloFleet(drones=[], host_ip=LOCAL_IP, host_port=HOST_COMMAND_PORT, state_port=STATE_PORT)
+    drone = fleet.add_drone('simulator', LOCAL_IP, drone_port=DRONE_COMMAND_PORT, video_port=VIDEO_PORT,
+                            video_decoder=args.decoder or settings.VIDEO_DECODER)
+    drone.start_video_receiver()
+
+    import controllers.server
+    from werkzeug.serving import make_server
+    server = make_server(LOCAL_IP, HTTP_PORT, controllers.server.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    try:
+        # 起動時に送った初期化コマンドの応答を待ってから計測する
+        drone.send_command('command')
+        rtts = measure_command_rtt(drone, args.commands)
+        print(f'command RTT: {len(rtts)}/{args.commands} answered, {format_percentiles(rtts)}')
+
+        published_before = drone.frame_ring.stats()['published_frames']
+        start_time = time.perf_counter()
+        latencies, frames = read_mjpeg_stream(f'http://{LOCAL_IP}:{HTTP_PORT}/api/tello/video/stremeing',
+                                              simulator, args.duration)
+        elapsed = time.perf_counter() - start_time
+        decoded = drone.frame_ring.stats()['published_frames'] - published_before
+        print(f'decode: {decoded / elapsed:.1f} fps ({decoded} frames in {elapsed:.1f} s)')
+        print(f'http: {frames / elapsed:.1f} fps ({frames} frames)')
+        if has_frame_code:
+            print(f'glass-to-glass: {format_percentiles(latencies)}')
+    finally:
+        server.shutdown()
+        fleet.stop()
+        simulator.stop()
+
+
+if __name__ == '__main__':
+    main()
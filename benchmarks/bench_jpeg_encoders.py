@@ -0,0 +1,111 @@
+import argparse
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from benchmarks.tello_simulator import encode_synthetic_video
+from models.flight_recorder import FlightRecording
+from models.flight_recorder import FlightReplayer
+from models.tello_drone import FRAME_X
+from models.tello_drone import FRAME_Y
+from models.video.decoders import PyAVDecoder
+from models.video.frame_reader import FrameRing
+from models.video.h264 import split_access_units
+from models.video.jpeg_encoders import JPEG_ENCODERS
+from models.video.jpeg_encoders import ErrorJpegEncoderUnavailable
+from models.video.stream_profiles import DEFAULT_PROFILE
+from models.video.stream_profiles import PROFILES
+
+# 記録したフレームをエンコーダと配信の設定ごとにJPEGにし、処理時間とサイズを比較する
+# 使い方: python -m benchmarks.bench_jpeg_encoders [recordings/20240101_120000 | recording.h264] [--frames 300]
+
+
+def load_frames(source, limit):
+    """
+    Args:
+        source: FlightRecorderの記録のディレクトリ、録画した.h264、Noneの場合は生成した映像
+        limit: 読み込む最大フレーム数
+    Returns:
+        デコードしたフレーム (FRAME_Y, FRAME_X, 3) のリスト
+    """
+    frame_ring = FrameRing((FRAME_Y, FRAME_X, 3))
+    decoder = PyAVDecoder(frame_ring, threading.Event())
+    frames = []
+
+    def on_frame(seq, frame):
+        if len(frames) < limit:
+            frames.append(frame.copy())
+
+    if source is not None and os.path.isdir(source):
+        FlightReplayer(FlightRecording(source), decoder, frame_ring).run(on_frame)
+    else:
+        if source is None:
+            access_units = encode_synthetic_video(limit)
+        else:
+            with open(source, 'rb') as f:
+                access_units = split_access_units(f.read())
+        decoder.start()
+        seq = 0
+        for access_unit in access_units:
+            decoder.feed_access_unit(access_unit)
+            latest_seq, frame = frame_ring.latest()
+            if latest_seq != seq:
+                seq = latest_seq
+                on_frame(seq, frame)
+    decoder.close()
+    return frames
+
+
+def measure(encoder, profile, frames):
+    """
+    Returns:
+        (処理時間(ms)の配列, 平均のサイズ(バイト))
+    """
+    latencies = []
+    total_bytes = 0
+    for frame in frames:
+        start_time = time.perf_counter()
+        image = frame
+        if profile.scale < 1.0:
+            image = cv2.resize(frame, None, fx=profile.scale, fy=profile.scale, interpolation=cv2.INTER_AREA)
+        jpeg = encoder.encode(image, profile.quality)
+        latencies.append((time.perf_counter() - start_time) * 1000)
+        total_bytes += len(jpeg)
+    return np.array(latencies), total_bytes / len(frames)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare JPEG encoder backends and stream profiles')
+    parser.add_argument('source', nargs='?', help='flight recording directory or raw H.264 file. '
+                                                  'a synthetic video is used when omitted')
+    parser.add_argument('--frames', type=int, default=300, help='frames to encode')
+    parser.add_argument('--encoders', nargs='+', default=list(JPEG_ENCODERS))
+    args = parser.parse_args()
+
+    frames = load_frames(args.source, args.frames)
+    if not frames:
+        print('no video frames to encode')
+        return
+    print(f'{args.source or "synthetic video"}: {len(frames)} frames of {FRAME_X}x{FRAME_Y}')
+
+    profiles = [DEFAULT_PROFILE] + list(PROFILES.values())
+    for encoder_name in args.encoders:
+        try:
+            encoder = JPEG_ENCODERS[encoder_name]()
+        except ErrorJpegEncoderUnavailable as ex:
+            print(f'{encoder_name:>10}: skipped ({ex})')
+            continue
+        # 初回の呼び出しの初期化を計測に含めない
+        encoder.encode(frames[0])
+        for profile in profiles:
+            latencies, size = measure(encoder, profile, frames)
+            print('{:>10} {:>8} (q{:>3}, x{:.2f}): p50 {:.2f} / p90 {:.2f} ms, {:.0f} encodes/s, {:.1f} KB'.format(
+                encoder_name, profile.name, profile.quality, profile.scale, *np.percentile(latencies, [50, 90]),
+                1000 / latencies.mean(), size / 1024))
+
+
+if __name__ == '__main__':
+    main()
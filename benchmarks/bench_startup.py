@@ -0,0 +1,144 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+import numpy as np
+
+from benchmarks.tello_simulator import TelloSimulator
+from benchmarks.tello_simulator import load_access_units
+from settings import PROJECT_ROOT
+
+# シミュレーターのTelloに対してアプリ (main.py) を別プロセスで起動し、
+# 最初のページ・ヘルスチェックの準備完了・最初の映像フレームまでの時間を計測する
+# 使い方: python -m benchmarks.bench_startup [--runs 5] [--target 2.0]
+
+LOCAL_IP = '127.0.0.1'
+DRONE_COMMAND_PORT = 18889
+HOST_COMMAND_PORT = 18890
+VIDEO_PORT = 21111
+STATE_PORT = 18891
+HTTP_PORT = 15001
+# 計測を諦めるまでの時間(秒)
+STARTUP_TIMEOUT = 30.0
+POLL_INTERVAL = 0.01
+
+
+def wait_for(url, deadline, ready=lambda response: True):
+    """
+    urlが200を返すまで繰り返しリクエストする
+    Returns:
+        成功したレスポンスの本文。時間内に成功しなかった場合は None
+    """
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1.0) as response:
+                body = response.read()
+                if ready(body):
+                    return body
+        except (urllib.error.URLError, ConnectionError, OSError):
+            # まだ起動していない、または準備ができていない (503)
+            pass
+        time.sleep(POLL_INTERVAL)
+    return None
+
+
+def read_first_frame(url, deadline):
+    """
+    MJPEGの配信から最初のJPEGを受け取るまで待つ
+    Returns:
+        受け取った場合は True
+    """
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=5.0) as stream:
+                buffer = b''
+                while time.perf_counter() < deadline:
+                    chunk = stream.read1(65536)
+                    if not chunk:
+                        break
+                    buffer += chunk
+                    if buffer.find(b'\xff\xd9', buffer.find(b'\xff\xd8')) > 0:
+                        return True
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(POLL_INTERVAL)
+    return False
+
+
+def measure_startup():
+    """
+    Returns:
+        {計測項目: 起動からの時間(秒)}。時間内に終わらなかった項目は None
+    """
+    env = dict(os.environ, TELLO_HOST_IP=LOCAL_IP, TELLO_HOST_COMMAND_PORT=str(HOST_COMMAND_PORT),
+               TELLO_DRONE_IP=LOCAL_IP, TELLO_COMMAND_PORT=str(DRONE_COMMAND_PORT),
+               TELLO_VIDEO_PORT=str(VIDEO_PORT), TELLO_STATE_PORT=str(STATE_PORT),
+               SERVER_PORT=str(HTTP_PORT))
+    base_url = f'http://{LOCAL_IP}:{HTTP_PORT}'
+    start_time = time.perf_counter()
+    deadline = start_time + STARTUP_TIMEOUT
+    process = subprocess.Popen([sys.executable, 'main.py'], cwd=PROJECT_ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    results = {}
+    try:
+        page = wait_for(base_url + '/', deadline)
+        results['first_page'] = time.perf_counter() - start_time if page is not None else None
+        health = wait_for(base_url + '/api/tello/health', deadline,
+                          lambda body: json.loads(body)['status'] == 'ready')
+        results['health_ready'] = time.perf_counter() - start_time if health is not None else None
+        frame = read_first_frame(base_url + '/api/tello/video/stremeing', deadline)
+        results['first_frame'] = time.perf_counter() - start_time if frame else None
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=5.0)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+    return results
+
+
+def format_seconds(values):
+    values = [value for value in values if value is not None]
+    if not values:
+        return 'n/a'
+    return 'p50 {:.3f} / max {:.3f} s'.format(np.percentile(values, 50), max(values))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the time until the app serves its first page')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--target', type=float, default=2.0,
+                        help='seconds the first page must be served within (p50). exits with 1 when missed')
+    args = parser.parse_args()
+
+    access_units, has_frame_code = load_access_units(None)
+    simulator = TelloSimulator(access_units, LOCAL_IP, DRONE_COMMAND_PORT, VIDEO_PORT,
+                               has_frame_code=has_frame_code, state_port=STATE_PORT)
+    simulator.start()
+    runs = []
+    try:
+        for run in range(args.runs):
+            results = measure_startup()
+            print(f'run {run + 1}: ' + ', '.join(
+                f'{name} {"n/a" if seconds is None else f"{seconds:.3f} s"}' for name, seconds in results.items()))
+            runs.append(results)
+    finally:
+        simulator.stop()
+
+    for name in ('first_page', 'health_ready', 'first_frame'):
+        print(f'{name:>12}: {format_seconds([results.get(name) for results in runs])}')
+    first_pages = [results['first_page'] for results in runs if results['first_page'] is not None]
+    if len(first_pages) < len(runs) or np.percentile(first_pages, 50) > args.target:
+        print(f'first page is not served within the target {args.target:.1f} s')
+        sys.exit(1)
+    print(f'first page is served within the target {args.target:.1f} s')
+
+
+if __name__ == '__main__':
+    main()
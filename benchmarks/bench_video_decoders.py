@@ -0,0 +1,114 @@
+import argparse
+import threading
+import time
+
+import numpy as np
+
+from models.tello_drone import FRAME_X
+from models.tello_drone import FRAME_Y
+from models.video.decoders import VIDEO_DECODERS
+from models.video.decoders import ErrorVideoDecoderUnavailable
+from models.video.frame_reader import FrameRing
+from models.video.h264 import split_access_units
+
+# 録画した.h264をデコーダごとに再生し、フレームレートとフレームごとの遅延を比較する
+# 使い方: python -m benchmarks.bench_video_decoders recording.h264 [--fps 30]
+
+# Telloの映像パケットの最大サイズ
+TELLO_PACKET_SIZE = 1460
+
+
+class TimedFrameRing(FrameRing):
+    """
+    公開したフレームの時刻を記録するFrameRing
+    """
+
+    def __init__(self, shape):
+        super().__init__(shape)
+        self.publish_times = []
+
+    def publish(self, decode_latency=0.0):
+        self.publish_times.append(time.perf_counter())
+        super().publish(decode_latency)
+
+
+def replay(decoder_name, access_units, fps, drain_timeout, whole_access_units=False):
+    """
+    アクセスユニットをTelloと同じパケットサイズに分けてデコーダへ入力する
+    Args:
+        decoder_name: デコーダ名
+        access_units: アクセスユニットのリスト
+        fps: 入力レート。0の場合は最大速度で入力する
+        drain_timeout: 入力完了後、フレームが出なくなるまで待つ時間(秒)
+        whole_access_units: Trueの場合はH264Reassemblerと同様に1フレームずつまとめて入力する
+    Returns:
+        計測結果の辞書
+    """
+    frame_ring = TimedFrameRing((FRAME_Y, FRAME_X, 3))
+    stop_flag = threading.Event()
+    decoder = VIDEO_DECODERS[decoder_name](frame_ring, stop_flag)
+    decoder.start()
+
+    feed_times = []
+    interval = 1.0 / fps if fps else 0.0
+    start_time = time.perf_counter()
+    for index, access_unit in enumerate(access_units):
+        if interval:
+            wait = start_time + index * interval - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+        if whole_access_units:
+            feed_times.append(time.perf_counter())
+            decoder.feed_access_unit(access_unit)
+        else:
+            for offset in range(0, len(access_unit), TELLO_PACKET_SIZE):
+                if offset + TELLO_PACKET_SIZE >= len(access_unit):
+                    feed_times.append(time.perf_counter())
+                decoder.feed(access_unit[offset:offset + TELLO_PACKET_SIZE])
+
+    published = -1
+    while published != len(frame_ring.publish_times):
+        published = len(frame_ring.publish_times)
+        time.sleep(drain_timeout)
+    stop_flag.set()
+    decoder.close()
+
+    publish_times = np.array(frame_ring.publish_times)
+    elapsed = (publish_times[-1] - start_time) if len(publish_times) else float('nan')
+    # 1アクセスユニット=1フレームとして、最後のパケットを入力し始めてからフレームが出るまでを遅延とする
+    count = min(len(publish_times), len(feed_times))
+    latencies = (publish_times[:count] - np.array(feed_times[:count])) * 1000
+    return {
+        'frames': len(publish_times),
+        'fps': len(publish_times) / elapsed if len(publish_times) else 0.0,
+        'latency_ms': np.percentile(latencies, [50, 90, 99]) if count else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare video decoder backends')
+    parser.add_argument('recording', help='raw H.264 (Annex B) file recorded from the Tello')
+    parser.add_argument('--fps', type=float, default=30.0, help='replay rate. 0 means as fast as possible')
+    parser.add_argument('--drain-timeout', type=float, default=1.0)
+    parser.add_argument('--decoders', nargs='+', default=list(VIDEO_DECODERS))
+    parser.add_argument('--access-units', action='store_true',
+                        help='feed one reassembled frame per call instead of per packet')
+    args = parser.parse_args()
+
+    with open(args.recording, 'rb') as f:
+        access_units = split_access_units(f.read())
+    print(f'{args.recording}: {len(access_units)} access units, replay at {args.fps or "max"} fps')
+
+    for decoder_name in args.decoders:
+        try:
+            result = replay(decoder_name, access_units, args.fps, args.drain_timeout, args.access_units)
+        except (ErrorVideoDecoderUnavailable, OSError) as ex:
+            print(f'{decoder_name:>8}: skipped ({ex})')
+            continue
+        latency = result['latency_ms']
+        latency_text = 'n/a' if latency is None else 'p50 {:.1f} / p90 {:.1f} / p99 {:.1f} ms'.format(*latency)
+        print(f'{decoder_name:>8}: {result["frames"]} frames, {result["fps"]:.1f} fps, latency {latency_text}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import argparse
+import threading
+import time
+
+import numpy as np
+
+from models.detection.face.face_detectors import FACE_DETECTORS
+from models.detection.face.face_detectors import create_face_detector
+from models.detection.face.face_tracker import FaceDetectionWorker
+from models.flight_recorder import RECORD_COMMAND
+from models.flight_recorder import RECORD_DETECTION
+from models.flight_recorder import FlightRecording
+from models.flight_recorder import FlightReplayer
+from models.tello_drone import FRAME_X
+from models.tello_drone import FRAME_Y
+from models.video.decoders import PyAVDecoder
+from models.video.frame_reader import FrameRing
+
+# 記録したフライトの映像をデコーダと顔検出に通し、検出結果と処理時間を記録時と比べる
+# 使い方: python -m benchmarks.replay_flight recordings/20240101_120000 [--speed 0] [--detector haar]
+
+
+def replay_face_detection(recording, speed, detector_name):
+    """
+    Returns:
+        (フレーム数, 経過時間(秒), 処理時間(ms)の配列, 顔を検出したフレーム数)
+    """
+    frame_ring = FrameRing((FRAME_Y, FRAME_X, 3))
+    stop_flag = threading.Event()
+    decoder = PyAVDecoder(frame_ring, stop_flag)
+    face_detector = FaceDetectionWorker(frame_ring, create_face_detector(detector_name))
+
+    latencies = []
+    detected_frames = 0
+
+    def on_frame(seq, frame):
+        nonlocal detected_frames
+        latencies.append(face_detector.process_frame(seq, frame) * 1000)
+        if face_detector.latest_track() is not None:
+            detected_frames += 1
+
+    start_time = time.perf_counter()
+    frames = FlightReplayer(recording, decoder, frame_ring).run(on_frame, speed)
+    elapsed = time.perf_counter() - start_time
+    decoder.close()
+    face_detector.detector.close()
+    return frames, elapsed, np.array(latencies), detected_frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a flight recording through the decoder and face detection')
+    parser.add_argument('recording', help='directory written by FlightRecorder')
+    parser.add_argument('--speed', type=float, default=0.0, help='replay speed. 0 means as fast as possible')
+    parser.add_argument('--detector', default='haar', choices=list(FACE_DETECTORS), help='face detector backend')
+    args = parser.parse_args()
+
+    recording = FlightRecording(args.recording)
+    commands = 0
+    recorded_faces = 0
+    for record_type, _, payload in recording.records({RECORD_COMMAND, RECORD_DETECTION}):
+        if record_type == RECORD_COMMAND:
+            commands += 1
+        elif FlightRecording.decode_payload(record_type, payload)['kind'] == 'face':
+            recorded_faces += 1
+    print(f'{args.recording}: {len(recording.chunks)} chunks, {commands} commands, '
+          f'{recorded_faces} recorded face detections')
+
+    frames, elapsed, latencies, detected_frames = replay_face_detection(recording, args.speed, args.detector)
+    if frames == 0:
+        print('no video frames in the recording')
+        return
+    print(f'replayed {frames} frames in {elapsed:.2f} s ({frames / elapsed:.1f} fps)')
+    print('face detection ({}): {} frames with a face, p50 {:.1f} / p90 {:.1f} / p99 {:.1f} ms'.format(
+        args.detector, detected_frames, *np.percentile(latencies, [50, 90, 99])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+import argparse
+import logging
+import random
+import socket
+import threading
+import time
+
+import numpy as np
+
+from models.video.h264 import split_access_units
+
+# ローカルで動くTelloのシミュレーター
+# コマンドポートで 'ok'/'error' を返し、映像ポートへH.264をTelloと同じパケットサイズで送る
+# 使い方: python -m benchmarks.tello_simulator [--video recording.h264] [--command-delay 0.05]
+# アプリ側は TELLO_DRONE_IP=127.0.0.1 TELLO_HOST_IP=127.0.0.1 TELLO_HOST_COMMAND_PORT=9000 python main.py
+
+SIMULATOR_IP = '127.0.0.1'
+COMMAND_PORT = 8889
+VIDEO_PORT = 11111
+STATE_PORT = 8890
+STATE_INTERVAL = 0.1
+STATE_FORMAT = ('mid:-1;x:0;y:0;z:0;mpry:0,0,0;pitch:{pitch};roll:0;yaw:{yaw};vgx:0;vgy:0;vgz:0;templ:60;temph:62;'
+                'tof:{tof};h:{h};bat:{bat};baro:{baro:.2f};time:{time};agx:-3.00;agy:1.00;agz:-999.00;\r\n')
+TELLO_VIDEO_PACKET_SIZE = 1460
+VIDEO_WIDTH = 960
+VIDEO_HEIGHT = 720
+VIDEO_FPS = 30
+# Telloは rc コマンドに応答しない
+NO_RESPONSE_COMMANDS = ('rc', )
+
+# フレーム番号を映像の上端に白黒のブロックで埋め込む
+FRAME_CODE_BITS = 16
+FRAME_CODE_MODULO = 1 << FRAME_CODE_BITS
+# ブロックの高さ (画像の高さに対する割合)
+FRAME_CODE_HEIGHT = 1 / 16
+# 生成する映像の長さ。末尾まで送ったら先頭から繰り返す
+SYNTHETIC_FRAME_COUNT = 300
+
+
+def draw_frame_code(image, code):
+    """
+    画像の上端にフレーム番号をFRAME_CODE_BITSビットのブロックで描く
+    """
+    height, width = image.shape[:2]
+    block_width = width // FRAME_CODE_BITS
+    block_height = int(height * FRAME_CODE_HEIGHT)
+    for bit in range(FRAME_CODE_BITS):
+        value = 255 if (code >> bit) & 1 else 0
+        image[:block_height, bit * block_width:(bit + 1) * block_width] = value
+
+
+def read_frame_code(image):
+    """
+    draw_frame_codeで描いたフレーム番号を読む。縮小やJPEG圧縮された画像でも読めるようにブロックの中心を見る
+    """
+    height, width = image.shape[:2]
+    block_width = width / FRAME_CODE_BITS
+    y = int(height * FRAME_CODE_HEIGHT / 2)
+    code = 0
+    for bit in range(FRAME_CODE_BITS):
+        x = int((bit + 0.5) * block_width)
+        if image[y, x].mean() > 127:
+            code |= 1 << bit
+    return code
+
+
+def encode_synthetic_video(frame_count, width=VIDEO_WIDTH, height=VIDEO_HEIGHT, fps=VIDEO_FPS, gop_size=VIDEO_FPS):
+    """
+    フレーム番号を埋め込んだ映像をH.264 (Annex B) にエンコードする
+    Returns:
+        アクセスユニットのリスト。i番目のフレームのフレーム番号は i
+    """
+    import av
+
+    codec = av.CodecContext.create('libx264', 'w')
+    codec.width = width
+    codec.height = height
+    codec.pix_fmt = 'yuv420p'
+    codec.framerate = fps
+    codec.gop_size = gop_size
+    codec.max_b_frames = 0
+    codec.options = {'preset': 'ultrafast', 'tune': 'zerolatency'}
+
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    gradient = np.linspace(0, 255, width, dtype=np.uint8)
+    access_units = []
+    for index in range(frame_count):
+        # 動きのある背景にして、実際の映像に近いビットレートにする
+        image[:] = np.roll(gradient, index * 8)[None, :, None]
+        draw_frame_code(image, index)
+        frame = av.VideoFrame.from_ndarray(image, format='bgr24')
+        frame.pts = index
+        access_units.extend(bytes(packet) for packet in codec.encode(frame))
+    access_units.extend(bytes(packet) for packet in codec.encode(None))
+    return access_units
+
+
+class TelloSimulator:
+    """
+    Telloのコマンド応答と映像送信を模擬する
+    """
+
+    def __init__(self, access_units, ip=SIMULATOR_IP, command_port=COMMAND_PORT, video_port=VIDEO_PORT,
+                 fps=VIDEO_FPS, command_delay=0.0, command_jitter=0.0, drop_rate=0.0, error_rate=0.0,
+                 video_drop_rate=0.0, has_frame_code=True, state_port=STATE_PORT):
+        """
+        Args:
+            access_units: 映像のアクセスユニットのリスト。末尾まで送ったら先頭に戻る
+            ip, command_port: コマンドを受け付けるアドレス
+            video_port: 映像の送信先のポート。送信先のIPはstreamonを送ってきたホスト
+            fps: 映像の送信レート
+            command_delay: 応答までの遅延(秒)
+            command_jitter: 応答までの遅延に加える揺らぎの最大値(秒)
+            drop_rate: 応答しないコマンドの割合
+            error_rate: 'error' を返すコマンドの割合
+            video_drop_rate: 送らない映像パケットの割合
+            has_frame_code: 映像にフレーム番号が埋め込まれているか
+            state_port: 状態パケットの送信先のポート。送信先のIPはcommandを送ってきたホスト
+        """
+        self.access_units = access_units
+        self.command_address = (ip, command_port)
+        self.video_port = video_port
+        self.video_address = None
+        self.state_port = state_port
+        self.state_address = None
+        self.fps = fps
+        self.command_delay = command_delay
+        self.command_jitter = command_jitter
+        self.drop_rate = drop_rate
+        self.error_rate = error_rate
+        self.video_drop_rate = video_drop_rate
+        self.has_frame_code = has_frame_code
+
+        self.stop_flag = threading.Event()
+        self._streaming = threading.Event()
+        self.command_socket = None
+        self._threads = []
+        self._random = random.Random(0)
+
+        self.received_commands = []
+        # フレーム番号 -> そのフレームの送信を始めた時刻 (time.perf_counter)
+        self.frame_send_times = {}
+        self.sent_frames = 0
+        self.sent_packets = 0
+
+    def start(self):
+        self.command_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.command_socket.bind(self.command_address)
+        self.command_socket.settimeout(0.5)
+        self._threads = [threading.Thread(target=self._serve_commands, daemon=True),
+                         threading.Thread(target=self._stream_video, daemon=True),
+                         threading.Thread(target=self._stream_state, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self.stop_flag.set()
+        for thread in self._threads:
+            thread.join(timeout=2.0)
+        if self.command_socket is not None:
+            self.command_socket.close()
+
+    def _serve_commands(self):
+        while not self.stop_flag.is_set():
+            try:
+                data, address = self.command_socket.recvfrom(3000)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            command = data.decode('utf-8', errors='replace').strip()
+            self.received_commands.append((time.perf_counter(), command))
+            if command == 'command':
+                self.state_address = (address[0], self.state_port)
+            elif command == 'streamon':
+                self.video_address = (address[0], self.video_port)
+                self._streaming.set()
+            elif command == 'streamoff':
+                self._streaming.clear()
+            elif command.startswith('port '):
+                # port <状態のポート> <映像のポート>
+                self.state_port, self.video_port = (int(port) for port in command.split()[1:3])
+                self.state_address = (address[0], self.state_port)
+                if self.video_address is not None:
+                    self.video_address = (address[0], self.video_port)
+
+            if command.split(' ', 1)[0] in NO_RESPONSE_COMMANDS or self._random.random() < self.drop_rate:
+                continue
+            response = b'error' if self._random.random() < self.error_rate else b'ok'
+            delay = self.command_delay + self._random.uniform(0, self.command_jitter)
+            timer = threading.Timer(delay, self._reply, args=(response, address))
+            timer.daemon = True
+            timer.start()
+
+    def _reply(self, response, address):
+        try:
+            self.command_socket.sendto(response, address)
+        except OSError:
+            pass
+
+    def _stream_state(self):
+        start_time = time.perf_counter()
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as state_socket:
+            # アプリは状態の送信元のIPでドローンを見分ける
+            state_socket.bind((self.command_address[0], 0))
+            while not self.stop_flag.wait(STATE_INTERVAL):
+                if self.state_address is None:
+                    continue
+                elapsed = time.perf_counter() - start_time
+                state = STATE_FORMAT.format(pitch=int(elapsed) % 5, yaw=int(elapsed * 10) % 360, tof=10, h=0,
+                                            bat=max(0, 100 - int(elapsed / 30)), baro=12.3 + elapsed % 1,
+                                            time=int(elapsed))
+                state_socket.sendto(state.encode('ascii'), self.state_address)
+
+    def _stream_video(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as video_socket:
+            interval = 1.0 / self.fps
+            next_time = time.perf_counter()
+            index = 0
+            while not self.stop_flag.is_set():
+                if not self._streaming.wait(timeout=0.5):
+                    next_time = time.perf_counter()
+                    continue
+                wait = next_time - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+                next_time += interval
+
+                access_unit = self.access_units[index % len(self.access_units)]
+                if self.has_frame_code:
+                    self.frame_send_times[index % len(self.access_units)] = time.perf_counter()
+                for offset in range(0, len(access_unit), TELLO_VIDEO_PACKET_SIZE):
+                    if self.video_drop_rate and self._random.random() < self.video_drop_rate:
+                        continue
+                    video_socket.sendto(access_unit[offset:offset + TELLO_VIDEO_PACKET_SIZE], self.video_address)
+                    self.sent_packets += 1
+                self.sent_frames += 1
+                index += 1
+
+
+def load_access_units(video_file=None, frame_count=SYNTHETIC_FRAME_COUNT):
+    """
+    Args:
+        video_file: 録画した.h264。Noneの場合はフレーム番号を埋め込んだ映像を生成する
+        frame_count: 生成するフレーム数
+    Returns:
+        (アクセスユニットのリスト, フレーム番号が埋め込まれているか)
+    """
+    if video_file is None:
+        if frame_count > FRAME_CODE_MODULO:
+            raise ValueError(f'frame_count must be <= {FRAME_CODE_MODULO}')
+        return encode_synthetic_video(frame_count), True
+    with open(video_file, 'rb') as f:
+        return split_access_units(f.read()), False
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate a Tello on local UDP ports')
+    parser.add_argument('--video', help='raw H.264 (Annex B) file to stream instead of the synthetic video')
+    parser.add_argument('--ip', default=SIMULATOR_IP)
+    parser.add_argument('--command-port', type=int, default=COMMAND_PORT)
+    parser.add_argument('--video-port', type=int, default=VIDEO_PORT, help='port on the host to stream video to')
+    parser.add_argument('--state-port', type=int, default=STATE_PORT, help='port on the host to send state to')
+    parser.add_argument('--fps', type=float, default=VIDEO_FPS)
+    parser.add_argument('--command-delay', type=float, default=0.0, help='seconds before each response')
+    parser.add_argument('--command-jitter', type=float, default=0.0)
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='fraction of commands left unanswered')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of commands answered with error')
+    parser.add_argument('--video-drop-rate', type=float, default=0.0, help='fraction of video packets dropped')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    access_units, has_frame_code = load_access_units(args.video)
+    simulator = TelloSimulator(access_units, args.ip, args.command_port, args.video_port, fps=args.fps,
+                               command_delay=args.command_delay, command_jitter=args.command_jitter,
+                               drop_rate=args.drop_rate, error_rate=args.error_rate,
+                               video_drop_rate=args.video_drop_rate, has_frame_code=has_frame_code,
+                               state_port=args.state_port)
+    simulator.start()
+    print(f'Simulated Tello listening on {args.ip}:{args.command_port}. Press Ctrl+C to stop')
+    try:
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    simulator.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+import asyncio
+import json
+import logging
+
+import settings
+
+import controllers.server
+from controllers.commands import execute_command
+from models.fleet import ErrorDroneNotFound
+from models.startup import ErrorStartupNotReady
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# 映像の送信とコマンドの受信を行うWebSocketのパス
+WEBSOCKET_PATH = '/api/tello/ws'
+DRONE_WEBSOCKET_PATH = '/api/tello/{drone_id}/ws'
+# 新しいフレームを待つ最大時間(秒)
+FRAME_WAIT_TIMEOUT = 1.0
+# 存在しないドローンへの接続を閉じるときのコード
+WEBSOCKET_POLICY_VIOLATION = 1008
+# ドローンの準備ができていないときのコード。画面は再接続する
+WEBSOCKET_TRY_AGAIN_LATER = 1013
+
+# MJPEGの配信 (controllers.server) とは別に数える
+WEBSOCKET_BYTES = metrics.counter('tello_websocket_bytes_total', 'JPEG bytes sent over WebSocket to each client',
+                                  ('client', ))
+WEBSOCKET_FRAMES = metrics.counter('tello_websocket_frames_total', 'JPEG frames sent over WebSocket to each client',
+                                   ('client', ))
+WEBSOCKET_SKIPPED_FRAMES = metrics.counter('tello_websocket_skipped_frames_total',
+                                           'Frames skipped because the WebSocket client was still receiving '
+                                           'an older frame', ('client', ))
+
+
+class AsyncFrameHub:
+    """
+    JpegFrameBroadcasterの新しいフレームをイベントループに渡し、全てのWebSocketの視聴者で共有する。
+    視聴者ごとにスレッドは作らず、プロデューサースレッドからの通知をイベントループで1回受け取るだけにする。
+    WebSocketの視聴者がいる間だけ、broadcasterに1人の視聴者として登録する
+    """
+
+    def __init__(self, broadcaster, loop):
+        """
+        Args:
+            broadcaster: JpegFrameBroadcaster
+            loop: 視聴者のコルーチンが動くイベントループ
+        """
+        self.broadcaster = broadcaster
+        self._loop = loop
+        self._version = 0
+        self._jpeg = None
+        self._event = asyncio.Event()
+        self.clients = 0
+
+    @property
+    def version(self):
+        return self._version
+
+    def add_client(self):
+        self.clients += 1
+        if self.clients == 1:
+            self.broadcaster.add_listener(self._on_frame)
+
+    def remove_client(self):
+        self.clients -= 1
+        if self.clients == 0:
+            self.broadcaster.remove_listener(self._on_frame)
+
+    def close(self):
+        self.clients = 0
+        self.broadcaster.remove_listener(self._on_frame)
+
+    def _on_frame(self, version, jpeg):
+        # プロデューサースレッドから呼ばれる
+        try:
+            self._loop.call_soon_threadsafe(self._publish, version, jpeg)
+        except RuntimeError:
+            # イベントループが終了している
+            self.close()
+
+    def _publish(self, version, jpeg):
+        self._version = version
+        self._jpeg = jpeg
+        # 待っている視聴者を全て起こし、以降の視聴者は新しいイベントを待つ
+        event, self._event = self._event, asyncio.Event()
+        event.set()
+
+    async def wait_next(self, last_version, timeout=None):
+        """
+        last_versionより新しいフレームが届くまで待つ
+        Returns:
+            (version, jpeg) 新しいフレームがない場合は None
+        """
+        if self._version <= last_version:
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        if self._version <= last_version:
+            return None
+        return self._version, self._jpeg
+
+
+class AsyncTelloServer:
+    """
+    ASGIのサーバー。1つのWebSocketで映像のJPEGを送り、画面からのコマンドを受け取る。
+    視聴者はコルーチンで扱うため、待機中の視聴者が多くてもスレッドは増えない。
+    WebSocket以外のルート (画面, 状態, メトリクスなど) は従来のFlaskのアプリに渡す。
+
+    メッセージ:
+        サーバー -> クライアント: バイナリは映像のJPEG、テキストはコマンドの応答
+            {"type": "ack", "id": ..., "command": ..., "status": ..., "response": ...}
+        クライアント -> サーバー: {"id": ..., "command": "up", "params": {...}}
+    """
+
+    def __init__(self, flask_app=None, drone_factory=controllers.server.get_tello_drone):
+        """
+        Args:
+            flask_app: WebSocket以外のリクエストを処理するFlaskのアプリ
+            drone_factory: ドローンの名前 (Noneは既定のドローン) からTelloDroneを返す関数
+        """
+        try:
+            from starlette.applications import Starlette
+            from starlette.middleware.wsgi import WSGIMiddleware
+            from starlette.routing import Mount
+            from starlette.routing import WebSocketRoute
+        except ImportError as ex:
+            raise ErrorAsyncServerUnavailable(f'starlette is not installed: {ex}') from ex
+
+        flask_app = flask_app or controllers.server.app
+        # 画面のJavaScriptにWebSocketを使わせる
+        flask_app.config['USE_WEBSOCKET'] = True
+        self._drone_factory = drone_factory
+        # ドローンの名前 -> AsyncFrameHub
+        self._hubs = {}
+        self.clients = 0
+        self.app = Starlette(routes=[
+            WebSocketRoute(WEBSOCKET_PATH, self.websocket_endpoint),
+            WebSocketRoute(DRONE_WEBSOCKET_PATH, self.websocket_endpoint),
+            Mount('/', app=WSGIMiddleware(flask_app)),
+        ])
+
+    def _get_hub(self, drone, loop):
+        hub = self._hubs.get(drone.drone_id)
+        if hub is None or hub.broadcaster is not drone.jpeg_broadcaster:
+            if hub is not None:
+                # 同じ名前で追加し直されたドローン
+                hub.close()
+            hub = AsyncFrameHub(drone.jpeg_broadcaster, loop)
+            self._hubs[drone.drone_id] = hub
+        return hub
+
+    async def websocket_endpoint(self, websocket):
+        loop = asyncio.get_running_loop()
+        # 起動直後はドローンの準備を待ってブロックするため、イベントループの外で取得する
+        try:
+            drone = await loop.run_in_executor(None, self._drone_factory, websocket.path_params.get('drone_id'))
+        except ErrorDroneNotFound:
+            await websocket.close(code=WEBSOCKET_POLICY_VIOLATION)
+            return
+        except ErrorStartupNotReady:
+            await websocket.close(code=WEBSOCKET_TRY_AGAIN_LATER)
+            return
+        await websocket.accept()
+        client = websocket.client.host if websocket.client else 'unknown'
+        self.clients += 1
+        hub = self._get_hub(drone, loop)
+        # 最初の視聴者で映像の受信とデコードが始まる
+        hub.add_client()
+        sender = asyncio.ensure_future(self._send_frames(websocket, hub, client))
+        try:
+            await self._receive_commands(websocket, drone, loop)
+        finally:
+            self.clients -= 1
+            sender.cancel()
+            hub.remove_client()
+
+    async def _send_frames(self, websocket, hub, client):
+        stream_bytes = WEBSOCKET_BYTES.labels(client)
+        stream_frames = WEBSOCKET_FRAMES.labels(client)
+        skipped_frames = WEBSOCKET_SKIPPED_FRAMES.labels(client)
+        last_version = 0
+        try:
+            while True:
+                latest = await hub.wait_next(last_version, FRAME_WAIT_TIMEOUT)
+                if latest is None:
+                    continue
+                version, jpeg = latest
+                if last_version:
+                    skipped_frames.inc(version - last_version - 1)
+                last_version = version
+                # 送信が終わる (送信バッファに空きができる) まで次のフレームを取りに行かない。
+                # 遅いクライアントには、その間に届いたフレームを送らずに最新のフレームだけを送る
+                await websocket.send_bytes(jpeg)
+                stream_bytes.inc(len(jpeg))
+                stream_frames.inc()
+        except asyncio.CancelledError:
+            raise
+        except Exception as ex:
+            # 切断された
+            logger.info(f'Stopped streaming to {client}: {ex}')
+
+    async def _receive_commands(self, websocket, drone, loop):
+        while True:
+            message = await websocket.receive()
+            if message['type'] == 'websocket.disconnect':
+                return
+            text = message.get('text')
+            if text is None:
+                continue
+            try:
+                request = json.loads(text)
+                command = request['command']
+            except (ValueError, KeyError, TypeError) as ex:
+                await websocket.send_text(json.dumps({'type': 'error', 'error': f'invalid command message: {ex}'}))
+                continue
+            # 時間のかかるコマンド (takeoffなど) の応答を待つ間も、次のコマンドを受け付ける
+            asyncio.ensure_future(self._execute(websocket, drone, loop, request.get('id'), command,
+                                                request.get('params') or {}))
+
+    async def _execute(self, websocket, drone, loop, command_id, command, params):
+        ack = {'type': 'ack', 'id': command_id, 'command': command}
+        try:
+            # ドローンへの送信は応答を待ってブロックするため、スレッドで実行する
+            response = await loop.run_in_executor(None, execute_command, drone, command, params)
+            ack.update(status='Success!!!', response=response)
+        except Exception as ex:
+            logger.error(f'Caught exception: {ex} at AsyncTelloServer._execute')
+            ack.update(status='Error', error=str(ex))
+        try:
+            await websocket.send_text(json.dumps(ack))
+        except Exception as ex:
+            logger.info(f'Could not acknowledge {command}: {ex}')
+
+
+def run():
+    try:
+        import uvicorn
+        server = AsyncTelloServer()
+    except (ImportError, ErrorAsyncServerUnavailable) as ex:
+        logger.warning(f'Caught exception: {ex} at async_server.run. Falling back to the Flask server')
+        controllers.server.run()
+        return
+    # websocketsの実装は送信バッファが一杯になると send を待たせるため、遅いクライアントのフレームを読み飛ばせる
+    uvicorn.run(server.app, host=settings.SERVER_ADDRESS, port=settings.SERVER_PORT, ws='websockets')
+
+
+class ErrorAsyncServerUnavailable(Exception):
+    """Error starlette or uvicorn is not installed"""
@@ -0,0 +1,59 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _set_speed(drone, params):
+    speed = params.get('speed')
+    if speed:
+        return drone.set_speed(int(speed))
+    return None
+
+
+def _enable_pose_control(drone, params):
+    logger.info('pose recognition mode start!!')
+    return drone.enable_pose_control()
+
+
+# 画面のボタンのコマンド名 -> (drone, params) を受け取りドローンを操作する関数
+COMMAND_HANDLERS = {
+    'speed': _set_speed,
+    'takeOff': lambda drone, params: drone.takeoff(),
+    'land': lambda drone, params: drone.land(),
+    'forward': lambda drone, params: drone.move_forward(),
+    'back': lambda drone, params: drone.move_backward(),
+    'up': lambda drone, params: drone.move_up(),
+    'down': lambda drone, params: drone.move_down(),
+    'right': lambda drone, params: drone.move_right(),
+    'left': lambda drone, params: drone.move_left(),
+    'clockwise': lambda drone, params: drone.rotate_clockwise(),
+    'counterClockwise': lambda drone, params: drone.rotate_counter_clockwise(),
+    'flipFront': lambda drone, params: drone.flip_forward(),
+    'flipBack': lambda drone, params: drone.flip_back(),
+    'flipRight': lambda drone, params: drone.flip_right(),
+    'flipLeft': lambda drone, params: drone.flip_left(),
+    'pose': _enable_pose_control,
+    'stopPose': lambda drone, params: drone.disable_pose_control(),
+    'startRecording': lambda drone, params: drone.start_recording(),
+    'stopRecording': lambda drone, params: drone.stop_recording(),
+    'faceDetectAndTrack': lambda drone, params: drone.enable_face_detect(),
+    'stopFaceDetectAndTrack': lambda drone, params: drone.disable_face_detect(),
+}
+
+
+def execute_command(drone, command, params):
+    """
+    画面から送られたコマンドを実行する。HTTPとWebSocketの両方から使う
+    Args:
+        drone: TelloDrone
+        command: コマンド名 (COMMAND_HANDLERSのキー)
+        params: コマンドの引数。getで値を取り出せるもの (request.form, dict)
+    Returns:
+        ドローンの応答 ('ok', 'error' など)。応答がない場合は None
+    """
+    logger.info(f'command : {command} command is called')
+    handler = COMMAND_HANDLERS.get(command)
+    if handler is None:
+        logger.warning(f'Unknown command: {command}')
+        return None
+    return handler(drone, params)
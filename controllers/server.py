@@ -1,102 +1,179 @@
-import logging
-
-import settings
-
-from models.tello_drone import TelloDrone
-
-from flask import render_template
-from flask import request
-from flask import jsonify
-from flask import Response
-
-logger = logging.getLogger(__name__)
-
-app = settings.app
-
-def get_tello_drone():
-    return TelloDrone()
-
-def video_generator():
-    drone = get_tello_drone()
-    for jpeg in drone.video_jpeg_generator():
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' +
-               jpeg +
-               b'\r\n\r\n')
-
-
-@app.route('/')
-def index():
-    return render_template('index.html')
-
-@app.route('/api/tello/video/stremeing')
-def streame_video():
-    return Response(video_generator(), mimetype='multipart/x-mixed-replace; boundary=frame')
-
-@app.route('/api/tello/command/', methods=['POST'])
-def send_command():
-    command = request.form.get('command')
-    logger.info(f'command : {command} command is called')
-    
-    drone = get_tello_drone()
-
-    if command =='speed':
-        speed = request.form.get('speed')
-        if speed:
-            drone.set_speed(int(speed))
-
-    if command == 'takeOff':
-        drone.takeoff()
-
-    if command == 'land':
-        drone.land()
-    
-    if command == 'forward':
-        drone.move_forward()
-
-    if command == 'back':
-        drone.move_backward()
-
-    if command == 'up':
-        drone.move_up()
-
-    if command == 'down':
-        drone.move_down()
-
-    if command == 'right':
-        drone.right()
-
-    if command == 'left':
-        drone.left()
-
-    if command == 'clockwise':
-        drone.rotate_clockwise()
-
-    if command == 'counterClockwise':
-        drone.rotate_counter_clockwise()
-
-    if command == 'flipFront':
-        drone.flip_forward()
-
-    if command == 'flipBack':
-        drone.flip_back()
-
-    if command == 'flipRight':
-        drone.flip_right()
-
-    if command == 'flipLeft':
-        drone.flip_left()
-
-    if command == 'pose':
-        logger.info('pose recognition mode start!!')
-
-    if command == 'faceDetectAndTrack':
-        drone.enable_face_detect()
-    if command == 'stopFaceDetectAndTrack':
-        drone.disable_face_detect()
-
-    return jsonify(status='Success!!!'), 200
-
-def run():
-    app.run(host=settings.SERVER_ADDRESS, port=settings.SERVER_PORT, threaded=True)
-
+import json
+import logging
+import time
+
+import settings
+
+from controllers.commands import execute_command
+from models.fleet import ErrorDroneNotFound
+from models.startup import ErrorStartupNotReady
+from models.startup import TelloStartup
+from models.video.stream_profiles import ADAPTIVE_PROFILE_NAME
+from models.video.stream_profiles import AdaptiveStreamProfile
+from models.video.stream_profiles import ErrorUnknownStreamProfile
+from models.video.stream_profiles import make_stream_profile
+from utils import metrics
+
+from flask import render_template
+from flask import request
+from flask import jsonify
+from flask import Response
+
+logger = logging.getLogger(__name__)
+
+app = settings.app
+
+STREAM_BYTES = metrics.counter('tello_stream_bytes_total', 'MJPEG bytes streamed to each client', ('client', ))
+STREAM_FRAMES = metrics.counter('tello_stream_frames_total', 'MJPEG frames streamed to each client', ('client', ))
+
+def get_tello_drone(drone_id=None):
+    """
+    Args:
+        drone_id: ドローンの名前。Noneの場合はフリートの最初のドローン
+    """
+    return TelloStartup().fleet().get(drone_id)
+
+def video_generator(client, drone, profile, adaptive=None):
+    stream_bytes = STREAM_BYTES.labels(client)
+    stream_frames = STREAM_FRAMES.labels(client)
+    frames = drone.jpeg_broadcaster.subscribe(profile, adaptive)
+    try:
+        for jpeg in frames:
+            chunk = (b'--frame\r\n'
+                     b'Content-Type: image/jpeg\r\n\r\n' +
+                     jpeg +
+                     b'\r\n\r\n')
+            stream_bytes.inc(len(chunk))
+            stream_frames.inc()
+            start_time = time.perf_counter()
+            # 次のフレームを要求されるまでの時間が、クライアントへの送信にかかった時間
+            yield chunk
+            if adaptive is not None and adaptive.record(time.perf_counter() - start_time):
+                logger.info(f'stream profile for {client}: {adaptive.profile.name} '
+                            f'(send utilization {adaptive.utilization:.2f})')
+    finally:
+        # 切断したらすぐに視聴者から外し、誰も見ていなければ映像の受信を止められるようにする
+        frames.close()
+
+def stream_profile_from_request():
+    """
+    ?profile=high|medium|low|minimum|auto, または ?quality=70&scale=0.5&fps=10 で配信の設定を選ぶ
+    Returns:
+        (StreamProfile, AdaptiveStreamProfile) 自動調整しない場合は後者が None
+    """
+    name = request.args.get('profile')
+    if name == ADAPTIVE_PROFILE_NAME:
+        adaptive = AdaptiveStreamProfile()
+        return adaptive.profile, adaptive
+    profile = make_stream_profile(name, quality=request.args.get('quality', type=float),
+                                  scale=request.args.get('scale', type=float),
+                                  fps=request.args.get('fps', type=float))
+    return profile, None
+
+
+@app.errorhandler(ErrorDroneNotFound)
+def drone_not_found(ex):
+    return jsonify(status='Error', error=str(ex)), 404
+
+@app.errorhandler(ErrorUnknownStreamProfile)
+def unknown_stream_profile(ex):
+    return jsonify(status='Error', error=str(ex)), 400
+
+@app.errorhandler(ErrorStartupNotReady)
+def startup_not_ready(ex):
+    # ドローンの接続がまだ終わっていない。画面はしばらくしてから再試行する
+    return jsonify(status='Error', error=str(ex)), 503, {'Retry-After': '1'}
+
+@app.route('/')
+def index():
+    # ASGIモード (controllers.async_server) では映像とコマンドをWebSocketでやり取りする
+    return render_template('index.html', use_websocket=app.config.get('USE_WEBSOCKET', False))
+
+@app.route('/api/tello/video/stremeing')
+@app.route('/api/tello/<drone_id>/video/stremeing')
+def streame_video(drone_id=None):
+    drone = get_tello_drone(drone_id)
+    profile, adaptive = stream_profile_from_request()
+    return Response(video_generator(request.remote_addr, drone, profile, adaptive),
+                    mimetype='multipart/x-mixed-replace; boundary=frame')
+
+@app.route('/api/tello/command/', methods=['POST'])
+@app.route('/api/tello/<drone_id>/command/', methods=['POST'])
+def send_command(drone_id=None):
+    command = request.form.get('command')
+    response = execute_command(get_tello_drone(drone_id), command, request.form)
+    # responseはドローンの応答 ('ok', 'error' など)。応答がない場合は None
+    return jsonify(status='Success!!!', response=response), 200
+
+@app.route('/api/tello/fleet/')
+def fleet():
+    return jsonify(TelloStartup().fleet().stats()), 200
+
+@app.route('/api/tello/fleet/command/', methods=['POST'])
+def broadcast_command():
+    command = request.form.get('command')
+    params = request.form.to_dict()
+    # 全台に並行して送信し、ドローンごとの応答を返す
+    responses = TelloStartup().fleet().broadcast(lambda drone: execute_command(drone, command, params))
+    return jsonify(status='Success!!!', responses=responses), 200
+
+@app.route('/api/tello/inference/', methods=['GET', 'POST'])
+@app.route('/api/tello/<drone_id>/inference/', methods=['GET', 'POST'])
+def inference(drone_id=None):
+    drone = get_tello_drone(drone_id)
+    if request.method == 'POST':
+        cpu_budget = request.form.get('cpuBudget', type=float)
+        latency_budget = request.form.get('latencyBudget', type=float)
+        try:
+            drone.set_inference_budget(cpu_budget, latency_budget)
+        except ValueError as ex:
+            return jsonify(status='Error', error=str(ex)), 400
+        face_detector = request.form.get('faceDetector')
+        if face_detector:
+            try:
+                drone.set_face_detector(face_detector)
+            except ValueError as ex:
+                return jsonify(status='Error', error=str(ex)), 400
+    # 推論の設定と計測した処理時間
+    return jsonify(drone.inference_stats()), 200
+
+@app.route('/api/tello/state/')
+@app.route('/api/tello/<drone_id>/state/')
+def state(drone_id=None):
+    drone = get_tello_drone(drone_id)
+    window = request.args.get('window', default=10.0, type=float)
+    return jsonify(state=drone.get_state(), stats=drone.state_stats(window),
+                   receiver=drone.state_receiver.stats()), 200
+
+def state_event_generator(drone):
+    for state in drone.state_generator():
+        if state is None:
+            # 接続を維持するためのコメント
+            yield ': keep-alive\n\n'
+            continue
+        yield f'data: {json.dumps(state)}\n\n'
+
+@app.route('/api/tello/state/stream')
+@app.route('/api/tello/<drone_id>/state/stream')
+def stream_state(drone_id=None):
+    return Response(state_event_generator(get_tello_drone(drone_id)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
+
+@app.route('/api/tello/health')
+def health():
+    # 各部分の準備の状況。全てのドローンが初期化コマンドに応答するまでは 503
+    ready, status = TelloStartup().health()
+    return jsonify(status), 200 if ready else 503
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.MetricsRegistry().to_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/metrics.json')
+def json_metrics():
+    return jsonify(metrics.MetricsRegistry().to_dict()), 200
+
+def run():
+    # リローダーはアプリを2回importし、ドローンの接続も2回行うため使わない
+    app.run(host=settings.SERVER_ADDRESS, port=settings.SERVER_PORT, threaded=True, use_reloader=False)
+
@@ -1,10 +1,19 @@
-import logging
-import sys
-
-import controllers.server
-
-logging.basicConfig(level=logging.INFO, stream=sys.stdout)
-
-
-if __name__ == '__main__':
-    controllers.server.run()
\ No newline at end of file
+import logging
+import sys
+
+import settings
+
+import controllers.async_server
+import controllers.server
+from models.startup import TelloStartup
+
+logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+
+
+if __name__ == '__main__':
+    # ドローンの接続はサーバーの起動と並行して行い、最初のページを待たせない
+    TelloStartup().start()
+    if settings.SERVER_MODE == 'asgi':
+        controllers.async_server.run()
+    else:
+        controllers.server.run()
\ No newline at end of file
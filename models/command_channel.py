@@ -0,0 +1,457 @@
+import collections
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+COMMAND_RTT_SECONDS = metrics.histogram('tello_command_rtt_seconds', 'Time from sending a command to its response',
+                                        ('command', ))
+COMMAND_RESULTS = metrics.counter('tello_commands_total', 'Commands sent to the drone by result', ('command', 'result'))
+
+DEFAULT_COMMAND_TIMEOUT = 7.0
+# コマンドの種類ごとの応答待ち時間(秒)。離着陸や移動は動作完了後に応答が返る
+COMMAND_TIMEOUTS = {
+    'command': 3.0,
+    'streamon': 3.0,
+    'streamoff': 3.0,
+    'speed': 3.0,
+    'takeoff': 20.0,
+    'land': 20.0,
+    'emergency': 3.0,
+    'flip': 10.0,
+    'cw': 10.0,
+    'ccw': 10.0,
+    'go': 15.0,
+}
+MAX_QUEUED_COMMANDS = 16
+# 移動コマンドの送信間隔の下限(秒)。Telloが処理できる以上の速さで送らない
+MIN_COMMAND_INTERVAL = 0.1
+# 他のコマンドより優先して送信し、待ち中の移動コマンドを取り消すコマンド
+SAFETY_COMMANDS = ('land', 'emergency')
+MOTION_COMMANDS = ('go', 'forward', 'back', 'up', 'down', 'left', 'right', 'cw', 'ccw', 'flip', 'curve', 'rc')
+QUEUE_POLL_INTERVAL = 0.5
+
+
+def get_command_name(command):
+    return command.split(' ', 1)[0]
+
+
+class PendingCommand:
+    """
+    送信待ち、または応答待ちのコマンド
+    """
+
+    def __init__(self, seq, command, timeout):
+        self.seq = seq
+        self.command = command
+        self.timeout = timeout
+        self.future = Future()
+        self.response = None
+        self.sent_time = None
+        self.preempted = False
+
+
+class CommandChannel:
+    """
+    Telloへのコマンド送信をCommandDispatcherのスレッドで直列に行う。
+    Telloの応答にはコマンドを識別する情報がないため、応答待ちのコマンドは常に1つだけとし、
+    受信した応答はその時点で応答待ちのコマンドにだけ紐づける。
+
+    送信順は 安全コマンド(land, emergency) > 通常のコマンド > 最新の移動目標 の優先度で決める。
+    移動目標(submit_motion)は最新の1つだけを保持し、古いものは送信せずに破棄する。
+    """
+
+    def __init__(self, sock, drone_address, timeouts=None, max_queued=MAX_QUEUED_COMMANDS,
+                 min_command_interval=MIN_COMMAND_INTERVAL, on_sent=None, dispatcher=None):
+        """
+        Args:
+            sock: コマンド送信用のUDPソケット
+            drone_address: ドローンの (ip, port)
+            timeouts: コマンド名ごとの応答待ち時間(秒)の辞書
+            max_queued: 送信待ちにできるコマンドの最大数
+            min_command_interval: 安全コマンド以外の送信間隔の下限(秒)
+            on_sent: コマンドを送信するたびにコマンド文字列で呼び出す関数
+            dispatcher: 送信と応答待ちを進めるCommandDispatcher。複数台で共有する場合に指定する。
+                Noneの場合はこのチャンネル専用のものを使う
+        """
+        self.sock = sock
+        self.drone_address = drone_address
+        self.timeouts = dict(COMMAND_TIMEOUTS if timeouts is None else timeouts)
+        self.max_queued = max_queued
+        self.min_command_interval = min_command_interval
+        self.on_sent = on_sent
+
+        self._condition = threading.Condition()
+        self._safety_commands = collections.deque()
+        self._commands = collections.deque()
+        self._latest_motion = None
+        self._in_flight = None
+        # 取り消したコマンドへの応答はまだ届いていないため、次に届く応答はそのコマンドのもの
+        self._stale_responses = 0
+        self._last_sent_time = 0.0
+        self._seq = itertools.count(1)
+
+        self.stop_flag = threading.Event()
+        self._owns_dispatcher = dispatcher is None
+        self.dispatcher = CommandDispatcher() if dispatcher is None else dispatcher
+
+        self.metrics = {
+            'issued': 0,
+            'coalesced': 0,
+            'dropped': 0,
+            'preempted': 0,
+            'acknowledged': 0,
+            'timeouts': 0,
+            'late_responses': 0,
+            'unacknowledged_sent': 0,
+            'unacknowledged_suppressed': 0,
+        }
+
+    def start(self):
+        self.dispatcher.add(self)
+
+    def stop(self):
+        self.stop_flag.set()
+        with self._condition:
+            pendings = list(self._safety_commands) + list(self._commands)
+            if self._latest_motion is not None:
+                pendings.append(self._latest_motion)
+            self._safety_commands.clear()
+            self._commands.clear()
+            self._latest_motion = None
+            in_flight = self._in_flight
+            self._in_flight = None
+        for pending in pendings:
+            pending.future.cancel()
+        if in_flight is not None:
+            self._finish(in_flight)
+        self.dispatcher.remove(self)
+        if self._owns_dispatcher:
+            self.dispatcher.stop()
+
+    def get_timeout(self, command):
+        return self.timeouts.get(get_command_name(command), DEFAULT_COMMAND_TIMEOUT)
+
+    def get_metrics(self):
+        with self._condition:
+            metrics = dict(self.metrics)
+            metrics['queued'] = len(self._safety_commands) + len(self._commands)
+        return metrics
+
+    def _new_pending(self, command, timeout):
+        if timeout is None:
+            timeout = self.get_timeout(command)
+        return PendingCommand(next(self._seq), command, timeout)
+
+    def submit(self, command, timeout=None):
+        """
+        コマンドを送信待ちキューに入れる。安全コマンドは待ち中の移動コマンドを取り消して最優先で送信する
+        Args:
+            command: コマンド文字列
+            timeout: 応答待ち時間(秒)。Noneの場合はコマンドの種類ごとの値を使う
+        Returns:
+            応答文字列を結果に持つFuture
+        """
+        pending = self._new_pending(command, timeout)
+        if self.stop_flag.is_set():
+            pending.future.set_exception(ErrorCommandChannelClosed('command channel is stopped'))
+            return pending.future
+
+        rejected = []
+        with self._condition:
+            if get_command_name(command) in SAFETY_COMMANDS:
+                rejected = self._preempt_motions()
+                self._safety_commands.append(pending)
+            elif len(self._commands) >= self.max_queued:
+                self.metrics['dropped'] += 1
+                rejected = [(pending, ErrorCommandQueueFull(f'command queue is full. {command} is rejected'))]
+            else:
+                self._commands.append(pending)
+        self.dispatcher.wake()
+
+        for rejected_pending, ex in rejected:
+            rejected_pending.future.set_exception(ex)
+        return pending.future
+
+    def submit_motion(self, command, timeout=None):
+        """
+        移動目標を送信する。送信前に新しい移動目標が来た場合は古いものを送信せずに破棄する
+        Args:
+            command: 移動コマンド文字列 (go, rc など)
+            timeout: 応答待ち時間(秒)
+        Returns:
+            応答文字列を結果に持つFuture
+        """
+        pending = self._new_pending(command, timeout)
+        if self.stop_flag.is_set():
+            pending.future.set_exception(ErrorCommandChannelClosed('command channel is stopped'))
+            return pending.future
+
+        with self._condition:
+            superseded = self._latest_motion
+            self._latest_motion = pending
+            if superseded is not None:
+                self.metrics['coalesced'] += 1
+        self.dispatcher.wake()
+
+        if superseded is not None:
+            superseded.future.set_exception(ErrorCommandSuperseded(f'{superseded.command} is superseded by {command}'))
+        return pending.future
+
+    def send_unacknowledged(self, command):
+        """
+        応答のないコマンド(rc)をキューを通さずにすぐ送信する。
+        安全コマンドの送信待ち、または応答待ちの間は送信しない
+        Args:
+            command: コマンド文字列
+        Returns:
+            送信した場合はTrue
+        """
+        with self._condition:
+            in_flight = self._in_flight
+            if self._safety_commands or (
+                    in_flight is not None and get_command_name(in_flight.command) in SAFETY_COMMANDS):
+                self.metrics['unacknowledged_suppressed'] += 1
+                return False
+            self.metrics['unacknowledged_sent'] += 1
+        self.sock.sendto(command.encode('utf-8'), self.drone_address)
+        if self.on_sent is not None:
+            self.on_sent(command)
+        return True
+
+    def _preempt_motions(self):
+        """
+        待ち中の移動コマンドと応答待ちの移動コマンドを取り消す。self._conditionを取得して呼び出すこと
+        Returns:
+            (PendingCommand, 例外) のリスト
+        """
+        preempted = [pending for pending in self._commands if get_command_name(pending.command) in MOTION_COMMANDS]
+        if self._latest_motion is not None:
+            preempted.append(self._latest_motion)
+            self._latest_motion = None
+        self._commands = collections.deque(
+            pending for pending in self._commands if get_command_name(pending.command) not in MOTION_COMMANDS)
+
+        in_flight = self._in_flight
+        if in_flight is not None and get_command_name(in_flight.command) in MOTION_COMMANDS:
+            # 応答待ちをやめて、すぐに安全コマンドを送信する
+            in_flight.preempted = True
+
+        self.metrics['preempted'] += len(preempted)
+        return [(pending, ErrorCommandPreempted(f'{pending.command} is preempted')) for pending in preempted]
+
+    def handle_response(self, response):
+        """
+        受信スレッドから呼び出し、応答待ちのコマンドへ応答を渡す
+        Args:
+            response: 受信したバイト列
+        """
+        with self._condition:
+            if self._stale_responses > 0:
+                self._stale_responses -= 1
+                self.metrics['late_responses'] += 1
+                logger.info(f'discard response for preempted command: {response}')
+                return
+            pending = self._in_flight
+            if pending is None or pending.response is not None:
+                # タイムアウトしたコマンドへの遅れた応答は破棄する
+                self.metrics['late_responses'] += 1
+                logger.warning(f'discard unexpected response: {response}')
+                return
+            pending.response = response.decode('utf-8', errors='replace').strip()
+            self.metrics['acknowledged'] += 1
+        self.dispatcher.wake()
+
+    def _next_command(self):
+        """
+        次に送信するコマンドを取り出す。self._conditionを取得して呼び出すこと
+        Returns:
+            (PendingCommand, 送信可能になるまでの秒数)
+        """
+        if self._safety_commands:
+            return self._safety_commands.popleft(), 0.0
+
+        wait = self._last_sent_time + self.min_command_interval - time.perf_counter()
+        if self._commands:
+            return (self._commands.popleft(), 0.0) if wait <= 0 else (None, wait)
+        if self._latest_motion is not None:
+            if wait > 0:
+                return None, wait
+            pending = self._latest_motion
+            self._latest_motion = None
+            return pending, 0.0
+        return None, QUEUE_POLL_INTERVAL
+
+    def step(self):
+        """
+        応答待ちのコマンドの結果を確定し、送信できるコマンドがあれば送信する。
+        CommandDispatcherのスレッドから呼び出す
+        Returns:
+            次に呼び出すまでの最大の待ち時間(秒)
+        """
+        with self._condition:
+            pending = self._in_flight
+            if pending is not None:
+                remaining = pending.sent_time + pending.timeout - time.perf_counter()
+                if pending.response is None and not pending.preempted and remaining > 0:
+                    return remaining
+                self._in_flight = None
+        if pending is not None:
+            self._finish(pending)
+
+        while not self.stop_flag.is_set():
+            with self._condition:
+                pending, wait = self._next_command()
+            if pending is None:
+                return wait
+            if not pending.future.set_running_or_notify_cancel():
+                continue
+            if self._send(pending):
+                return pending.timeout
+        return QUEUE_POLL_INTERVAL
+
+    def _send(self, pending):
+        """
+        Returns:
+            送信して応答待ちになった場合はTrue
+        """
+        logger.info(f'send_command: {pending.command}')
+        with self._condition:
+            self._in_flight = pending
+            pending.sent_time = time.perf_counter()
+            self._last_sent_time = pending.sent_time
+        try:
+            self.sock.sendto(pending.command.encode('utf-8'), self.drone_address)
+        except OSError as ex:
+            with self._condition:
+                self._in_flight = None
+            pending.future.set_exception(ex)
+            COMMAND_RESULTS.labels(get_command_name(pending.command), 'send_error').inc()
+            return False
+        with self._condition:
+            self.metrics['issued'] += 1
+        if self.on_sent is not None:
+            self.on_sent(pending.command)
+        return True
+
+    def _finish(self, pending):
+        """
+        応答待ちを終えたコマンドのFutureに結果を設定する。self._in_flightから外してから呼び出すこと
+        """
+        with self._condition:
+            response = pending.response
+            if response is None and pending.preempted:
+                self.metrics['preempted'] += 1
+                self._stale_responses += 1
+            elif response is None:
+                self.metrics['timeouts'] += 1
+
+        command_name = get_command_name(pending.command)
+        if response is not None:
+            round_trip_time = time.perf_counter() - pending.sent_time
+            COMMAND_RTT_SECONDS.labels(command_name).observe(round_trip_time)
+            COMMAND_RESULTS.labels(command_name, 'response').inc()
+            logger.info(f'receive response: {response} for {pending.command} in {round_trip_time:.3f} seconds')
+            pending.future.set_result(response)
+        elif pending.preempted:
+            COMMAND_RESULTS.labels(command_name, 'preempted').inc()
+            pending.future.set_exception(ErrorCommandPreempted(f'{pending.command} is preempted'))
+        elif self.stop_flag.is_set():
+            COMMAND_RESULTS.labels(command_name, 'closed').inc()
+            pending.future.set_exception(ErrorCommandChannelClosed(f'{pending.command} is cancelled by stop'))
+        else:
+            COMMAND_RESULTS.labels(command_name, 'timeout').inc()
+            pending.future.set_exception(
+                ErrorCommandTimeout(f'{pending.command} is timed out after {pending.timeout} seconds'))
+
+
+class CommandDispatcher:
+    """
+    複数のCommandChannelの送信と応答待ちを1つのスレッドで進める。
+    応答待ちの間はスレッドを止めずに他のチャンネルを進めるため、台数が増えてもスレッドは増えない
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._channels = []
+        self._woken = False
+        self.stop_flag = threading.Event()
+        self._thread = None
+
+    def add(self, channel):
+        with self._condition:
+            if channel not in self._channels:
+                self._channels.append(channel)
+            if self._thread is None:
+                self.stop_flag.clear()
+                self._thread = threading.Thread(target=self._run, args=(self.stop_flag, ), daemon=True)
+                self._thread.start()
+            self._woken = True
+            self._condition.notify_all()
+
+    def remove(self, channel):
+        with self._condition:
+            if channel in self._channels:
+                self._channels.remove(channel)
+
+    def wake(self):
+        """
+        送信待ちのコマンドや応答が届いたことを知らせる
+        """
+        with self._condition:
+            self._woken = True
+            self._condition.notify_all()
+
+    def stop(self):
+        self.stop_flag.set()
+        self.wake()
+        with self._condition:
+            thread = self._thread
+            self._thread = None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=2.0)
+
+    def _run(self, stop_flag):
+        while not stop_flag.is_set():
+            with self._condition:
+                channels = list(self._channels)
+                self._woken = False
+            wait = QUEUE_POLL_INTERVAL
+            for channel in channels:
+                try:
+                    wait = min(wait, channel.step())
+                except Exception as ex:
+                    logger.error(f'Caught exception: {ex} at CommandDispatcher._run')
+            with self._condition:
+                # 各チャンネルを進めている間に届いた通知は待たずに処理する
+                if not self._woken and wait > 0:
+                    self._condition.wait(wait)
+
+
+class ErrorCommand(Exception):
+    """Error command is not answered by the drone"""
+
+
+class ErrorCommandTimeout(ErrorCommand):
+    """Error drone did not respond to the command in time"""
+
+
+class ErrorCommandQueueFull(ErrorCommand):
+    """Error too many commands are waiting to be sent"""
+
+
+class ErrorCommandSuperseded(ErrorCommand):
+    """Error motion command is replaced by a newer one before it is sent"""
+
+
+class ErrorCommandPreempted(ErrorCommand):
+    """Error motion command is cancelled by a safety command"""
+
+
+class ErrorCommandChannelClosed(ErrorCommand):
+    """Error command channel is already stopped"""
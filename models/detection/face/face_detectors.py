@@ -0,0 +1,263 @@
+import logging
+import os
+
+import cv2
+import numpy as np
+
+import settings
+
+from models.pose.person_pose import EAR_LEFT
+from models.pose.person_pose import EAR_RIGHT
+from models.pose.person_pose import EYE_LEFT
+from models.pose.person_pose import EYE_RIGHT
+from models.pose.person_pose import NOSE
+
+logger = logging.getLogger(__name__)
+
+HAAR_CASCADE_FILE = os.path.join(settings.PROJECT_ROOT, 'models', 'detection', 'face',
+                                 'haarcascade_frontalface_default.xml')
+DEFAULT_SCALE_FACTOR = 1.3
+DEFAULT_MIN_NEIGHBORS = 5
+# YuNetの顔らしさの下限と、重なった検出をまとめるIoUの閾値
+YUNET_SCORE_THRESHOLD = 0.6
+YUNET_NMS_THRESHOLD = 0.3
+# OpenCVのサンプルのSSD顔検出モデル (res10_300x300) の入力
+SSD_INPUT_SIZE = (300, 300)
+SSD_MEAN = (104.0, 177.0, 123.0)
+SSD_SCORE_THRESHOLD = 0.5
+# 顔の骨格点 (鼻・目・耳) の信頼度の下限
+MOVENET_KEYPOINT_THRESHOLD = 0.3
+# 両目の間隔に対する顔の幅
+EYE_DISTANCE_TO_FACE_WIDTH = 2.5
+# 顔の幅に対する高さ
+FACE_ASPECT_RATIO = 1.25
+FACE_KEYPOINTS = (NOSE, EYE_LEFT, EYE_RIGHT, EAR_LEFT, EAR_RIGHT)
+
+
+def to_boxes(boxes, width, height):
+    """
+    検出結果を画像内に収めた整数の (x, y, w, h) のリストにする
+    Args:
+        boxes: (N, 4) の [x, y, w, h]
+        width, height: 画像の大きさ
+    """
+    result = []
+    for x, y, w, h in boxes:
+        x1, y1 = max(0, int(x)), max(0, int(y))
+        x2, y2 = min(width, int(x + w)), min(height, int(y + h))
+        if x2 > x1 and y2 > y1:
+            result.append((x1, y1, x2 - x1, y2 - y1))
+    return result
+
+
+class FaceDetector:
+    """
+    顔検出器の基底クラス
+    """
+    name = None
+    # Trueの場合はBGRの画像、Falseの場合はグレースケールの画像を渡す
+    uses_color = False
+
+    def detect(self, image):
+        """
+        Args:
+            image: uses_colorに合わせたBGR (H, W, 3) またはグレースケール (H, W) の画像
+        Returns:
+            顔の (x, y, w, h) のリスト
+        """
+        raise NotImplementedError
+
+    def configure(self, inference_settings):
+        """
+        InferenceSchedulerの設定を反映する。負荷に応じて変えられる設定のない検出器は何もしない
+        """
+
+    def close(self):
+        """
+        モデルなどの資源を解放する
+        """
+
+
+class HaarCascadeFaceDetector(FaceDetector):
+    """
+    OpenCVのHaarカスケードによる検出器。正面の顔に限られるが、追加のモデルなしで使える
+    """
+    name = 'haar'
+
+    def __init__(self, cascade_file=HAAR_CASCADE_FILE):
+        if not os.path.exists(cascade_file):
+            raise ErrorFaceDetectorUnavailable(f'{cascade_file} is not exists')
+        if not hasattr(cv2, 'CascadeClassifier'):
+            raise ErrorFaceDetectorUnavailable(f'cv2.CascadeClassifier is not available in OpenCV {cv2.__version__}')
+        self.cascade = cv2.CascadeClassifier(cascade_file)
+        self.scale_factor = DEFAULT_SCALE_FACTOR
+        self.min_neighbors = DEFAULT_MIN_NEIGHBORS
+
+    def configure(self, inference_settings):
+        self.scale_factor = inference_settings.scale_factor
+        self.min_neighbors = inference_settings.min_neighbors
+
+    def detect(self, image):
+        faces = self.cascade.detectMultiScale(image, self.scale_factor, self.min_neighbors)
+        return [(int(x), int(y), int(w), int(h)) for x, y, w, h in faces]
+
+
+class YuNetFaceDetector(FaceDetector):
+    """
+    OpenCV DNNのYuNet (cv2.FaceDetectorYN) による検出器。横顔や小さい顔も検出できる
+    """
+    name = 'yunet'
+    uses_color = True
+
+    def __init__(self, model_file=None, score_threshold=YUNET_SCORE_THRESHOLD, nms_threshold=YUNET_NMS_THRESHOLD):
+        model_file = model_file or settings.FACE_YUNET_MODEL_FILE
+        if not os.path.exists(model_file):
+            raise ErrorFaceDetectorUnavailable(f'{model_file} is not exists')
+        if not hasattr(cv2, 'FaceDetectorYN'):
+            raise ErrorFaceDetectorUnavailable('cv2.FaceDetectorYN requires OpenCV 4.5.4 or later')
+        try:
+            # 入力の大きさは画像ごとに合わせる
+            self._detector = cv2.FaceDetectorYN.create(model_file, '', (0, 0), score_threshold, nms_threshold)
+        except cv2.error as ex:
+            raise ErrorFaceDetectorUnavailable(f'could not load {model_file}: {ex}')
+        self._input_size = None
+
+    def detect(self, image):
+        height, width = image.shape[:2]
+        if self._input_size != (width, height):
+            self._detector.setInputSize((width, height))
+            self._input_size = (width, height)
+        _, faces = self._detector.detect(image)
+        if faces is None:
+            return []
+        # 1行は [x, y, w, h, 目・鼻・口の5点の座標, score]
+        return to_boxes(faces[:, :4], width, height)
+
+
+class SsdFaceDetector(FaceDetector):
+    """
+    OpenCV DNNのSSD (res10_300x300) による検出器。
+    Caffe (.caffemodel + .prototxt) またはTensorFlow (.pb + .pbtxt) のモデルを使う
+    """
+    name = 'ssd'
+    uses_color = True
+
+    def __init__(self, model_file=None, config_file=None, score_threshold=SSD_SCORE_THRESHOLD):
+        model_file = model_file or settings.FACE_SSD_MODEL_FILE
+        config_file = config_file or settings.FACE_SSD_CONFIG_FILE
+        for path in (model_file, config_file):
+            if not os.path.exists(path):
+                raise ErrorFaceDetectorUnavailable(f'{path} is not exists')
+        try:
+            self._net = cv2.dnn.readNet(model_file, config_file)
+        except cv2.error as ex:
+            raise ErrorFaceDetectorUnavailable(f'could not load {model_file}: {ex}')
+        self.score_threshold = score_threshold
+
+    def detect(self, image):
+        height, width = image.shape[:2]
+        blob = cv2.dnn.blobFromImage(image, 1.0, SSD_INPUT_SIZE, SSD_MEAN, swapRB=False, crop=False)
+        self._net.setInput(blob)
+        # 1行は [image_id, label, score, x1, y1, x2, y2] (正規化座標)
+        detections = self._net.forward().reshape(-1, 7)
+        detections = detections[detections[:, 2] > self.score_threshold]
+        boxes = detections[:, 3:7] * (width, height, width, height)
+        boxes[:, 2:] -= boxes[:, :2]
+        return to_boxes(boxes, width, height)
+
+
+def face_box_from_pose(pose):
+    """
+    鼻・目・耳の骨格点から顔の矩形を見積もる
+    Args:
+        pose: 画像座標のPersonPose
+    Returns:
+        (x, y, w, h)。顔の骨格点が2つ未満の場合は None
+    """
+    valid = pose.valid[list(FACE_KEYPOINTS)]
+    if np.count_nonzero(valid) < 2:
+        return None
+    points = pose.xy[list(FACE_KEYPOINTS)][valid]
+    width = np.ptp(points[:, 0])
+    if pose.is_valid(EYE_LEFT, EYE_RIGHT):
+        # 正面を向いている場合は、両目の間隔の方が顔の幅をよく表す
+        eye_distance = np.linalg.norm(pose.xy[EYE_LEFT] - pose.xy[EYE_RIGHT])
+        width = max(width, eye_distance * EYE_DISTANCE_TO_FACE_WIDTH)
+    if width <= 0:
+        return None
+    center_x, center_y = pose.xy[NOSE] if pose.is_valid(NOSE) else points.mean(axis=0)
+    height = width * FACE_ASPECT_RATIO
+    return center_x - width / 2, center_y - height / 2, width, height
+
+
+class MoveNetFaceDetector(FaceDetector):
+    """
+    姿勢認識と同じMoveNetの骨格点から顔の位置を見積もる検出器。
+    後ろ向きや遠くの人でも頭の位置を追えるが、矩形は顔の骨格点からの推定になる
+    """
+    name = 'movenet'
+    uses_color = True
+
+    def __init__(self, keypoint_threshold=MOVENET_KEYPOINT_THRESHOLD):
+        # TensorFlowは使うときだけ読み込む
+        from models.detection.person_keypoints import tflite_models
+        from models.detection.person_keypoints.model_registry import ErrorTFLiteUnavailable
+
+        if settings.PERSON_KEYPOINTS_MODEL_TYPE == 'multipose':
+            model_file = settings.MULTI_PERSON_KEYPOINTS_MODEL_FILE
+            create_predictor = tflite_models.get_multi_person_kp_predictor
+        else:
+            model_file = settings.PERSON_KEYPOINTS_MODEL_FILE
+            create_predictor = tflite_models.get_person_kp_predictor
+        if not os.path.exists(model_file):
+            raise ErrorFaceDetectorUnavailable(f'{model_file} is not exists')
+        try:
+            self._predictor = create_predictor(model_file)
+        except ErrorTFLiteUnavailable as ex:
+            raise ErrorFaceDetectorUnavailable(str(ex))
+        self._release_predictor = tflite_models.release_predictor
+        self.keypoint_threshold = keypoint_threshold
+
+    def detect(self, image):
+        height, width = image.shape[:2]
+        self._predictor.preprocess(image)
+        self._predictor.interpreter.invoke()
+        boxes = [face_box_from_pose(pose) for pose, _ in self._predictor.get_persons(self.keypoint_threshold)]
+        return to_boxes([box for box in boxes if box is not None], width, height)
+
+    def close(self):
+        if self._predictor is not None:
+            self._release_predictor(self._predictor)
+            self._predictor = None
+
+
+FACE_DETECTORS = {
+    HaarCascadeFaceDetector.name: HaarCascadeFaceDetector,
+    YuNetFaceDetector.name: YuNetFaceDetector,
+    SsdFaceDetector.name: SsdFaceDetector,
+    MoveNetFaceDetector.name: MoveNetFaceDetector,
+}
+
+
+def create_face_detector(name):
+    """
+    顔検出器を生成する。指定の検出器が使えない場合はHaarカスケードにフォールバックする
+    Args:
+        name: 検出器名 ('haar', 'yunet', 'ssd' または 'movenet')
+    """
+    detector_class = FACE_DETECTORS.get(name)
+    if detector_class is None:
+        raise ValueError(f'unknown face detector: {name}')
+    try:
+        detector = detector_class()
+    except ErrorFaceDetectorUnavailable as ex:
+        if detector_class is HaarCascadeFaceDetector:
+            raise
+        logger.warning(f'{ex}. fall back to {HaarCascadeFaceDetector.name}')
+        detector = HaarCascadeFaceDetector()
+    logger.info(f'face detector: {detector.name}')
+    return detector
+
+
+class ErrorFaceDetectorUnavailable(Exception):
+    """Error face detector model or backend is not available"""
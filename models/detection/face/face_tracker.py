@@ -0,0 +1,298 @@
+import logging
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+DETECTION_SECONDS = metrics.histogram('tello_detection_seconds', 'Time to run detection on one frame', ('stage', ))
+
+# 全体検出を行う間隔(秒)。間のフレームはテンプレートマッチングで追跡する
+DEFAULT_DETECT_INTERVAL = 0.2
+# 前回の顔の周りを検出する範囲 (顔の大きさに対する余白の割合)
+DEFAULT_ROI_MARGIN = 1.0
+# 追跡時に探索する範囲 (顔の大きさに対する余白の割合)
+DEFAULT_SEARCH_MARGIN = 0.5
+# 顔を見失った場合の全画面検出の縮小率
+DEFAULT_FULL_FRAME_SCALE = 0.5
+# テンプレートマッチングで同じ顔とみなす類似度の下限
+DEFAULT_MATCH_THRESHOLD = 0.6
+FRAME_WAIT_TIMEOUT = 1.0
+
+
+class FaceTrack:
+    """
+    顔の検出・追跡結果
+    """
+    __slots__ = ('box', 'seq', 'timestamp', 'source')
+
+    def __init__(self, box, seq, timestamp, source):
+        """
+        Args:
+            box: 顔の (x, y, w, h)
+            seq: 検出に使ったフレームのシーケンス番号
+            timestamp: 検出した時刻 (time.perf_counter)
+            source: 'detect' (顔検出器) または 'track' (テンプレートマッチング)
+        """
+        self.box = box
+        self.seq = seq
+        self.timestamp = timestamp
+        self.source = source
+
+
+def expand_box(box, margin, frame_width, frame_height):
+    """
+    矩形を顔の大きさ×marginだけ広げ、画面内に収める
+    Returns:
+        (x1, y1, x2, y2)
+    """
+    x, y, w, h = box
+    dx, dy = int(w * margin), int(h * margin)
+    return max(0, x - dx), max(0, y - dy), min(frame_width, x + w + dx), min(frame_height, y + h + dy)
+
+
+class FaceDetectionWorker:
+    """
+    最新フレームに対して専用スレッドで顔検出を行い、結果だけを公開する。
+    検出は前回の顔の周辺に限定し、見失った場合だけ縮小した全画面を探索する。
+    検出と検出の間はテンプレートマッチングで顔の位置を追跡する。
+    """
+
+    def __init__(self, frame_ring, detector, on_face=None, detect_interval=DEFAULT_DETECT_INTERVAL,
+                 roi_margin=DEFAULT_ROI_MARGIN, search_margin=DEFAULT_SEARCH_MARGIN,
+                 full_frame_scale=DEFAULT_FULL_FRAME_SCALE, match_threshold=DEFAULT_MATCH_THRESHOLD, scheduler=None):
+        """
+        Args:
+            frame_ring: 入力フレームのFrameRing
+            detector: FaceDetector。Noneの場合はstartの前にset_detectorで設定する
+            on_face: 顔が見つかるたびに (box, timestamp) で呼び出す関数
+            detect_interval: 顔検出器で検出を行う間隔(秒)
+            roi_margin: 前回の顔の周辺を検出する範囲
+            search_margin: テンプレートマッチングの探索範囲
+            full_frame_scale: 全画面検出の縮小率
+            match_threshold: テンプレートマッチングの類似度の下限
+            scheduler: InferenceScheduler。指定した場合は処理するフレームの間隔と検出の設定を負荷に合わせて変える
+        """
+        self.frame_ring = frame_ring
+        self.detector = detector
+        self.on_face = on_face
+        self.detect_interval = detect_interval
+        self.roi_margin = roi_margin
+        self.search_margin = search_margin
+        self.full_frame_scale = full_frame_scale
+        self.match_threshold = match_threshold
+        self.scheduler = scheduler
+
+        frame_height, frame_width, _ = frame_ring.writable_buffer().shape
+        self.frame_width = frame_width
+        self.frame_height = frame_height
+        self._gray = np.empty((frame_height, frame_width), dtype=np.uint8)
+        # カラー画像を使う検出器に渡すフレームのコピー。リングのスロットは検出中に再利用されることがある
+        self._color = np.empty((frame_height, frame_width, 3), dtype=np.uint8)
+        self._small_image = None
+        self._template = None
+        self._last_detect_time = 0.0
+
+        self._lock = threading.Lock()
+        # 検出器の切り替えは処理中のフレームが終わるのを待つ
+        self._process_lock = threading.Lock()
+        self._latest_track = None
+        self._stop_flag = threading.Event()
+        self._thread = None
+
+        self.detections = 0
+        # 読み出し中に書き込み側がスロットを再利用したため処理しなかったフレーム数
+        self.overwritten_frames = 0
+        self.tracked_frames = 0
+        self.lost_count = 0
+        self.last_detect_latency = 0.0
+        self.last_track_latency = 0.0
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.is_running:
+            return
+        self._stop_flag.clear()
+        if self.scheduler is not None:
+            self.scheduler.reset_window()
+        self._thread = threading.Thread(target=self._run, args=(self._stop_flag, ), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_flag.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+        with self._lock:
+            self._latest_track = None
+        self._template = None
+
+    def set_detector(self, detector):
+        """
+        顔検出器を切り替える。前の検出器は閉じる
+        """
+        with self._process_lock:
+            previous, self.detector = self.detector, detector
+            if self.scheduler is not None:
+                detector.configure(self.scheduler.settings)
+        if previous is not None and previous is not detector:
+            previous.close()
+
+    def latest_track(self):
+        """
+        Returns:
+            最新のFaceTrack。顔が見つかっていない場合は None
+        """
+        with self._lock:
+            return self._latest_track
+
+    def _apply_schedule(self):
+        settings = self.scheduler.settings
+        self.full_frame_scale = settings.downscale
+        self.detector.configure(settings)
+
+    def _run(self, stop_flag):
+        seq = 0
+        processed_seq = 0
+        detection_seconds = DETECTION_SECONDS.labels('face')
+        while not stop_flag.is_set():
+            latest = self.frame_ring.wait_next(seq, timeout=FRAME_WAIT_TIMEOUT)
+            if latest is None:
+                continue
+            seq, frame = latest
+            if self.scheduler is not None:
+                if not self.scheduler.should_process(seq, processed_seq):
+                    continue
+                self._apply_schedule()
+            processed_seq = seq
+            elapsed = self.process_frame(seq, frame)
+            detection_seconds.observe(elapsed)
+            if self.scheduler is not None:
+                self.scheduler.record('face', elapsed)
+
+    def process_frame(self, seq, frame):
+        """
+        1フレームの顔検出・追跡を行う。記録の再生ではスレッドを使わずに直接呼び出す
+        Returns:
+            処理時間(秒)
+        """
+        start_time = time.perf_counter()
+        with self._process_lock:
+            # 検出・追跡はコピーしたフレームに対して行う
+            if self.detector is not None and self.detector.uses_color:
+                np.copyto(self._color, frame)
+                cv2.cvtColor(self._color, cv2.COLOR_BGR2GRAY, dst=self._gray)
+            else:
+                cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self._gray)
+            if self.frame_ring.is_overwritten(seq):
+                self.overwritten_frames += 1
+                return time.perf_counter() - start_time
+            try:
+                self._process(seq)
+            except cv2.error as ex:
+                logger.error(f'Caught exception: {ex} at FaceDetectionWorker._run')
+        return time.perf_counter() - start_time
+
+    def _process(self, seq):
+        start_time = time.perf_counter()
+        previous = self.latest_track()
+        box = None
+        source = 'detect'
+
+        if self._template is not None and previous is not None and \
+                start_time - self._last_detect_time < self.detect_interval:
+            box = self._track(previous.box)
+            if box is not None:
+                source = 'track'
+                self.tracked_frames += 1
+                self.last_track_latency = time.perf_counter() - start_time
+
+        if box is None:
+            if previous is not None:
+                box = self._detect_in_roi(previous.box)
+            if box is None:
+                box = self._detect_full_frame()
+            self._last_detect_time = start_time
+            self.last_detect_latency = time.perf_counter() - start_time
+            if box is None:
+                if previous is not None:
+                    self.lost_count += 1
+                self._template = None
+                with self._lock:
+                    self._latest_track = None
+                return
+            self.detections += 1
+            x, y, w, h = box
+            self._template = self._gray[y:y + h, x:x + w].copy()
+
+        timestamp = time.perf_counter()
+        with self._lock:
+            self._latest_track = FaceTrack(box, seq, timestamp, source)
+        if self.on_face is not None:
+            self.on_face(box, timestamp)
+
+    def _detector_image(self):
+        # 検出器に合わせて、カラーのフレームかグレースケールを使う
+        return self._color if self.detector.uses_color else self._gray
+
+    def _detect(self, image):
+        faces = self.detector.detect(image)
+        if len(faces) == 0:
+            return None
+        # 一番大きい顔を追跡対象とする
+        x, y, w, h = max(faces, key=lambda face: face[2] * face[3])
+        return int(x), int(y), int(w), int(h)
+
+    def _detect_in_roi(self, box):
+        x1, y1, x2, y2 = expand_box(box, self.roi_margin, self.frame_width, self.frame_height)
+        face = self._detect(self._detector_image()[y1:y2, x1:x2])
+        if face is None:
+            return None
+        x, y, w, h = face
+        return x + x1, y + y1, w, h
+
+    def _detect_full_frame(self):
+        scale = self.full_frame_scale
+        image = self._detector_image()
+        if scale >= 1.0:
+            return self._detect(image)
+        small_size = (int(self.frame_width * scale), int(self.frame_height * scale))
+        small_shape = small_size[::-1] + image.shape[2:]
+        if self._small_image is None or self._small_image.shape != small_shape:
+            self._small_image = np.empty(small_shape, dtype=np.uint8)
+        cv2.resize(image, small_size, dst=self._small_image, interpolation=cv2.INTER_AREA)
+        face = self._detect(self._small_image)
+        if face is None:
+            return None
+        x, y, w, h = (int(round(value / scale)) for value in face)
+        # 縮小前の座標に戻したときに画面からはみ出さないようにする
+        return x, y, min(w, self.frame_width - x), min(h, self.frame_height - y)
+
+    def _track(self, box):
+        template_height, template_width = self._template.shape
+        x1, y1, x2, y2 = expand_box(box, self.search_margin, self.frame_width, self.frame_height)
+        if x2 - x1 < template_width or y2 - y1 < template_height:
+            return None
+        result = cv2.matchTemplate(self._gray[y1:y2, x1:x2], self._template, cv2.TM_CCOEFF_NORMED)
+        _, max_value, _, max_location = cv2.minMaxLoc(result)
+        if max_value < self.match_threshold:
+            return None
+        return x1 + max_location[0], y1 + max_location[1], template_width, template_height
+
+    def stats(self):
+        return {
+            'detector': None if self.detector is None else self.detector.name,
+            'detections': self.detections,
+            'overwritten_frames': self.overwritten_frames,
+            'tracked_frames': self.tracked_frames,
+            'lost_count': self.lost_count,
+            'last_detect_latency': self.last_detect_latency,
+            'last_track_latency': self.last_track_latency,
+        }
@@ -0,0 +1,172 @@
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from utils.singleton import Singleton
+
+logger = logging.getLogger(__name__)
+
+# 同じモデルで待機させておくInterpreterの上限
+MAX_IDLE_INTERPRETERS = 4
+
+
+def load_tflite_runtime():
+    """
+    TFLiteのInterpreterクラスを読み込む。
+    軽量な tflite_runtime を優先し、インストールされていない場合は tensorflow.lite を使う
+    Returns:
+        (Interpreter, load_delegate)
+    """
+    try:
+        from tflite_runtime.interpreter import Interpreter
+        from tflite_runtime.interpreter import load_delegate
+    except ImportError:
+        try:
+            from tensorflow.lite.python.interpreter import Interpreter
+            from tensorflow.lite.python.interpreter import load_delegate
+        except ImportError as ex:
+            raise ErrorTFLiteUnavailable('tflite_runtime or tensorflow is required') from ex
+    return Interpreter, load_delegate
+
+
+class TFLiteModelRegistry(metaclass=Singleton):
+    """
+    準備済み(allocate_tensorsとウォームアップの推論が済んだ)Interpreterのキャッシュ。
+    キーは (モデルファイル, スレッド数, デリゲート, 入力の形状)。
+    Interpreterはスレッドセーフではないため、acquireしたものはreleaseするまで他に渡さない。
+    """
+
+    def __init__(self):
+        self._interpreter_class = None
+        self._load_delegate = None
+        self._condition = threading.Condition()
+        self._idle = {}
+        self._loading = {}
+        self._in_use = {}
+
+        self.loaded_count = 0
+        self.cache_hits = 0
+        self.last_load_time = 0.0
+
+    def _import_runtime(self):
+        # TensorFlowの読み込みは重いため、最初にモデルを使うときだけimportする
+        if self._interpreter_class is None:
+            start_time = time.perf_counter()
+            self._interpreter_class, self._load_delegate = load_tflite_runtime()
+            logger.info(f'Imported {self._interpreter_class.__module__} '
+                        f'in {time.perf_counter() - start_time:.3f} seconds')
+        return self._interpreter_class
+
+    @staticmethod
+    def make_key(model_file, num_threads, delegate=None, input_shape=None):
+        return (os.path.abspath(model_file), num_threads, delegate,
+                tuple(input_shape) if input_shape is not None else None)
+
+    def _load(self, key):
+        model_file, num_threads, delegate, input_shape = key
+        interpreter_class = self._import_runtime()
+
+        start_time = time.perf_counter()
+        delegates = [self._load_delegate(delegate)] if delegate else None
+        # model_pathで渡すとモデルファイルはメモリマップされ、ヒープにはコピーされない
+        interpreter = interpreter_class(model_path=model_file, num_threads=num_threads,
+                                        experimental_delegates=delegates)
+        input_details = interpreter.get_input_details()[0]
+        if input_shape is not None:
+            interpreter.resize_tensor_input(input_details['index'], list(input_shape))
+        interpreter.allocate_tensors()
+
+        # 最初の推論はメモリ確保などで遅いため、ダミーの入力で一度推論しておく
+        input_details = interpreter.get_input_details()[0]
+        interpreter.set_tensor(input_details['index'],
+                               np.zeros(input_details['shape'], dtype=input_details['dtype']))
+        interpreter.invoke()
+
+        self.last_load_time = time.perf_counter() - start_time
+        logger.info(f'Loaded {model_file} (threads={num_threads}, delegate={delegate}) '
+                    f'in {self.last_load_time:.3f} seconds')
+        return interpreter
+
+    def acquire(self, key):
+        """
+        準備済みのInterpreterを取得する。キャッシュにない場合は読み込む
+        Args:
+            key: make_key で作ったキー
+        Returns:
+            Interpreter
+        """
+        with self._condition:
+            # 同じモデルを読み込み中なら、それを待つ
+            while not self._idle.get(key) and self._loading.get(key, 0) > 0:
+                self._condition.wait()
+            if self._idle.get(key):
+                interpreter = self._idle[key].pop()
+                self._in_use[id(interpreter)] = key
+                self.cache_hits += 1
+                return interpreter
+            self._loading[key] = self._loading.get(key, 0) + 1
+
+        try:
+            interpreter = self._load(key)
+        finally:
+            with self._condition:
+                self._loading[key] -= 1
+                self._condition.notify_all()
+
+        with self._condition:
+            self._in_use[id(interpreter)] = key
+            self.loaded_count += 1
+        return interpreter
+
+    def release(self, interpreter):
+        """
+        使い終わったInterpreterをキャッシュに戻す
+        """
+        with self._condition:
+            key = self._in_use.pop(id(interpreter), None)
+            if key is None:
+                return
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < MAX_IDLE_INTERPRETERS:
+                idle.append(interpreter)
+            self._condition.notify_all()
+
+    def preload(self, key, count=1):
+        """
+        バックグラウンドのスレッドでInterpreterを準備し、キャッシュに入れておく
+        Args:
+            key: make_key で作ったキー
+            count: 準備するInterpreterの数
+        Returns:
+            準備を行うスレッド
+        """
+        def _preload():
+            try:
+                interpreters = [self.acquire(key) for _ in range(count)]
+            except Exception as ex:
+                logger.error(f'Caught exception: {ex} at TFLiteModelRegistry.preload')
+                return
+            for interpreter in interpreters:
+                self.release(interpreter)
+
+        thread = threading.Thread(target=_preload, daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self):
+        with self._condition:
+            return {
+                'runtime': self._interpreter_class.__module__ if self._interpreter_class else None,
+                'loaded': self.loaded_count,
+                'cache_hits': self.cache_hits,
+                'idle': sum(len(idle) for idle in self._idle.values()),
+                'in_use': len(self._in_use),
+                'last_load_time': self.last_load_time,
+            }
+
+
+class ErrorTFLiteUnavailable(Exception):
+    """Error TFLite runtime is not installed"""
@@ -1,110 +1,176 @@
-import cv2
-import numpy as np
-
-from models.detection.person_keypoints.tflite_net import TFLiteNet
-
-class PersonKpPredictor(TFLiteNet):
-    """ 
-    骨格検知クラス
-    """
-
-    def __init__(self, interpreter):
-        super().__init__(interpreter)
-
-        self.input_image_width = None
-        self.input_image_height = None
-
-        self.keypoint_labels = (
-            'nose',
-            'eye_left',
-            'eye_right',
-            'ear_left',
-            'ear_right',
-            'shoulder_left',
-            'shoulder_right',
-            'elbow_left',
-            'elbow_right',
-            'wrist_left',
-            'wrist_right',
-            'hip_left',
-            'hip_right',
-            'knee_left',
-            'knee_right',
-            'ankle_left',
-            'ankle_right'
-        )
-
-    def preprocess(self, image):
-        """
-        画像の前処理:リサイズ、RGBへの変換、float32への変換、リシェイプを行う
-        Args:
-            image:入力画像
-        Returns:
-            処理した画像（processed_image）と入力画像のサイズ (shapes)
-        """
-        _, input_height, input_width, _ = self.interpreter.get_input_details()[0]['shape']
-        self.input_image_height,  self.input_image_width, _ = image.shape
-
-        resized_input = cv2.resize(image, (input_width, input_height))
-        # BGR => RGB
-        resized_rgb_input = cv2.cvtColor(resized_input, cv2.COLOR_BGR2RGB)
-        processed_input = resized_rgb_input.astype(np.float32)
-
-        return processed_input
-
-    def predict(self, image_np):
-        """
-        骨格検知を行う
-        Args:
-            image_np: (height, width, 3)
-        Returns:
-            検知結果: 人の骨格点17個(person_keypoints) を格納した辞書
-        """
-        image = self.preprocess(image_np)
-        self.set_input_tensor(image)
-        self.interpreter.invoke()
-        pers_kpts_with_scores = self.get_output_tensor(0)
-        person_keypoints = {}
-        scores = []
-
-        for index in range(len(pers_kpts_with_scores)):
-            keypoint_x = pers_kpts_with_scores[index][1]
-            keypoint_y = pers_kpts_with_scores[index][0]
-            score = pers_kpts_with_scores[index][2]
-
-            # y座標をマイナスすることで画像座標系から標準座標系へ変換
-            person_keypoints[self.keypoint_labels[index]] = {'x': keypoint_x, 'y': keypoint_y, 'score': score}
-
-        return person_keypoints
-
-    def get_person_kpts(self, key_points, score_threshold_for_per_kpts):
-        """
-               信頼度スコアが閾値以上の骨格点を取得する
-               Args:
-                   key_points:骨格点
-                   score_threshold_for_per_kpts: scoreの低い検知を削除するために使用する閾値
-
-               Returns:
-                   検知結果: 信頼度スコアが閾値より大きい、人の骨格点17個(person_keypoints) を格納した辞書
-                       キー：部位
-                       バリュー： xy座標
-               """
-
-        person_keypoints = {}
-
-
-        scale_x = self.input_image_width
-        scale_y = self.input_image_height
-
-        for index in range(len(key_points)):
-
-            keypoint_x = int(scale_x * key_points[self.keypoint_labels[index]]['x'])
-            keypoint_y = int(scale_y * key_points[self.keypoint_labels[index]]['y'])
-            score = key_points[self.keypoint_labels[index]]['score']
-
-            if score > score_threshold_for_per_kpts:
-                person_keypoints[self.keypoint_labels[index]] = {'x': keypoint_x, 'y': keypoint_y, 'score': score}
-            else:
-                person_keypoints[self.keypoint_labels[index]] = {'x': None, 'y': None, 'score':None}
-
-        return person_keypoints
\ No newline at end of file
+import cv2
+import numpy as np
+
+from models.detection.person_keypoints.tflite_net import TFLiteNet
+from models.pose.person_pose import SCORE
+from models.pose.person_pose import X
+from models.pose.person_pose import Y
+from models.pose.person_pose import PersonPose
+
+class PersonKpPredictor(TFLiteNet):
+    """ 
+    骨格検知クラス
+    """
+
+    def __init__(self, interpreter):
+        super().__init__(interpreter)
+
+        self.input_image_width = None
+        self.input_image_height = None
+        # リサイズ先のバッファ。フレームごとに確保しない
+        self._resized_input = np.empty((self.input_height, self.input_width, 3), dtype=np.uint8)
+
+        self.keypoint_labels = (
+            'nose',
+            'eye_left',
+            'eye_right',
+            'ear_left',
+            'ear_right',
+            'shoulder_left',
+            'shoulder_right',
+            'elbow_left',
+            'elbow_right',
+            'wrist_left',
+            'wrist_right',
+            'hip_left',
+            'hip_right',
+            'knee_left',
+            'knee_right',
+            'ankle_left',
+            'ankle_right'
+        )
+
+    def preprocess(self, image):
+        """
+        画像の前処理:リサイズ、RGBへの変換、入力の型への変換を行い、入力Tensorへ直接書き込む
+        uint8の量子化モデルの場合はfloat32への変換は行わない
+        Args:
+            image:入力画像
+        Returns:
+            書き込んだ入力Tensorのビュー
+        """
+        self.input_image_height,  self.input_image_width, _ = image.shape
+
+        cv2.resize(image, (self.input_width, self.input_height), dst=self._resized_input)
+        input_tensor = self.input_tensor()
+        if self.input_dtype == np.uint8:
+            # BGR => RGB
+            cv2.cvtColor(self._resized_input, cv2.COLOR_BGR2RGB, dst=input_tensor)
+        else:
+            # BGR => RGB とfloat32への変換を1回のコピーで行う
+            np.copyto(input_tensor, self._resized_input[:, :, ::-1], casting='unsafe')
+
+        return input_tensor
+
+    def predict(self, image_np):
+        """
+        骨格検知を行う
+        Args:
+            image_np: (height, width, 3)
+        Returns:
+            検知結果: 人の骨格点17個を正規化座標(0〜1)で格納したPersonPose
+        """
+        self.preprocess(image_np)
+        self.interpreter.invoke()
+        return self.postprocess()
+
+    def postprocess(self):
+        """
+        推論結果の出力Tensor [y, x, score] をPersonPoseに変換する
+        Returns:
+            検知結果: 人の骨格点17個を正規化座標(0〜1)で格納したPersonPose
+        """
+        pers_kpts_with_scores = self.get_output_tensor(0)
+        person_pose = PersonPose()
+        keypoints = person_pose.keypoints
+        keypoints[:, X] = pers_kpts_with_scores[:, 1]
+        keypoints[:, Y] = pers_kpts_with_scores[:, 0]
+        keypoints[:, SCORE] = pers_kpts_with_scores[:, 2]
+        person_pose.valid[:] = True
+        return person_pose
+
+    def get_person_kpts(self, key_points, score_threshold_for_per_kpts):
+        """
+               信頼度スコアが閾値以上の骨格点を取得する
+               Args:
+                   key_points:正規化座標のPersonPose。画像座標に変換して上書きする
+                   score_threshold_for_per_kpts: scoreの低い検知を削除するために使用する閾値
+
+               Returns:
+                   検知結果: 画像座標に変換し、信頼度スコアが閾値より大きい骨格点だけを有効にしたPersonPose
+               """
+        key_points.xy[:] *= (self.input_image_width, self.input_image_height)
+        np.greater(key_points.scores, score_threshold_for_per_kpts, out=key_points.valid)
+        return key_points
+
+    def get_persons(self, score_threshold_for_per_kpts):
+        """
+        画像座標の骨格点を人物ごとに返す
+        Returns:
+            [(PersonPose, None)] 1人用モデルのため人物の矩形はない
+        """
+        return [(self.get_person_kpts(self.postprocess(), score_threshold_for_per_kpts), None)]
+
+
+# MoveNet MultiPose の出力は1人あたり 17×[y, x, score] + [ymin, xmin, ymax, xmax, score] の56個
+MULTI_POSE_KEYPOINTS_SIZE = 17 * 3
+MAX_PERSONS = 6
+DEFAULT_PERSON_SCORE_THRESHOLD = 0.2
+
+
+class MultiPersonKpPredictor(PersonKpPredictor):
+    """
+    複数人(最大6人)の骨格検知クラス (MoveNet MultiPose)
+    """
+
+    def __init__(self, interpreter, person_score_threshold=DEFAULT_PERSON_SCORE_THRESHOLD):
+        super().__init__(interpreter)
+        self.person_score_threshold = person_score_threshold
+
+    def postprocess(self):
+        """
+        推論結果の出力Tensorを人物ごとのPersonPoseと矩形に変換する
+        Returns:
+            正規化座標(0〜1)の (PersonPoseのリスト, (N, 4) の [x1, y1, x2, y2], (N, ) の人物のスコア)
+            人物のスコアが閾値以下の検知は含まない
+        """
+        output = self.get_output_tensor(0).reshape(-1, MULTI_POSE_KEYPOINTS_SIZE + 5)
+        person_scores = output[:, MULTI_POSE_KEYPOINTS_SIZE + 4]
+        output = output[person_scores > self.person_score_threshold]
+
+        keypoints = output[:, :MULTI_POSE_KEYPOINTS_SIZE].reshape(-1, 17, 3)
+        person_poses = []
+        for person_keypoints in keypoints:
+            person_pose = PersonPose()
+            person_pose.keypoints[:, X] = person_keypoints[:, 1]
+            person_pose.keypoints[:, Y] = person_keypoints[:, 0]
+            person_pose.keypoints[:, SCORE] = person_keypoints[:, 2]
+            person_pose.valid[:] = True
+            person_poses.append(person_pose)
+
+        ymin, xmin, ymax, xmax = (output[:, MULTI_POSE_KEYPOINTS_SIZE + i] for i in range(4))
+        boxes = np.stack([xmin, ymin, xmax, ymax], axis=1)
+        return person_poses, boxes, output[:, MULTI_POSE_KEYPOINTS_SIZE + 4].copy()
+
+    def predict(self, image_np):
+        """
+        骨格検知を行う
+        Args:
+            image_np: (height, width, 3)
+        Returns:
+            正規化座標(0〜1)の (PersonPoseのリスト, 人物の矩形, 人物のスコア)
+        """
+        self.preprocess(image_np)
+        self.interpreter.invoke()
+        return self.postprocess()
+
+    def get_persons(self, score_threshold_for_per_kpts):
+        """
+        画像座標の骨格点と人物の矩形を人物ごとに返す
+        Returns:
+            [(PersonPose, [x1, y1, x2, y2])]
+        """
+        person_poses, boxes, _ = self.postprocess()
+        boxes *= (self.input_image_width, self.input_image_height, self.input_image_width, self.input_image_height)
+        return [(self.get_person_kpts(person_pose, score_threshold_for_per_kpts), box)
+                for person_pose, box in zip(person_poses, boxes)]
@@ -0,0 +1,150 @@
+import itertools
+
+import numpy as np
+
+DEFAULT_IOU_THRESHOLD = 0.3
+# IoUで対応が取れない場合に、箱の大きさに対する中心間の距離がこれ以下なら同一人物とみなす
+DEFAULT_MAX_CENTROID_DISTANCE = 0.5
+# この回数続けて見つからなかった人物は追跡をやめる
+DEFAULT_MAX_MISSED = 10
+MAX_TRACKS = 16
+
+
+class TrackedPerson:
+    """
+    追跡中の人物
+    """
+    __slots__ = ('track_id', 'box', 'pose', 'missed', 'hits')
+
+    def __init__(self, track_id, box, pose):
+        self.track_id = track_id
+        self.box = box
+        self.pose = pose
+        self.missed = 0
+        self.hits = 1
+
+
+def box_iou(boxes1, boxes2):
+    """
+    Args:
+        boxes1: (M, 4) の [x1, y1, x2, y2]
+        boxes2: (N, 4) の [x1, y1, x2, y2]
+    Returns:
+        (M, N) のIoU
+    """
+    top_left = np.maximum(boxes1[:, None, :2], boxes2[None, :, :2])
+    bottom_right = np.minimum(boxes1[:, None, 2:], boxes2[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area1 = np.prod(boxes1[:, 2:] - boxes1[:, :2], axis=1)
+    area2 = np.prod(boxes2[:, 2:] - boxes2[:, :2], axis=1)
+    union = area1[:, None] + area2[None, :] - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+
+class PersonIdentityTracker:
+    """
+    複数人の検知結果をフレーム間で対応付け、操作者(controlling person)を安定して選ぶ。
+    前フレームの追跡結果とだけ照合するため、1フレームあたりの処理量は人数によらずほぼ一定。
+    """
+
+    def __init__(self, iou_threshold=DEFAULT_IOU_THRESHOLD, max_centroid_distance=DEFAULT_MAX_CENTROID_DISTANCE,
+                 max_missed=DEFAULT_MAX_MISSED):
+        self.iou_threshold = iou_threshold
+        self.max_centroid_distance = max_centroid_distance
+        self.max_missed = max_missed
+
+        self.tracks = []
+        self.controlling_id = None
+        self._track_ids = itertools.count(1)
+
+    def reset(self):
+        self.tracks = []
+        self.controlling_id = None
+
+    def _match(self, boxes):
+        """
+        Returns:
+            {trackのindex: 検知結果のindex}
+        """
+        if not self.tracks or len(boxes) == 0:
+            return {}
+        track_boxes = np.array([track.box for track in self.tracks], dtype=np.float32)
+        scores = box_iou(track_boxes, boxes)
+
+        # IoUで対応が取れないものは、中心間の距離で対応付ける
+        track_centers = (track_boxes[:, :2] + track_boxes[:, 2:]) / 2
+        centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+        track_sizes = np.maximum(track_boxes[:, 2:] - track_boxes[:, :2], 1e-6).max(axis=1)
+        distances = np.linalg.norm(track_centers[:, None, :] - centers[None, :, :], axis=2) / track_sizes[:, None]
+        is_close = (scores < self.iou_threshold) & (distances <= self.max_centroid_distance)
+        # 距離で対応付けたものはIoUで対応付けたものより優先度を下げる
+        scores = np.where(is_close, self.iou_threshold * (1 - distances / self.max_centroid_distance) * 0.5, scores)
+        scores[(scores < self.iou_threshold) & ~is_close] = -1
+
+        matches = {}
+        # スコアの高い組から貪欲に対応付ける
+        for flat_index in np.argsort(scores, axis=None)[::-1]:
+            track_index, person_index = np.unravel_index(flat_index, scores.shape)
+            if scores[track_index, person_index] < 0:
+                break
+            if track_index in matches or person_index in matches.values():
+                continue
+            matches[int(track_index)] = int(person_index)
+        return matches
+
+    def update(self, persons):
+        """
+        Args:
+            persons: (PersonPose, box) のリスト。boxは画像座標の [x1, y1, x2, y2]
+        Returns:
+            このフレームで見つかった TrackedPerson のリスト
+        """
+        boxes = np.array([box for _, box in persons], dtype=np.float32).reshape(-1, 4)
+        matches = self._match(boxes)
+
+        matched_persons = set(matches.values())
+        visible = []
+        for track_index, track in enumerate(self.tracks):
+            person_index = matches.get(track_index)
+            if person_index is None:
+                track.missed += 1
+                continue
+            track.pose, _ = persons[person_index]
+            track.box = boxes[person_index]
+            track.missed = 0
+            track.hits += 1
+            visible.append(track)
+
+        for person_index, (pose, _) in enumerate(persons):
+            if person_index in matched_persons or len(self.tracks) >= MAX_TRACKS:
+                continue
+            track = TrackedPerson(next(self._track_ids), boxes[person_index], pose)
+            self.tracks.append(track)
+            visible.append(track)
+
+        self.tracks = [track for track in self.tracks if track.missed <= self.max_missed]
+        return visible
+
+    def select(self, persons):
+        """
+        操作者の骨格点を返す。操作者が一時的に見えない間は他の人物に切り替えない
+        Args:
+            persons: (PersonPose, box) のリスト
+        Returns:
+            操作者のPersonPose。見つからない場合は None
+        """
+        visible = self.update(persons)
+        track_ids = {track.track_id for track in self.tracks}
+        if self.controlling_id in track_ids:
+            for track in visible:
+                if track.track_id == self.controlling_id:
+                    return track.pose
+            return None
+
+        if not visible:
+            self.controlling_id = None
+            return None
+        # 新しい操作者は一番大きく写っている人物とする
+        largest = max(visible, key=lambda track: np.prod(track.box[2:] - track.box[:2]))
+        self.controlling_id = largest.track_id
+        return largest.pose
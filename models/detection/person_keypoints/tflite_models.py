@@ -1,29 +1,64 @@
-import time
-
-from tensorflow.lite.python.interpreter import Interpreter
-
-from models.detection.person_keypoints.person_keypoints_detector import PersonKpPredictor
-
-
-def get_person_kp_predictor(model_file):
-    """
-    人の骨格点の検知モデル
-    Args:
-        conf: アプリ設定
-
-    Returns:
-        骨格検知モデル
-    """
-
-    print('Loading file: %s ...' % model_file)
-    start_time = time.time()
-    interpreter = Interpreter(model_file, num_threads=2)
-    interpreter.allocate_tensors()
-
-    end_time = time.time()
-    elapsed_time = end_time - start_time
-    print(f'It took {elapsed_time} seconds to load the model.')
-
-    pers_kpts_predictor = PersonKpPredictor(interpreter)
-
-    return pers_kpts_predictor
\ No newline at end of file
+import settings
+from models.detection.person_keypoints.model_registry import TFLiteModelRegistry
+from models.detection.person_keypoints.person_keypoints_detector import MultiPersonKpPredictor
+from models.detection.person_keypoints.person_keypoints_detector import PersonKpPredictor
+
+# MoveNet MultiPose の入力サイズ (32の倍数)
+MULTI_POSE_INPUT_SIZE = 256
+
+
+def person_kp_model_key(model_file, num_threads=None, delegate=None):
+    """
+    1人用の骨格検知モデルのキャッシュのキー
+    """
+    if num_threads is None:
+        num_threads = settings.TFLITE_NUM_THREADS
+    if delegate is None:
+        delegate = settings.TFLITE_DELEGATE
+    return TFLiteModelRegistry.make_key(model_file, num_threads, delegate)
+
+
+def multi_person_kp_model_key(model_file, input_size=MULTI_POSE_INPUT_SIZE, num_threads=None, delegate=None):
+    """
+    複数人用の骨格検知モデルのキャッシュのキー
+    MultiPoseは入力サイズが可変のため、指定したサイズで確保する
+    """
+    if num_threads is None:
+        num_threads = settings.TFLITE_NUM_THREADS
+    if delegate is None:
+        delegate = settings.TFLITE_DELEGATE
+    return TFLiteModelRegistry.make_key(model_file, num_threads, delegate, (1, input_size, input_size, 3))
+
+
+def get_person_kp_predictor(model_file):
+    """
+    人の骨格点の検知モデル
+    Args:
+        model_file: モデルファイルのパス
+
+    Returns:
+        骨格検知モデル。使い終わったら release_predictor を呼ぶこと
+    """
+    interpreter = TFLiteModelRegistry().acquire(person_kp_model_key(model_file))
+    return PersonKpPredictor(interpreter)
+
+
+def get_multi_person_kp_predictor(model_file, input_size=MULTI_POSE_INPUT_SIZE):
+    """
+    複数人の骨格点の検知モデル (MoveNet MultiPose)
+    Args:
+        model_file: モデルファイルのパス
+        input_size: 入力画像のサイズ
+
+    Returns:
+        骨格検知モデル。使い終わったら release_predictor を呼ぶこと
+    """
+    interpreter = TFLiteModelRegistry().acquire(multi_person_kp_model_key(model_file, input_size))
+    return MultiPersonKpPredictor(interpreter)
+
+
+def release_predictor(predictor):
+    """
+    骨格検知モデルのInterpreterをキャッシュに戻す
+    """
+    TFLiteModelRegistry().release(predictor.interpreter)
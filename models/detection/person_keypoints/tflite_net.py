@@ -1,35 +1,61 @@
-import numpy as np
-
-
-class TFLiteNet():
-    """
-    TFliteのネットワークをルパー
-    """
-
-    def __init__(self, interpreter):
-        self.interpreter = interpreter
-
-    def set_input_tensor(self, image):
-        """
-        画像を入力する
-        Args:
-            image:画像
-
-        """
-        tensor_index = self.interpreter.get_input_details()[0]['index']
-        # 本モデルは index=0
-        input_tensor = self.interpreter.tensor(tensor_index)()[0]
-        input_tensor[:, :] = image
-
-    def get_output_tensor(self, index):
-        """
-        指定されたindexで出力Tensorを返します
-        Args:
-            index:
-
-        Returns:
-            検知結果を含むTensor
-        """
-        output_details = self.interpreter.get_output_details()[index]
-        tensor = np.squeeze(self.interpreter.get_tensor(output_details['index']))
-        return tensor
+import numpy as np
+
+
+class TFLiteNet():
+    """
+    TFliteのネットワークをルパー
+    入出力の情報は生成時に一度だけ取得し、Tensorへはコピーせずにビューで読み書きする
+    """
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+
+        self.input_details = interpreter.get_input_details()
+        self.output_details = interpreter.get_output_details()
+        # 本モデルは index=0
+        _, self.input_height, self.input_width, _ = self.input_details[0]['shape']
+        self.input_dtype = self.input_details[0]['dtype']
+        self._input_tensor = interpreter.tensor(self.input_details[0]['index'])
+        self._output_tensors = [interpreter.tensor(details['index']) for details in self.output_details]
+        # 量子化モデルの出力を実数に戻すためのバッファ
+        self._dequantized_outputs = [None] * len(self.output_details)
+
+    def input_tensor(self):
+        """
+        入力Tensorのビューを返す。invokeをまたいで保持しないこと
+        Returns:
+            (height, width, 3) の入力Tensor
+        """
+        return self._input_tensor()[0]
+
+    def set_input_tensor(self, image):
+        """
+        画像を入力する
+        Args:
+            image:画像
+
+        """
+        self.input_tensor()[:, :] = image
+
+    def get_output_tensor(self, index):
+        """
+        指定されたindexで出力Tensorを返します
+        Args:
+            index:
+
+        Returns:
+            検知結果を含むTensor。次のinvokeで上書きされる
+        """
+        tensor = np.squeeze(self._output_tensors[index]())
+        details = self.output_details[index]
+        scale, zero_point = details['quantization']
+        if not np.issubdtype(details['dtype'], np.integer) or not scale:
+            return tensor
+
+        dequantized = self._dequantized_outputs[index]
+        if dequantized is None:
+            dequantized = np.empty(tensor.shape, dtype=np.float32)
+            self._dequantized_outputs[index] = dequantized
+        np.subtract(tensor, zero_point, out=dequantized, dtype=np.float32)
+        dequantized *= scale
+        return dequantized
@@ -0,0 +1,229 @@
+import logging
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import settings
+
+from models.command_channel import CommandDispatcher
+from models.tello_drone import HOST_COMMAND_PORT
+from models.tello_drone import HOST_IP
+from models.tello_drone import RECEIVE_TIMEOUT
+from models.tello_drone import SEND_COMMAND_PORT
+from models.tello_drone import STATE_PORT
+from models.tello_drone import VIDEO_PORT
+from models.tello_drone import TelloDrone
+from models.tello_state import MAX_STATE_PACKET_SIZE
+from models.video.receiver_pool import VideoReceiverPool
+from utils.singleton import Singleton
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DRONE_ID = 'default'
+# 全台へのコマンドを並行に実行するスレッドの最大数
+MAX_BROADCAST_WORKERS = 8
+# Telloのサンプルコードと同様に3000
+RESPONSE_BUFFER_SIZE = 3000
+
+
+class TelloFleet(metaclass=Singleton):
+    """
+    複数台のTello (EDUのステーションモード) を1つのプロセスで操作する。
+    コマンドと状態の受信ソケットは全台で共有し、受信したパケットは送信元のIPでドローンに振り分ける。
+    コマンドの送信は1つのCommandDispatcher、映像の受信とデコードはVideoReceiverPoolのスレッドで全台分を行う
+    """
+
+    def __init__(self, drones=None, host_ip=HOST_IP, host_port=HOST_COMMAND_PORT, state_port=STATE_PORT,
+                 video_workers=settings.VIDEO_RECEIVE_WORKERS):
+        """
+        Args:
+            drones: ドローンの設定 ({'id', 'drone_ip', 'drone_port', 'video_port'}) のリスト。
+                Noneの場合は settings.TELLO_FLEET。それも空の場合は settings.TELLO_DRONE_IP の1台
+            host_ip, host_port: コマンドの送受信に使うアドレス
+            state_port: 状態パケットを受信するポート
+            video_workers: 映像を受信・デコードするスレッドの数
+        """
+        self.host_ip = host_ip
+        self.host_port = host_port
+        self.state_port = state_port
+
+        self.stop_flag = threading.Event()
+        self.command_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.command_socket.bind((self.host_ip, self.host_port))
+        self.command_socket.settimeout(RECEIVE_TIMEOUT)
+        self.command_dispatcher = CommandDispatcher()
+        self.video_receiver = VideoReceiverPool(video_workers)
+        self._broadcast_executor = ThreadPoolExecutor(max_workers=MAX_BROADCAST_WORKERS,
+                                                      thread_name_prefix='fleet-broadcast')
+
+        self._lock = threading.Lock()
+        self._drones = {}
+        self._drones_by_ip = {}
+        self.default_id = None
+        self.unknown_packets = 0
+
+        self._response_thread = threading.Thread(target=self._receive_responses, args=(self.stop_flag, ),
+                                                 daemon=True)
+        self._response_thread.start()
+        self._state_thread = threading.Thread(target=self._receive_states, args=(self.stop_flag, ), daemon=True)
+        self._state_thread.start()
+
+        if drones is None:
+            drones = settings.TELLO_FLEET or [{'id': DEFAULT_DRONE_ID, 'drone_ip': settings.TELLO_DRONE_IP}]
+        for drone in drones:
+            drone = dict(drone)
+            self.add_drone(drone.pop('id'), **drone)
+
+    def add_drone(self, drone_id, drone_ip, drone_port=SEND_COMMAND_PORT, video_port=VIDEO_PORT, **kwargs):
+        """
+        ドローンを追加し、初期化コマンドを送信する
+        Args:
+            drone_id: ルートなどで使うドローンの名前
+            drone_ip, drone_port: ドローンのコマンドのアドレス
+            video_port: 映像を受信するポート。ドローンごとに別のポートにすること
+            kwargs: TelloDroneに渡すその他の引数
+        Returns:
+            TelloDrone
+        """
+        with self._lock:
+            if drone_id in self._drones:
+                raise ErrorDroneAlreadyExists(f'{drone_id} is already in the fleet')
+            for drone in self._drones.values():
+                if drone.drone_ip == drone_ip:
+                    raise ErrorDroneAlreadyExists(f'{drone_ip} is already used by {drone.drone_id}')
+                if drone.video_port == video_port:
+                    raise ErrorDroneAlreadyExists(f'video port {video_port} is already used by {drone.drone_id}')
+        return TelloDrone(host_ip=self.host_ip, host_port=self.host_port, drone_ip=drone_ip, drone_port=drone_port,
+                          video_port=video_port, state_port=self.state_port, drone_id=drone_id, fleet=self,
+                          **kwargs)
+
+    def attach(self, drone):
+        """
+        応答と状態をドローンに振り分けるように登録する。TelloDroneが初期化コマンドを送る前に呼び出す
+        """
+        with self._lock:
+            self._drones[drone.drone_id] = drone
+            self._drones_by_ip[drone.drone_ip] = drone
+            if self.default_id is None:
+                self.default_id = drone.drone_id
+
+    def detach(self, drone):
+        with self._lock:
+            if self._drones.get(drone.drone_id) is drone:
+                del self._drones[drone.drone_id]
+            if self._drones_by_ip.get(drone.drone_ip) is drone:
+                del self._drones_by_ip[drone.drone_ip]
+            if self.default_id == drone.drone_id:
+                self.default_id = next(iter(self._drones), None)
+
+    def remove_drone(self, drone_id):
+        self.get(drone_id).stop()
+
+    def get(self, drone_id=None):
+        """
+        Args:
+            drone_id: ドローンの名前。Noneの場合は最初に追加したドローン
+        Returns:
+            TelloDrone
+        """
+        with self._lock:
+            drone = self._drones.get(self.default_id if drone_id is None else drone_id)
+        if drone is None:
+            raise ErrorDroneNotFound(f'{drone_id} is not in the fleet')
+        return drone
+
+    def drones(self):
+        """
+        Returns:
+            {ドローンの名前: TelloDrone}
+        """
+        with self._lock:
+            return dict(self._drones)
+
+    def broadcast(self, function):
+        """
+        全てのドローンで function(drone) を並行に実行する。コマンドは応答を待つため、台数分の時間はかからない
+        Returns:
+            {ドローンの名前: functionの戻り値}。例外が発生したドローンは None
+        """
+        futures = {drone_id: self._broadcast_executor.submit(function, drone)
+                   for drone_id, drone in self.drones().items()}
+        results = {}
+        for drone_id, future in futures.items():
+            try:
+                results[drone_id] = future.result()
+            except Exception as ex:
+                logger.error(f'Caught exception: {ex} at TelloFleet.broadcast ({drone_id})')
+                results[drone_id] = None
+        return results
+
+    def stop(self):
+        for drone in self.drones().values():
+            drone.stop()
+        self.stop_flag.set()
+        self.command_dispatcher.stop()
+        self.video_receiver.stop()
+        self._response_thread.join(timeout=2.0)
+        self._state_thread.join(timeout=2.0)
+        self.command_socket.close()
+        self._broadcast_executor.shutdown(wait=False)
+
+    def _receive_responses(self, stop_flag):
+        while not stop_flag.is_set():
+            try:
+                response, address = self.command_socket.recvfrom(RESPONSE_BUFFER_SIZE)
+            except socket.timeout:
+                # stop_flagを確認するために定期的に起きる
+                continue
+            except socket.error as ex:
+                logger.error(f'Caught exception socket.error: {ex} at TelloFleet._receive_responses')
+                break
+            drone = self._drones_by_ip.get(address[0])
+            if drone is None:
+                self.unknown_packets += 1
+                logger.warning(f'discard response from unknown drone {address[0]}: {response}')
+                continue
+            drone.handle_command_response(response)
+
+    def _receive_states(self, stop_flag):
+        buffer = bytearray(MAX_STATE_PACKET_SIZE)
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as state_socket:
+            state_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            state_socket.settimeout(RECEIVE_TIMEOUT)
+            try:
+                state_socket.bind((self.host_ip, self.state_port))
+            except socket.error as ex:
+                logger.error(f'Caught exception socket.error: {ex} at TelloFleet._receive_states')
+                return
+
+            while not stop_flag.is_set():
+                try:
+                    size, address = state_socket.recvfrom_into(buffer)
+                except socket.timeout:
+                    continue
+                except socket.error as ex:
+                    logger.error(f'Caught exception socket.error: {ex} at TelloFleet._receive_states')
+                    break
+                drone = self._drones_by_ip.get(address[0])
+                if drone is None:
+                    self.unknown_packets += 1
+                    continue
+                drone.state_receiver.handle_packet(buffer, size)
+
+    def stats(self):
+        return {
+            'default': self.default_id,
+            'drones': {drone_id: {'drone_ip': drone.drone_ip, 'video_port': drone.video_port,
+                                  'state': drone.get_state()}
+                       for drone_id, drone in self.drones().items()},
+            'video_receiver': self.video_receiver.stats(),
+            'unknown_packets': self.unknown_packets,
+        }
+
+
+class ErrorDroneNotFound(Exception):
+    """Error no drone with the id in the fleet"""
+
+
+class ErrorDroneAlreadyExists(Exception):
+    """Error drone id, ip or video port is already used in the fleet"""
@@ -0,0 +1,346 @@
+import glob
+import json
+import logging
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 記録の種類
+RECORD_VIDEO = 1
+RECORD_COMMAND = 2
+RECORD_RESPONSE = 3
+RECORD_DETECTION = 4
+RECORD_STATE = 5
+RECORD_TYPE_NAMES = {
+    RECORD_VIDEO: 'video',
+    RECORD_COMMAND: 'command',
+    RECORD_RESPONSE: 'response',
+    RECORD_DETECTION: 'detection',
+    RECORD_STATE: 'state',
+}
+
+# チャンクファイルの各記録の先頭: 種類, 時刻 (time.time), ペイロードのバイト数
+RECORD_HEADER = struct.Struct('<BdI')
+# インデックスファイルの各エントリ: 時刻, チャンク内の位置, 種類
+INDEX_DTYPE = np.dtype([('timestamp', '<f8'), ('offset', '<u8'), ('type', 'u1')])
+CHUNK_FILE_FORMAT = 'chunk_{:05d}.bin'
+INDEX_FILE_FORMAT = 'chunk_{:05d}.idx'
+MANIFEST_FILE = 'manifest.json'
+
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+DEFAULT_CHUNK_DURATION = 60.0
+# 書き込みが追いつかない場合に、映像を捨て始める待ち件数
+MAX_PENDING_RECORDS = 1024
+WRITE_BUFFER_SIZE = 1024 * 1024
+QUEUE_POLL_INTERVAL = 0.5
+
+
+class FlightRecorder:
+    """
+    映像(H.264のアクセスユニット)、コマンドと応答、検出結果、状態を時刻つきでチャンクファイルに追記する。
+    記録する側はキューに入れるだけで、ファイルへの書き込みは専用のスレッドで行う。
+    チャンクごとにインデックスファイルを作り、記録の位置を引けるようにする。
+    """
+
+    def __init__(self, directory, chunk_size=DEFAULT_CHUNK_SIZE, chunk_duration=DEFAULT_CHUNK_DURATION):
+        """
+        Args:
+            directory: 記録を保存するディレクトリ
+            chunk_size: 1チャンクの最大バイト数
+            chunk_duration: 1チャンクの最大の長さ(秒)
+        """
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.chunk_duration = chunk_duration
+
+        self._queue = queue.SimpleQueue()
+        self._stop_flag = threading.Event()
+        self._thread = None
+
+        self._chunk_index = -1
+        self._chunk_file = None
+        self._index_file = None
+        self._chunk_bytes = 0
+        self._chunk_start_time = 0.0
+        self._chunks = []
+        self._index_entry = np.zeros(1, dtype=INDEX_DTYPE)
+
+        self.records = 0
+        self.dropped_records = 0
+        self.bytes_written = 0
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.is_running:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._stop_flag.clear()
+        self._thread = threading.Thread(target=self._run, args=(self._stop_flag, ), daemon=True)
+        self._thread.start()
+        logger.info(f'Recording flight data to {self.directory}')
+
+    def stop(self):
+        """
+        キューに残っている記録を書き終えてから止める
+        """
+        self._stop_flag.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+
+    def _put(self, record_type, payload, timestamp=None):
+        if not self.is_running:
+            return
+        self._queue.put((record_type, time.time() if timestamp is None else timestamp, payload))
+
+    def record_video(self, access_unit):
+        """
+        Args:
+            access_unit: 1フレーム分のH.264。呼び出し元のバッファは再利用されるためコピーして記録する
+        """
+        if not self.is_running:
+            return
+        if self._queue.qsize() > MAX_PENDING_RECORDS:
+            self.dropped_records += 1
+            return
+        self._put(RECORD_VIDEO, bytes(access_unit))
+
+    def record_command(self, command):
+        self._put(RECORD_COMMAND, command)
+
+    def record_response(self, response):
+        self._put(RECORD_RESPONSE, response)
+
+    def record_detection(self, kind, result, timestamp=None):
+        """
+        Args:
+            kind: 検出の種類 ('face', 'pose')
+            result: JSONに変換できる検出結果、またはto_dict()を持つオブジェクト
+        """
+        self._put(RECORD_DETECTION, (kind, result), timestamp)
+
+    def record_state(self, timestamp, values):
+        self._put(RECORD_STATE, values, timestamp)
+
+    @staticmethod
+    def encode_payload(record_type, payload):
+        if record_type == RECORD_VIDEO:
+            return payload
+        if record_type in (RECORD_COMMAND, RECORD_RESPONSE):
+            return payload.encode('utf-8') if isinstance(payload, str) else bytes(payload)
+        if record_type == RECORD_STATE:
+            return np.asarray(payload, dtype='<f4').tobytes()
+        kind, result = payload
+        if hasattr(result, 'to_dict'):
+            # 検出結果の変換は記録する側ではなく書き込みスレッドで行う
+            result = result.to_dict()
+        return json.dumps({'kind': kind, 'result': result}).encode('utf-8')
+
+    def _run(self, stop_flag):
+        try:
+            while not stop_flag.is_set() or not self._queue.empty():
+                try:
+                    record_type, timestamp, payload = self._queue.get(timeout=QUEUE_POLL_INTERVAL)
+                except queue.Empty:
+                    continue
+                # 1件の記録の失敗で書き込みスレッドを止めず、その記録だけを捨てる
+                try:
+                    data = self.encode_payload(record_type, payload)
+                except Exception as ex:
+                    logger.error(f'Caught exception: {ex} at FlightRecorder._run')
+                    self.dropped_records += 1
+                    continue
+                try:
+                    self._write(record_type, timestamp, data)
+                except OSError as ex:
+                    logger.error(f'Caught exception: {ex} at FlightRecorder._run')
+                    self.dropped_records += 1
+                    # 書きかけの記録が残ったチャンクには書き足さず、次の記録から新しいチャンクにする
+                    self._close_chunk()
+        finally:
+            self._close_chunk()
+
+    def _write(self, record_type, timestamp, payload):
+        if self._chunk_file is None or self._chunk_bytes >= self.chunk_size or \
+                timestamp - self._chunk_start_time >= self.chunk_duration:
+            self._open_chunk(timestamp)
+
+        self._chunk_file.write(RECORD_HEADER.pack(record_type, timestamp, len(payload)))
+        self._chunk_file.write(payload)
+
+        # インデックスには書き込めた記録だけを載せる
+        entry = self._index_entry[0]
+        entry['timestamp'] = timestamp
+        entry['offset'] = self._chunk_bytes
+        entry['type'] = record_type
+        self._index_file.write(self._index_entry.tobytes())
+        size = RECORD_HEADER.size + len(payload)
+        self._chunk_bytes += size
+        self.bytes_written += size
+        self.records += 1
+        self._chunks[-1]['end_time'] = timestamp
+
+    def _open_chunk(self, timestamp):
+        self._close_chunk()
+        self._chunk_index += 1
+        chunk_path = os.path.join(self.directory, CHUNK_FILE_FORMAT.format(self._chunk_index))
+        index_path = os.path.join(self.directory, INDEX_FILE_FORMAT.format(self._chunk_index))
+        self._chunk_file = open(chunk_path, 'wb', buffering=WRITE_BUFFER_SIZE)
+        self._index_file = open(index_path, 'wb')
+        self._chunk_bytes = 0
+        self._chunk_start_time = timestamp
+        self._chunks.append({'chunk': os.path.basename(chunk_path), 'index': os.path.basename(index_path),
+                             'start_time': timestamp, 'end_time': timestamp})
+        # 記録中に終了した場合もマニフェストに書き込み中のチャンクが載っているようにする
+        self._write_manifest()
+
+    def _close_chunk(self):
+        if self._chunk_file is None:
+            return
+        for f in (self._chunk_file, self._index_file):
+            if f is None:
+                continue
+            try:
+                f.close()
+            except OSError as ex:
+                logger.error(f'Caught exception: {ex} at FlightRecorder._close_chunk')
+        self._chunk_file = None
+        self._index_file = None
+        try:
+            self._write_manifest()
+        except OSError as ex:
+            # マニフェストがなくても、再生はチャンクファイルから行える
+            logger.error(f'Caught exception: {ex} at FlightRecorder._close_chunk')
+
+    def _write_manifest(self):
+        with open(os.path.join(self.directory, MANIFEST_FILE), 'w') as f:
+            json.dump({'chunks': self._chunks}, f, indent=2)
+
+    def stats(self):
+        return {
+            'directory': self.directory,
+            'recording': self.is_running,
+            'records': self.records,
+            'dropped_records': self.dropped_records,
+            'bytes_written': self.bytes_written,
+            'pending_records': self._queue.qsize(),
+            'chunks': self._chunk_index + 1,
+        }
+
+
+class FlightRecording:
+    """
+    FlightRecorderで記録したディレクトリを読む
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        # 記録中に終了した場合はマニフェストが古いことがあるため、チャンクはファイルから探す
+        self.chunks = sorted(os.path.basename(path)
+                             for path in glob.glob(os.path.join(directory, 'chunk_*.bin')))
+        if not self.chunks:
+            raise ErrorFlightRecordingNotFound(f'{directory} has no recorded chunks')
+
+    def index(self, chunk_number):
+        """
+        Returns:
+            チャンクのインデックス (INDEX_DTYPE の配列)
+        """
+        path = os.path.join(self.directory, INDEX_FILE_FORMAT.format(chunk_number))
+        return np.fromfile(path, dtype=INDEX_DTYPE)
+
+    def records(self, record_types=None):
+        """
+        記録を時刻順に返す
+        Args:
+            record_types: 返す記録の種類の集合。Noneの場合は全て
+        Yields:
+            (種類, 時刻, ペイロードのバイト列)
+        """
+        for chunk in self.chunks:
+            path = os.path.join(self.directory, chunk)
+            if os.path.getsize(path) == 0:
+                continue
+            with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                offset = 0
+                while offset + RECORD_HEADER.size <= len(data):
+                    record_type, timestamp, size = RECORD_HEADER.unpack_from(data, offset)
+                    offset += RECORD_HEADER.size
+                    if offset + size > len(data):
+                        # 書き込み途中で終了した記録
+                        break
+                    if record_types is None or record_type in record_types:
+                        yield record_type, timestamp, data[offset:offset + size]
+                    offset += size
+
+    @staticmethod
+    def decode_payload(record_type, payload):
+        if record_type == RECORD_VIDEO:
+            return payload
+        if record_type in (RECORD_COMMAND, RECORD_RESPONSE):
+            return payload.decode('utf-8', errors='replace')
+        if record_type == RECORD_STATE:
+            return np.frombuffer(payload, dtype='<f4')
+        return json.loads(payload)
+
+
+class FlightReplayer:
+    """
+    記録した映像をデコーダと検出処理に通す。
+    フレームごとに同期して検出するため、実時間より速く、毎回同じ結果で再生できる
+    """
+
+    def __init__(self, recording, video_decoder, frame_ring):
+        """
+        Args:
+            recording: FlightRecording
+            video_decoder: VideoDecoder。フレームを同期して出力するPyAVDecoderを使うこと
+            frame_ring: video_decoderの出力先のFrameRing
+        """
+        self.recording = recording
+        self.video_decoder = video_decoder
+        self.frame_ring = frame_ring
+
+    def run(self, on_frame=None, speed=0.0):
+        """
+        Args:
+            on_frame: デコードしたフレームごとに (seq, frame) で呼び出す関数
+            speed: 再生速度の倍率。0の場合は最大速度で再生する
+        Returns:
+            再生したフレーム数
+        """
+        self.video_decoder.start()
+        first_timestamp = None
+        start_time = time.perf_counter()
+        seq = self.frame_ring.latest()[0]
+        frames = 0
+        for _, timestamp, payload in self.recording.records({RECORD_VIDEO}):
+            if speed > 0:
+                if first_timestamp is None:
+                    first_timestamp = timestamp
+                wait = (timestamp - first_timestamp) / speed - (time.perf_counter() - start_time)
+                if wait > 0:
+                    time.sleep(wait)
+            self.video_decoder.feed_access_unit(payload)
+            latest_seq, frame = self.frame_ring.latest()
+            if latest_seq == seq:
+                continue
+            seq = latest_seq
+            frames += 1
+            if on_frame is not None:
+                on_frame(seq, frame)
+        return frames
+
+
+class ErrorFlightRecordingNotFound(Exception):
+    """Error no flight recording in the directory"""
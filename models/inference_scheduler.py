@@ -0,0 +1,178 @@
+import math
+import threading
+import time
+
+# 処理時間の指数移動平均の重み
+LATENCY_SMOOTHING = 0.2
+# 設定を見直す間隔(秒)
+ADJUST_INTERVAL = 1.0
+# 予算に対してこの割合を下回ったら、精度の高い設定に戻す
+UPGRADE_HEADROOM = 0.6
+DEFAULT_CPU_BUDGET = 0.3
+DEFAULT_LATENCY_BUDGET = 0.05
+
+
+class InferenceSettings:
+    """
+    推論の負荷を決める設定
+    """
+    __slots__ = ('stride', 'downscale', 'scale_factor', 'min_neighbors')
+
+    def __init__(self, stride, downscale, scale_factor, min_neighbors):
+        """
+        Args:
+            stride: 何フレームに1回推論するか
+            downscale: 全画面の顔検出を行う画像の縮小率
+            scale_factor: detectMultiScaleのscaleFactor
+            min_neighbors: detectMultiScaleのminNeighbors
+        """
+        self.stride = stride
+        self.downscale = downscale
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+# 負荷の高い順(精度の高い順)の設定。予算を超えたら次の段階に下げる
+DEFAULT_LEVELS = (
+    InferenceSettings(stride=1, downscale=1.0, scale_factor=1.1, min_neighbors=5),
+    InferenceSettings(stride=1, downscale=0.75, scale_factor=1.2, min_neighbors=5),
+    InferenceSettings(stride=1, downscale=0.5, scale_factor=1.3, min_neighbors=5),
+    InferenceSettings(stride=2, downscale=0.5, scale_factor=1.3, min_neighbors=4),
+    InferenceSettings(stride=3, downscale=0.5, scale_factor=1.4, min_neighbors=4),
+    InferenceSettings(stride=4, downscale=0.35, scale_factor=1.5, min_neighbors=3),
+)
+# 従来の固定設定 (縮小率0.5, scaleFactor 1.3, minNeighbors 5) から始める
+DEFAULT_INITIAL_LEVEL = 2
+
+
+class InferenceScheduler:
+    """
+    推論の処理時間を計測し、CPUの使用率と1回の処理時間が予算内に収まるように設定の段階を切り替える。
+    CPUの使用率は、推論スレッドが処理していた時間の割合 (1コアに対する割合) で見積もる。
+    """
+
+    def __init__(self, cpu_budget=DEFAULT_CPU_BUDGET, latency_budget=DEFAULT_LATENCY_BUDGET,
+                 levels=DEFAULT_LEVELS, initial_level=DEFAULT_INITIAL_LEVEL, adjust_interval=ADJUST_INTERVAL):
+        """
+        Args:
+            cpu_budget: 推論に使ってよい1コアあたりの割合
+            latency_budget: 1フレームの推論にかけてよい時間(秒)
+            levels: 負荷の高い順のInferenceSettingsのリスト
+            initial_level: 最初に使うlevelsのインデックス
+            adjust_interval: 設定を見直す間隔(秒)
+        """
+        self.cpu_budget = cpu_budget
+        self.latency_budget = latency_budget
+        self.levels = levels
+        self.adjust_interval = adjust_interval
+
+        self._lock = threading.Lock()
+        self._level = initial_level
+        self.latencies = {}
+        self._window_start = time.perf_counter()
+        self._window_busy = 0.0
+        self._window_stages = set()
+
+        self.cpu_usage = 0.0
+        self.adjustments = 0
+
+    @property
+    def level(self):
+        return self._level
+
+    @property
+    def settings(self):
+        """
+        現在の設定。推論の前に毎回参照する
+        """
+        return self.levels[self._level]
+
+    def should_process(self, seq, last_seq):
+        """
+        Args:
+            seq: 処理しようとしているフレームのシーケンス番号
+            last_seq: 前回処理したフレームのシーケンス番号
+        Returns:
+            strideに従って処理すべきフレームなら True
+        """
+        return seq - last_seq >= self.settings.stride
+
+    def record(self, stage, elapsed):
+        """
+        推論の処理時間を記録し、必要なら設定を切り替える
+        Args:
+            stage: 処理の名前
+            elapsed: 処理時間(秒)
+        """
+        now = time.perf_counter()
+        with self._lock:
+            latency = self.latencies.get(stage)
+            if latency is None:
+                self.latencies[stage] = elapsed
+            else:
+                self.latencies[stage] = latency + LATENCY_SMOOTHING * (elapsed - latency)
+            self._window_busy += elapsed
+            self._window_stages.add(stage)
+            if now - self._window_start >= self.adjust_interval:
+                self._adjust(now)
+
+    def _adjust(self, now):
+        self.cpu_usage = self._window_busy / (now - self._window_start)
+        latency = max(self.latencies[stage] for stage in self._window_stages)
+
+        if self.cpu_usage > self.cpu_budget or latency > self.latency_budget:
+            level = min(self._level + 1, len(self.levels) - 1)
+        elif self.cpu_usage < self.cpu_budget * UPGRADE_HEADROOM and \
+                latency < self.latency_budget * UPGRADE_HEADROOM:
+            level = max(self._level - 1, 0)
+        else:
+            level = self._level
+        if level != self._level:
+            self._level = level
+            self.adjustments += 1
+
+        self._window_start = now
+        self._window_busy = 0.0
+        self._window_stages = set()
+
+    def reset_window(self):
+        """
+        推論を止めていた時間を使用率に含めないように、計測をやり直す
+        """
+        with self._lock:
+            self._window_start = time.perf_counter()
+            self._window_busy = 0.0
+            self._window_stages = set()
+
+    def set_budget(self, cpu_budget=None, latency_budget=None):
+        """
+        Args:
+            cpu_budget: CPU使用率の予算。Noneの場合は変えない
+            latency_budget: 1回の推論の処理時間(秒)の予算。Noneの場合は変えない
+        Raises:
+            ValueError: 予算が正の有限の数でない場合。どちらの予算も変えない
+        """
+        for name, budget in (('cpu_budget', cpu_budget), ('latency_budget', latency_budget)):
+            # 'nan' や 'inf' もfloatとして読めてしまい、nanでは比較が常に偽になって設定を下げられなくなる
+            if budget is not None and not (math.isfinite(budget) and budget > 0):
+                raise ValueError(f'{name} must be a positive finite number: {budget}')
+        with self._lock:
+            if cpu_budget is not None:
+                self.cpu_budget = cpu_budget
+            if latency_budget is not None:
+                self.latency_budget = latency_budget
+
+    def stats(self):
+        with self._lock:
+            return {
+                'level': self._level,
+                'settings': self.settings.to_dict(),
+                'cpu_budget': self.cpu_budget,
+                'latency_budget': self.latency_budget,
+                'cpu_usage': self.cpu_usage,
+                'latency': dict(self.latencies),
+                'adjustments': self.adjustments,
+            }
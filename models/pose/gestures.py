@@ -0,0 +1,322 @@
+import collections
+import math
+import time
+
+from models.pose.person_pose import ELBOW_LEFT
+from models.pose.person_pose import ELBOW_RIGHT
+from models.pose.person_pose import HIP_LEFT
+from models.pose.person_pose import HIP_RIGHT
+from models.pose.person_pose import NOSE
+from models.pose.person_pose import SHOULDER_LEFT
+from models.pose.person_pose import SHOULDER_RIGHT
+from models.pose.person_pose import WRIST_LEFT
+from models.pose.person_pose import WRIST_RIGHT
+from models.pose.person_pose import X
+from models.pose.person_pose import Y
+
+# 姿勢 (utils.utils.pose_labelsのインデックス)
+NOMAL = 0
+HANDS_UP = 1
+LEFT_HAND_UP = 2
+RIGHT_HAND_UP = 3
+T_POSE = 4
+
+# 多数決をとるフレーム数
+DEFAULT_WINDOW = 5
+# 直近のフレームのうち、この割合以上で判定された姿勢を開始する
+DEFAULT_ENTER_CONFIDENCE = 0.6
+# 開始した姿勢は、この割合を下回るまで続いているとみなす
+DEFAULT_EXIT_CONFIDENCE = 0.4
+# 同じ姿勢を再び開始できるまでの時間(秒)
+DEFAULT_COOLDOWN = 2.0
+# 腰-肩-手首の角度がこの範囲ならTポーズ
+T_POSE_MIN_DEGREE = 85
+T_POSE_MAX_DEGREE = 115
+
+GESTURE_START = 'start'
+GESTURE_END = 'end'
+
+
+class Visible:
+    """
+    骨格点が全て有効
+    """
+    __slots__ = ('keypoints', )
+
+    def __init__(self, *keypoints):
+        self.keypoints = keypoints
+
+    def evaluate(self, features):
+        for keypoint in self.keypoints:
+            if not features.valid[keypoint]:
+                return False
+        return True
+
+
+class Above:
+    """
+    骨格点upperが骨格点lowerより上にある (画像座標でyが小さい)。どちらかが無効な場合は偽
+    """
+    __slots__ = ('upper', 'lower')
+
+    def __init__(self, upper, lower):
+        self.upper = upper
+        self.lower = lower
+
+    @property
+    def key(self):
+        return self.upper, self.lower
+
+    def evaluate(self, features):
+        return features.above[self.key]
+
+
+class AngleBetween:
+    """
+    点A(first)，B(target)，C(second)がなす角∠ABCが [min_degree, max_degree] の範囲にある。
+    いずれかの骨格点が無効な場合は偽
+    """
+    __slots__ = ('first', 'target', 'second', 'min_degree', 'max_degree')
+
+    def __init__(self, first, target, second, min_degree=0, max_degree=180):
+        self.first = first
+        self.target = target
+        self.second = second
+        self.min_degree = min_degree
+        self.max_degree = max_degree
+
+    @property
+    def key(self):
+        return self.first, self.target, self.second
+
+    def evaluate(self, features):
+        degree = features.angles[self.key]
+        return degree is not None and self.min_degree <= degree <= self.max_degree
+
+
+class AllOf:
+    __slots__ = ('conditions', )
+
+    def __init__(self, *conditions):
+        self.conditions = conditions
+
+    def evaluate(self, features):
+        for condition in self.conditions:
+            if not condition.evaluate(features):
+                return False
+        return True
+
+
+class AnyOf:
+    __slots__ = ('conditions', )
+
+    def __init__(self, *conditions):
+        self.conditions = conditions
+
+    def evaluate(self, features):
+        for condition in self.conditions:
+            if condition.evaluate(features):
+                return True
+        return False
+
+
+class Gesture:
+    """
+    姿勢の定義。conditionsが全て成り立つフレームをこの姿勢と判定する
+    """
+    __slots__ = ('pose', 'name', 'conditions')
+
+    def __init__(self, pose, name, *conditions):
+        self.pose = pose
+        self.name = name
+        self.conditions = AllOf(*conditions)
+
+
+def _left_hand_up():
+    return AllOf(Visible(WRIST_LEFT, ELBOW_LEFT, NOSE),
+                 AnyOf(Above(WRIST_LEFT, NOSE), Above(ELBOW_LEFT, NOSE)))
+
+
+def _right_hand_up():
+    return AllOf(Visible(WRIST_RIGHT, ELBOW_RIGHT, NOSE),
+                 AnyOf(Above(WRIST_RIGHT, NOSE), Above(ELBOW_RIGHT, NOSE)))
+
+
+# 判定する順に並べる。どれにも当てはまらない場合はNOMAL
+GESTURES = (
+    Gesture(HANDS_UP, 'hands_up', _left_hand_up(), _right_hand_up()),
+    Gesture(LEFT_HAND_UP, 'left_hand_up', _left_hand_up()),
+    Gesture(RIGHT_HAND_UP, 'right_hand_up', _right_hand_up()),
+    Gesture(T_POSE, 't_pose',
+            AngleBetween(HIP_LEFT, SHOULDER_LEFT, WRIST_LEFT, T_POSE_MIN_DEGREE, T_POSE_MAX_DEGREE),
+            AngleBetween(HIP_RIGHT, SHOULDER_RIGHT, WRIST_RIGHT, T_POSE_MIN_DEGREE, T_POSE_MAX_DEGREE)),
+)
+
+
+class PoseFeatures:
+    """
+    1フレーム分の、姿勢の定義で使う位置関係と角度の計算結果
+    """
+    __slots__ = ('valid', 'above', 'angles')
+
+    def __init__(self, valid, above, angles):
+        """
+        Args:
+            valid: 骨格点ごとの有効かどうかのリスト
+            above: (upper, lower) -> 真偽の辞書
+            angles: (first, target, second) -> 角度(度)の辞書。骨格点が無効な場合は None
+        """
+        self.valid = valid
+        self.above = above
+        self.angles = angles
+
+
+def _angle(xy, first, target, second):
+    # 点A(first)，B(target)，C(second)がなす角∠ABC (点B周りの角度)。骨格点の数が少ないためnumpyを使わない方が速い
+    ax, ay = xy[first][X] - xy[target][X], xy[first][Y] - xy[target][Y]
+    cx, cy = xy[second][X] - xy[target][X], xy[second][Y] - xy[target][Y]
+    length = math.sqrt((ax * ax + ay * ay) * (cx * cx + cy * cy))
+    if length <= 0:
+        return None
+    return math.degrees(math.acos(min(max((ax * cx + ay * cy) / length, -1.0), 1.0)))
+
+
+def _walk(condition):
+    yield condition
+    for child in getattr(condition, 'conditions', ()):
+        yield from _walk(child)
+
+
+class GestureClassifier:
+    """
+    姿勢の定義で使う位置関係と角度を集め、1フレームにつきまとめて1回ずつ計算してから各定義を判定する
+    """
+
+    def __init__(self, gestures=GESTURES):
+        self.gestures = gestures
+        # 条件のオブジェクトは他の分類器と共有することがあるため書き換えず、骨格点の組で計算結果を引く
+        above_pairs = {}
+        angle_triples = {}
+        for gesture in gestures:
+            for condition in _walk(gesture.conditions):
+                if isinstance(condition, Above):
+                    above_pairs[condition.key] = None
+                elif isinstance(condition, AngleBetween):
+                    angle_triples[condition.key] = None
+        self._above_pairs = tuple(above_pairs)
+        self._angle_triples = tuple(angle_triples)
+
+    def features(self, person_pose):
+        valid = person_pose.valid.tolist()
+        xy = person_pose.keypoints.tolist()
+        above = {(upper, lower): valid[upper] and valid[lower] and xy[upper][Y] < xy[lower][Y]
+                 for upper, lower in self._above_pairs}
+        angles = {triple: _angle(xy, *triple) if valid[triple[0]] and valid[triple[1]] and valid[triple[2]] else None
+                  for triple in self._angle_triples}
+        return PoseFeatures(valid, above, angles)
+
+    def classify(self, person_pose):
+        """
+        Returns:
+            最初に条件が成り立った定義の姿勢。どれにも当てはまらない場合はNOMAL
+        """
+        features = self.features(person_pose)
+        for gesture in self.gestures:
+            if gesture.conditions.evaluate(features):
+                return gesture.pose
+        return NOMAL
+
+
+class GestureEvent:
+    """
+    姿勢の開始 (GESTURE_START) または終了 (GESTURE_END)
+    """
+    __slots__ = ('pose', 'kind', 'confidence', 'timestamp')
+
+    def __init__(self, pose, kind, confidence, timestamp):
+        self.pose = pose
+        self.kind = kind
+        self.confidence = confidence
+        self.timestamp = timestamp
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class GestureDebouncer:
+    """
+    フレームごとの判定を直近window個の多数決で安定させ、姿勢の開始と終了をイベントにする。
+    票数はフレームの出入りで増減させるため、1フレームの更新はwindowの大きさによらない。
+    開始と終了の割合を分けて (ヒステリシス) 境目で判定がばたつかないようにし、
+    同じ姿勢は前の開始からcooldown秒経つまで開始しない
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW, enter_confidence=DEFAULT_ENTER_CONFIDENCE,
+                 exit_confidence=DEFAULT_EXIT_CONFIDENCE, cooldown=DEFAULT_COOLDOWN, cooldowns=None):
+        """
+        Args:
+            window: 多数決をとるフレーム数
+            enter_confidence: 姿勢を開始する割合
+            exit_confidence: 姿勢を終了する割合。enter_confidence以下にする
+            cooldown: 同じ姿勢を再び開始できるまでの時間(秒)
+            cooldowns: 姿勢ごとにcooldownを変える場合の {姿勢: 秒}
+        """
+        if not 0 < exit_confidence <= enter_confidence <= 1:
+            raise ValueError('confidence must be 0 < exit_confidence <= enter_confidence <= 1')
+        self.window = window
+        self.enter_confidence = enter_confidence
+        self.exit_confidence = exit_confidence
+        self.cooldown = cooldown
+        self.cooldowns = cooldowns or {}
+        self._last_started = {}
+        self.reset()
+        self.events = 0
+        self.suppressed = 0
+
+    def reset(self):
+        # 初期値は全てNOMAL
+        self._poses = collections.deque([NOMAL] * self.window)
+        self._votes = collections.Counter({NOMAL: self.window})
+        self.active = NOMAL
+
+    def confidence(self, pose):
+        return self._votes[pose] / self.window
+
+    def update(self, pose, timestamp=None):
+        """
+        1フレームの判定を加える
+        Args:
+            pose: このフレームで判定した姿勢
+            timestamp: 時刻(秒)。Noneの場合はtime.monotonic()
+        Returns:
+            GestureEventのリスト (通常は空)
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        self._votes[self._poses.popleft()] -= 1
+        self._poses.append(pose)
+        self._votes[pose] += 1
+
+        events = []
+        if self.active != NOMAL and self.confidence(self.active) < self.exit_confidence:
+            events.append(GestureEvent(self.active, GESTURE_END, self.confidence(self.active), timestamp))
+            self.active = NOMAL
+        # 票が増えたのはこのフレームの姿勢だけなので、開始を調べるのはそれだけでよい
+        if self.active == NOMAL and pose != NOMAL and self.confidence(pose) >= self.enter_confidence:
+            last_started = self._last_started.get(pose)
+            if last_started is not None and timestamp - last_started < self.cooldowns.get(pose, self.cooldown):
+                self.suppressed += 1
+            else:
+                self.active = pose
+                self._last_started[pose] = timestamp
+                events.append(GestureEvent(pose, GESTURE_START, self.confidence(pose), timestamp))
+        self.events += len(events)
+        return events
+
+    def stats(self):
+        return {
+            'active': self.active,
+            'confidence': self.confidence(self.active),
+            'events': self.events,
+            'suppressed': self.suppressed,
+        }
@@ -0,0 +1,74 @@
+import numpy as np
+
+from utils.utils import labels
+
+NUM_KEYPOINTS = len(labels)
+
+# 骨格点のインデックス (utils.utils.labels と同じ順番)
+NOSE = 0
+EYE_LEFT = 1
+EYE_RIGHT = 2
+EAR_LEFT = 3
+EAR_RIGHT = 4
+SHOULDER_LEFT = 5
+SHOULDER_RIGHT = 6
+ELBOW_LEFT = 7
+ELBOW_RIGHT = 8
+WRIST_LEFT = 9
+WRIST_RIGHT = 10
+HIP_LEFT = 11
+HIP_RIGHT = 12
+KNEE_LEFT = 13
+KNEE_RIGHT = 14
+ANKLE_LEFT = 15
+ANKLE_RIGHT = 16
+
+# keypoints の列
+X = 0
+Y = 1
+SCORE = 2
+
+
+class PersonPose:
+    """
+    1人分の骨格点。(17, 3) の [x, y, score] 配列と、信頼度が閾値を超えた骨格点のマスクを持つ
+    """
+    __slots__ = ('keypoints', 'valid')
+
+    def __init__(self, keypoints=None, valid=None):
+        """
+        Args:
+            keypoints: (17, 3) の [x, y, score] 配列。Noneの場合は0で初期化する
+            valid: (17, ) の有効な骨格点のマスク。Noneの場合は全て無効
+        """
+        if keypoints is None:
+            keypoints = np.zeros((NUM_KEYPOINTS, 3), dtype=np.float32)
+        if valid is None:
+            valid = np.zeros(NUM_KEYPOINTS, dtype=bool)
+        self.keypoints = keypoints
+        self.valid = valid
+
+    @property
+    def xy(self):
+        return self.keypoints[:, :SCORE]
+
+    @property
+    def scores(self):
+        return self.keypoints[:, SCORE]
+
+    def is_valid(self, *indices):
+        return bool(self.valid[list(indices)].all())
+
+    def to_dict(self):
+        """
+        Returns:
+            {部位: {'x', 'y', 'score'}} の辞書。無効な骨格点の値は None
+        """
+        person_keypoints = {}
+        for index, label in enumerate(labels):
+            if self.valid[index]:
+                x, y, score = self.keypoints[index].tolist()
+                person_keypoints[label] = {'x': x, 'y': y, 'score': score}
+            else:
+                person_keypoints[label] = {'x': None, 'y': None, 'score': None}
+        return person_keypoints
@@ -0,0 +1,244 @@
+import logging
+import threading
+import time
+
+from models.detection.person_keypoints.person_tracker import PersonIdentityTracker
+from models.pose.gestures import GESTURE_START
+from models.pose.gestures import HANDS_UP
+from models.pose.gestures import LEFT_HAND_UP
+from models.pose.gestures import RIGHT_HAND_UP
+from models.pose.gestures import T_POSE
+from models.pose.person_pose import PersonPose
+from models.pose.pose_estimator import HumanPoseEstimator
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# 姿勢ごとのドローンへのコマンド
+POSE_COMMANDS = {
+    HANDS_UP: 'up 30',
+    LEFT_HAND_UP: 'left 30',
+    RIGHT_HAND_UP: 'right 30',
+    T_POSE: 'land',
+}
+DEFAULT_SCORE_THRESHOLD = 0.3
+FRAME_WAIT_TIMEOUT = 1.0
+STAGES = ('preprocess', 'invoke', 'postprocess', 'estimate')
+# 処理時間の指数移動平均の重み
+LATENCY_SMOOTHING = 0.1
+
+DETECTION_SECONDS = metrics.histogram('tello_detection_seconds', 'Time to run detection on one frame', ('stage', ))
+STAGE_SECONDS = {stage: DETECTION_SECONDS.labels(f'pose_{stage}') for stage in STAGES}
+
+
+class PoseResult:
+    """
+    姿勢推定の結果
+    """
+    __slots__ = ('seq', 'keypoints', 'pose', 'timestamp')
+
+    def __init__(self, seq, keypoints, pose, timestamp):
+        self.seq = seq
+        self.keypoints = keypoints
+        self.pose = pose
+        self.timestamp = timestamp
+
+    def to_dict(self):
+        return {'seq': self.seq, 'pose': self.pose, 'keypoints': self.keypoints.to_dict()}
+
+
+class PoseControlWorker:
+    """
+    最新フレームに対して骨格検知を行い、複数フレームの判定から姿勢が始まったときにドローンのコマンドを送る。
+    推論は最大num_workers個のスレッドで行い、推論が追いつかないフレームは読み飛ばす。
+    TFLiteのInterpreterはスレッドセーフではないため、スレッドごとに骨格検知モデルを持つ。
+    """
+
+    def __init__(self, frame_ring, predictor_factory, on_pose_command, num_workers=1,
+                 score_threshold=DEFAULT_SCORE_THRESHOLD, predictor_release=None, scheduler=None, on_result=None,
+                 gesture_debouncer=None):
+        """
+        Args:
+            frame_ring: 入力フレームのFrameRing
+            predictor_factory: PersonKpPredictorを生成する関数
+            on_pose_command: 姿勢が始まったときにコマンド文字列で呼び出す関数
+            num_workers: 推論スレッドの数
+            score_threshold: 骨格点の信頼度スコアの閾値
+            predictor_release: スレッドの終了時に使い終わったPersonKpPredictorを渡す関数
+            scheduler: InferenceScheduler。指定した場合は推論するフレームの間隔を負荷に合わせて変える
+            on_result: 姿勢を推定するたびにPoseResultで呼び出す関数
+            gesture_debouncer: GestureDebouncer。Noneの場合は既定の設定を使う
+        """
+        self.frame_ring = frame_ring
+        self.predictor_factory = predictor_factory
+        self.predictor_release = predictor_release
+        self.scheduler = scheduler
+        self.on_result = on_result
+        self.on_pose_command = on_pose_command
+        self.num_workers = num_workers
+        self.score_threshold = score_threshold
+
+        self.pose_estimator = HumanPoseEstimator(debouncer=gesture_debouncer)
+        # 複数人が写っている場合に操作者を選ぶ
+        self.person_tracker = PersonIdentityTracker()
+        self._lock = threading.Lock()
+        self._claimed_seq = 0
+        self._estimated_seq = 0
+        self._latest_result = None
+
+        self._stop_flag = threading.Event()
+        self._threads = []
+
+        self.latencies = {stage: 0.0 for stage in STAGES}
+        self.processed_frames = 0
+        self.stale_results = 0
+        # 前処理の間に書き込み側がスロットを再利用したため推論しなかったフレーム数
+        self.overwritten_frames = 0
+
+    @property
+    def is_running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def start(self):
+        if self.is_running:
+            return
+        self._stop_flag.clear()
+        self.pose_estimator.reset()
+        self.person_tracker.reset()
+        if self.scheduler is not None:
+            self.scheduler.reset_window()
+        self._threads = [threading.Thread(target=self._run, args=(self._stop_flag, ), daemon=True)
+                         for _ in range(self.num_workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stop_flag.set()
+        for thread in self._threads:
+            thread.join(timeout=2.0)
+        self._threads = []
+        with self._lock:
+            self._latest_result = None
+
+    def latest_result(self):
+        """
+        Returns:
+            最新のPoseResult。まだ推定していない場合は None
+        """
+        with self._lock:
+            return self._latest_result
+
+    def _claim_frame(self, stop_flag):
+        """
+        他のスレッドがまだ処理していない最新フレームを取得する
+        """
+        skipped_seq = 0
+        while not stop_flag.is_set():
+            with self._lock:
+                claimed_seq = self._claimed_seq
+            latest = self.frame_ring.wait_next(max(claimed_seq, skipped_seq), timeout=FRAME_WAIT_TIMEOUT)
+            if latest is None:
+                continue
+            seq, frame = latest
+            with self._lock:
+                if seq <= self._claimed_seq:
+                    continue
+                if self.scheduler is not None and not self.scheduler.should_process(seq, self._claimed_seq):
+                    # strideに満たないフレームは読み飛ばし、次のフレームを待つ
+                    skipped_seq = seq
+                    continue
+                self._claimed_seq = seq
+            return seq, frame
+        return None
+
+    def _record_latency(self, stage, elapsed):
+        STAGE_SECONDS[stage].observe(elapsed)
+        if self.processed_frames == 0:
+            self.latencies[stage] = elapsed
+        else:
+            self.latencies[stage] += LATENCY_SMOOTHING * (elapsed - self.latencies[stage])
+
+    def _run(self, stop_flag):
+        try:
+            predictor = self.predictor_factory()
+        except Exception as ex:
+            logger.error(f'Caught exception: {ex} at PoseControlWorker._run')
+            return
+
+        try:
+            while not stop_flag.is_set():
+                claimed = self._claim_frame(stop_flag)
+                if claimed is None:
+                    break
+                seq, frame = claimed
+                try:
+                    self.process_frame(predictor, seq, frame)
+                except Exception as ex:
+                    logger.error(f'Caught exception: {ex} at PoseControlWorker._run')
+        finally:
+            if self.predictor_release is not None:
+                self.predictor_release(predictor)
+
+    def process_frame(self, predictor, seq, frame):
+        """
+        1フレームの骨格検知と姿勢推定を行う。記録の再生ではスレッドを使わずに直接呼び出す
+        """
+        start_time = time.perf_counter()
+        predictor.preprocess(frame)
+        preprocessed_time = time.perf_counter()
+        # 前処理で入力テンソルにコピーした後はフレームを参照しない。コピー中に上書きされていたら捨てる
+        if self.frame_ring.is_overwritten(seq):
+            with self._lock:
+                self.overwritten_frames += 1
+            return
+        predictor.interpreter.invoke()
+        invoked_time = time.perf_counter()
+        persons = predictor.get_persons(self.score_threshold)
+        postprocessed_time = time.perf_counter()
+
+        with self._lock:
+            if seq <= self._estimated_seq:
+                # 他のスレッドが新しいフレームを推定済み
+                self.stale_results += 1
+                if self.scheduler is not None:
+                    self.scheduler.record('pose', postprocessed_time - start_time)
+                return
+            self._estimated_seq = seq
+            if len(persons) == 1 and persons[0][1] is None:
+                keypoints = persons[0][0]
+            else:
+                # 操作者だけ姿勢を推定する
+                keypoints = self.person_tracker.select(persons)
+            if keypoints is None:
+                keypoints = PersonPose()
+            pose = self.pose_estimator.pose_estimate(keypoints, check_multi_frame=True)
+            events = self.pose_estimator.events
+            estimated_time = time.perf_counter()
+            result = PoseResult(seq, keypoints, pose, estimated_time)
+            self._latest_result = result
+
+            self._record_latency('preprocess', preprocessed_time - start_time)
+            self._record_latency('invoke', invoked_time - preprocessed_time)
+            self._record_latency('postprocess', postprocessed_time - invoked_time)
+            self._record_latency('estimate', estimated_time - postprocessed_time)
+            self.processed_frames += 1
+            if self.scheduler is not None:
+                self.scheduler.record('pose', estimated_time - start_time)
+
+        if self.on_result is not None:
+            self.on_result(result)
+        for event in events:
+            command = POSE_COMMANDS.get(event.pose)
+            if event.kind == GESTURE_START and command is not None:
+                logger.info(f'pose: {event.pose} command: {command} (confidence {event.confidence:.2f})')
+                self.on_pose_command(command)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'processed_frames': self.processed_frames,
+                'stale_results': self.stale_results,
+                'overwritten_frames': self.overwritten_frames,
+                'latency': dict(self.latencies),
+                'gestures': self.pose_estimator.debouncer.stats(),
+            }
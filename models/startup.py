@@ -0,0 +1,124 @@
+import logging
+import threading
+import time
+
+from models.detection.person_keypoints.model_registry import TFLiteModelRegistry
+from models.fleet import TelloFleet
+from utils.singleton import Singleton
+
+logger = logging.getLogger(__name__)
+
+# リクエストがドローンの準備を待つ最大時間(秒)。これを超えたら 503 を返す
+FLEET_WAIT_TIMEOUT = 5.0
+# 初期化コマンドに応答のないドローンへ送り直す間隔(秒)
+HANDSHAKE_RETRY_INTERVAL = 3.0
+
+
+class TelloStartup(metaclass=Singleton):
+    """
+    サーバーの起動と並行して、バックグラウンドのスレッドでドローンの接続 (ソケット・スレッドの準備と
+    初期化コマンドの送信) を行う。最初のページは接続を待たずに返し、ドローンを使うリクエストだけが準備を待つ。
+    準備の状況は health で各部分ごとに返す
+    """
+
+    def __init__(self, fleet_factory=TelloFleet):
+        """
+        Args:
+            fleet_factory: TelloFleetを返す関数
+        """
+        self._fleet_factory = fleet_factory
+        self._fleet = None
+        self._ready = threading.Event()
+        self._thread = None
+        self.error = None
+        self.created_time = time.perf_counter()
+        self.fleet_seconds = None
+
+    @property
+    def is_started(self):
+        return self._thread is not None
+
+    def start(self):
+        """
+        ドローンの接続をバックグラウンドで始める。サーバーを起動する前に呼び出す
+        """
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='tello-startup', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        start_time = time.perf_counter()
+        try:
+            self._fleet = self._fleet_factory()
+        except Exception as ex:
+            logger.error(f'Caught exception: {ex} at TelloStartup._run')
+            self.error = str(ex)
+        else:
+            self.fleet_seconds = time.perf_counter() - start_time
+            logger.info(f'drone session is ready in {self.fleet_seconds:.3f} seconds')
+        self._ready.set()
+        if self._fleet is not None:
+            self._retry_handshakes(self._fleet)
+
+    def _retry_handshakes(self, fleet):
+        # ドローンの電源を入れる前にサーバーを起動した場合は、応答があるまで初期化コマンドを送り直す
+        while not fleet.stop_flag.wait(HANDSHAKE_RETRY_INTERVAL):
+            waiting = [drone for drone in fleet.drones().values() if not drone.is_connected]
+            if not waiting:
+                return
+            for drone in waiting:
+                if drone.handshake.done():
+                    logger.info(f'retry handshake with {drone.drone_id}')
+                    drone.connect()
+
+    def fleet(self, timeout=FLEET_WAIT_TIMEOUT):
+        """
+        Returns:
+            準備のできたTelloFleet。バックグラウンドで起動していない場合 (ベンチマークなど) はその場で生成する
+        """
+        if self._thread is None:
+            return TelloFleet()
+        if not self._ready.wait(timeout):
+            raise ErrorStartupNotReady('drone session is still starting')
+        if self._fleet is None:
+            raise ErrorStartupNotReady(f'drone session failed to start: {self.error}')
+        return self._fleet
+
+    def health(self):
+        """
+        Returns:
+            (ready, 各部分の準備の状況の辞書)
+        """
+        try:
+            fleet = self.fleet(timeout=0)
+        except ErrorStartupNotReady:
+            fleet = None
+        if fleet is None:
+            fleet_status = {'ready': False, 'error': self.error, 'starting': self.error is None}
+            drones = {}
+        else:
+            fleet_status = {'ready': True, 'seconds': self.fleet_seconds}
+            drones = {drone_id: drone.health() for drone_id, drone in fleet.drones().items()}
+        # 映像・顔検出・姿勢認識は使うときに準備するため、コマンドの応答だけを準備完了の条件にする
+        ready = fleet_status['ready'] and bool(drones) and all(drone['command']['ready'] for drone in drones.values())
+        if ready:
+            status = 'ready'
+        elif self.error is not None:
+            status = 'error'
+        elif fleet_status['ready']:
+            status = 'waiting_for_drone'
+        else:
+            status = 'starting'
+        return ready, {
+            'status': status,
+            'uptime': time.perf_counter() - self.created_time,
+            'fleet': fleet_status,
+            'drones': drones,
+            # 骨格検知モデルは姿勢認識を最初に有効にしたときに読み込む
+            'models': {'tflite': TFLiteModelRegistry().stats()},
+        }
+
+
+class ErrorStartupNotReady(Exception):
+    """Error drone session is not ready yet or failed to start"""
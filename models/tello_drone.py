@@ -1,277 +1,693 @@
-import logging
-import socket
-import threading
-import time
-import cv2
-import subprocess
-import numpy as np
-import signal
-import os
-import contextlib
-
-from utils.singleton import Singleton
-
-logger = logging.getLogger(__name__)
-
-HOST_IP = '192.168.10.2'
-DRONE_IP = '192.168.10.1'
-SEND_COMMAND_PORT = 8889
-VIDEO_PORT = 11111
-DEFAULT_DRONE_MOVE_DISTANTE = 0.30
-DEFAULT_DRONE_MOVE_SPEED = 15
-FRAME_X = int(960/3)
-FRAME_Y = int(720/3)
-FRAME_AREA = FRAME_X * FRAME_Y
-# 画像はRBGで3次元
-FRAME_SIZE = FRAME_AREA * 3
-FRAME_CENTER_X = FRAME_X / 2
-FRAME_CENTER_Y = FRAME_Y / 2
-
-FFMPEG_COMMAND = (f'ffmpeg -hwaccel auto -hwaccel_device opencl -i pipe:0 '
-                  f'-pix_fmt bgr24 -s {FRAME_X}x{FRAME_Y} -f rawvideo pipe:1')
-
-
-FACE_DETECT_XML_FILE = './tello_drone_app/models/detection/face/haarcascade_frontalface_default.xml'
-
-
-class TelloDrone(metaclass=Singleton):
-    def __init__(self, host_ip=HOST_IP, host_port=SEND_COMMAND_PORT, 
-              drone_ip=DRONE_IP, drone_port=SEND_COMMAND_PORT, 
-                 move_speed=DEFAULT_DRONE_MOVE_SPEED, video_port=VIDEO_PORT):
-        
-        self.host_ip = host_ip
-        self.host_port = host_port                    
-        
-        self.drone_ip = drone_ip
-        self.drone_port = drone_port
-        self.drone_address = (self.drone_ip, self.drone_port)
-        self.move_speed = move_speed
-        self.video_port = video_port
-
-        self.stop_flag = threading.Event()
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.socket.bind((self.host_ip, self.host_port))
-        self.response = None
-        self._receive_thread = threading.Thread(target=self.receive_drone_response, args=(self.stop_flag, ))
-        self._receive_thread.start()
-
-        self.video_proc = subprocess.Popen(FFMPEG_COMMAND.split(' '), stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-        self.video_proc_stdin = self.video_proc.stdin
-        self.video_proc_stdout = self.video_proc.stdout
-        self._receive_video_thread = threading.Thread(target=self.receive_drone_video, 
-                                                      args=(self.stop_flag, self.video_proc_stdin,
-                                                            self.host_ip, self.video_port))
-        # self._receive_video_thread.start()
-
-        if not os.path.exists(FACE_DETECT_XML_FILE):
-            raise ErrorNotFoundFaceDetectXmlFile(f'{FACE_DETECT_XML_FILE} is not exists')
-        self.face_cascade = cv2.CascadeClassifier(FACE_DETECT_XML_FILE)
-        self._is_use_face_detect = False
-
-
-        self._command_semaphore = threading.Semaphore(1)
-        self._command_thread = None
-
-        # コマンドの初期化
-        self.socket.sendto(b'command', self.drone_address)
-        self.socket.sendto(b'streamon', self.drone_address)
-
-        self.set_speed(self.move_speed)
-
-    def __del__(self):
-        self.stop()
-
-    def stop(self):
-        self.stop_flag.set()
-        self.socket.close()
-        os.kill(self.video_proc.pid, signal.CTRL_C_EVENT)
-        print('ffmpeg is killed!!!!!!!!!!!!')
-        
-
-    def receive_drone_response(self, stop_flag):
-        while not stop_flag.is_set():
-            try:
-                # Telloのサンプルコードと同様に3000
-                self.response, ip = self.socket.recvfrom(3000)
-                logger.info(f'receive_thread: {self.response}')
-            except socket.error as ex:
-                logger.error(f'Caught exception socket.error: {ex} at receive_drone_response')
-                break
-
-    def receive_drone_video(self, stop_flag, pipe_in, host_ip,video_port):
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as socket_video:
-            socket_video.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            socket_video.settimeout(.5)
-            socket_video.bind((host_ip, video_port))
-            video_data = bytearray(2048)
-
-            while not stop_flag.is_set():
-                try:
-                    data_size, address = socket_video.recvfrom_into(video_data)
-                    # logger.info(f'receive_drone_video: {video_data}')
-                except socket.timeout as ex:
-                    logger.warning(f'Caught exception socket.timeout: {ex} at receive_drone_video')
-                    time.sleep(0.5)
-                    continue
-                except socket.error as ex:
-                    logger.error(f'Caught exception socket.error: {ex} at receive_drone_video')
-                    break
-
-                try:
-                    pipe_in.write(video_data[:data_size])
-                    pipe_in.flush()
-                except Exception as ex:
-                    logger.error(f'Caught exception: {ex} at receive_drone_video')
-                    break
-
-
-    def send_command(self, command, blocknig=True):
-        self._command_thread = threading.Thread(
-            target=self._send_command,
-            args=(command, blocknig,))
-        self._command_thread.start()
-    
-    def _send_command(self, command, blocknig=True):
-
-        is_acquire = self._command_semaphore.acquire(blocking=blocknig)
-        if is_acquire:
-            with contextlib.ExitStack() as stack:
-                stack.callback(self._command_semaphore.release)
-                logger.info(f'send_command: {command}')
-                self.socket.sendto(command.encode('utf-8'), self.drone_address)
-
-                retry = 0
-                while self.response is None:
-                    time.sleep(0.3)
-                    if retry > 3:
-                        break
-                    retry += 1
-
-                if self.response is None:
-                    response = None
-                else:
-                    response = self.response.decode('utf-8')
-
-                self.response = None
-                
-                return response
-        else:
-            logger.warning(f'Not acquire')
-
-    
-    def set_speed(self, speed):
-        return self.send_command(f'speed {speed}')
-
-    def takeoff(self):
-        return self.send_command('takeoff')
-
-    def land(self):
-        return self.send_command('land')
-    
-    def move(self, direction, distance):
-        distance = float(distance)
-        distance = int(round(distance * 100))
-        return self.send_command(f'{direction} {distance}')
-    
-    def move_forward(self, distance=DEFAULT_DRONE_MOVE_DISTANTE):
-        return self.move('forward', distance)
-    
-    def move_backward(self, distance=DEFAULT_DRONE_MOVE_DISTANTE):
-        return self.move('back', distance)
-    
-    def move_up(self, distance=DEFAULT_DRONE_MOVE_DISTANTE):
-        return self.move('up', distance)
-
-    def move_down(self, distance=DEFAULT_DRONE_MOVE_DISTANTE):
-        return self.move('down', distance)
-
-    def move_right(self, distance=DEFAULT_DRONE_MOVE_DISTANTE):
-        return self.move('right', distance)
-
-    def move_left(self, distance=DEFAULT_DRONE_MOVE_DISTANTE):
-        return self.move('left', distance)
-    
-    def rotate_clockwise(self, degrees=90):
-        return self.send_command(f'cw {degrees}')
-
-    def rotate_counter_clockwise(self, degrees=90):
-        return self.send_command(f'ccw {degrees}')
-
-    def flip(self, direction):
-        return self.send_command(f'flip {direction}')
-    
-    def flip_forward(self):
-        return self.flip('f')
-    
-    def flip_back(self):
-        return self.flip('b')
-    
-    def flip_right(self):
-        return self.flip('r')
-    
-    def flip_left(self):
-        return self.flip('l')
-    
-    def video_binary_generator(self):
-        while True:
-            try:
-                frame = self.video_proc_stdout.read(FRAME_SIZE)
-            except Exception as ex:
-                logger.error(f'Caught exception : {ex} at video_binary_generator')
-                continue
-
-            if not frame:
-                continue
-                
-            frame = np.fromstring(frame, np.uint8).reshape(FRAME_Y, FRAME_X, 3) 
-            yield frame
-
-    def enable_face_detect(self):
-        self._is_use_face_detect = True
-
-    def disable_face_detect(self):
-        self._is_use_face_detect = False
-        
-    def video_jpeg_generator(self):
-        for frame in self.video_binary_generator():
-            
-            if self._is_use_face_detect:
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                faces = self.face_cascade.detectMultiScale(gray, 1.3, 5)
-                for (x, y, w, h) in faces:
-                    cv2.rectangle(frame, (x,y), (x+w, y+h), (255, 0, 0), 2)
-
-                    face_cnter_x = x  + (w/2)
-                    face_cnter_y = y  + (h/2)
-
-                    diff_x = FRAME_CENTER_X - face_cnter_x
-                    diff_y = FRAME_CENTER_Y - face_cnter_y
-                    face_area = w * h
-                    percent_face = face_area / FRAME_AREA
-
-                    drone_x, drone_y, drone_z, speed = 0, 0, 0, self.move_speed
-                    if diff_x < -30:
-                        drone_y = -30
-                    if diff_x > 30:
-                        drone_y = 30
-                    if diff_y < -15:
-                        drone_z = -30
-                    if diff_y > 15:
-                        drone_z = 30
-                    if percent_face < 0.02:
-                        drone_x = 30
-                    if percent_face > 0.30:
-                        drone_x = -30
-                    
-                    self.send_command(f'go {drone_x} {drone_y} {drone_z} {speed}', blocknig=False)
- 
-                    break
-
-            _, jpeg = cv2.imencode('.jpg', frame)
-            jpeg_binary = jpeg.tobytes()
-            yield jpeg_binary
-
-
-
-class ErrorNotFoundFaceDetectXmlFile(Exception):
+import logging
+import socket
+import threading
+import time
+import cv2
+import numpy as np
+from concurrent.futures import CancelledError
+from functools import partial
+import os
+
+import settings
+
+from models.command_channel import CommandChannel
+from models.command_channel import ErrorCommand
+from models.detection.face.face_detectors import FACE_DETECTORS
+from models.detection.face.face_detectors import HAAR_CASCADE_FILE
+from models.detection.face.face_detectors import create_face_detector
+from models.detection.face.face_tracker import FaceDetectionWorker
+from models.flight_recorder import FlightRecorder
+from models.detection.person_keypoints import tflite_models
+from models.detection.person_keypoints.model_registry import TFLiteModelRegistry
+from models.inference_scheduler import InferenceScheduler
+from models.pose.gestures import GestureDebouncer
+from models.pose.pose_control import PoseControlWorker
+from models.tello_state import TelloStateReceiver
+from models.tello_state import state_to_dict
+from models.tracking_controller import RcTrackingController
+from models.video.decoders import create_video_decoder
+from models.video.frame_reader import FrameRing
+from models.video.jpeg_broadcaster import JpegFrameBroadcaster
+from models.video.jpeg_encoders import create_jpeg_encoder
+from models.video.pipeline import VideoPipeline
+from models.video.reassembler import H264Reassembler
+from models.video.receiver_pool import VIDEO_PACKETS
+from models.video.receiver_pool import VIDEO_RECEIVED_BYTES
+from utils.utils import render
+
+logger = logging.getLogger(__name__)
+
+
+HOST_IP = settings.TELLO_HOST_IP
+HOST_COMMAND_PORT = settings.TELLO_HOST_COMMAND_PORT
+DRONE_IP = settings.TELLO_DRONE_IP
+SEND_COMMAND_PORT = settings.TELLO_COMMAND_PORT
+VIDEO_PORT = settings.TELLO_VIDEO_PORT
+STATE_PORT = settings.TELLO_STATE_PORT
+# Telloが状態と映像を送る既定のポート。これ以外のポートで受信する場合は port コマンドで変更する
+TELLO_DEFAULT_VIDEO_PORT = 11111
+TELLO_DEFAULT_STATE_PORT = 8890
+DEFAULT_DRONE_MOVE_DISTANTE = 0.30
+DEFAULT_DRONE_MOVE_SPEED = 15
+# 応答の受信スレッドがstop_flagを確認する間隔(秒)
+RECEIVE_TIMEOUT = 0.5
+# この時間(秒)以上状態が届いていなければ、状態の受信は準備できていないとする
+STATE_STALE_SECONDS = 1.0
+FRAME_X = int(960/3)
+FRAME_Y = int(720/3)
+FRAME_AREA = FRAME_X * FRAME_Y
+# 画像はRBGで3次元
+FRAME_SIZE = FRAME_AREA * 3
+FRAME_CENTER_X = FRAME_X / 2
+FRAME_CENTER_Y = FRAME_Y / 2
+
+
+# 他の検出器が使えない場合のフォールバック先なので、起動時に存在を確認する
+FACE_DETECT_XML_FILE = HAAR_CASCADE_FILE
+
+
+class TelloDrone:
+    def __init__(self, host_ip=HOST_IP, host_port=HOST_COMMAND_PORT, 
+              drone_ip=DRONE_IP, drone_port=SEND_COMMAND_PORT, 
+                 move_speed=DEFAULT_DRONE_MOVE_SPEED, video_port=VIDEO_PORT,
+                 video_decoder=settings.VIDEO_DECODER, state_port=STATE_PORT,
+                 drone_id=None, fleet=None):
+        """
+        Args:
+            drone_id: フリートの中でのドローンの名前
+            fleet: TelloFleet。指定した場合はコマンドと状態の受信ソケット、コマンドの送信スレッド、
+                映像の受信スレッドをフリートの他のドローンと共有する
+        """
+        self.drone_id = drone_id
+        self.fleet = fleet
+        self.host_ip = host_ip
+        self.host_port = host_port                    
+        
+        self.drone_ip = drone_ip
+        self.drone_port = drone_port
+        self.drone_address = (self.drone_ip, self.drone_port)
+        self.move_speed = move_speed
+        self.video_port = video_port
+        self.state_port = state_port
+
+        self.stop_flag = threading.Event()
+        # 記録していない間は None
+        self.flight_recorder = None
+        if fleet is None:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.socket.bind((self.host_ip, self.host_port))
+            self.socket.settimeout(RECEIVE_TIMEOUT)
+            command_dispatcher = None
+        else:
+            self.socket = fleet.command_socket
+            command_dispatcher = fleet.command_dispatcher
+        # コマンドは順に送信し、応答を送信したコマンドに紐づける
+        self.command_channel = CommandChannel(self.socket, self.drone_address, on_sent=self._on_command_sent,
+                                              dispatcher=command_dispatcher)
+        self.command_channel.start()
+        # 姿勢・高度・バッテリーなどの状態はTelloから約10Hzで送られてくる
+        self.state_receiver = TelloStateReceiver(self.host_ip, self.state_port, on_state=self._on_state)
+        if fleet is None:
+            self._receive_thread = threading.Thread(target=self.receive_drone_response, args=(self.stop_flag, ))
+            self._receive_thread.start()
+            self.state_receiver.start()
+        else:
+            # 応答と状態はフリートの受信スレッドから送信元のIPで振り分けられる
+            self._receive_thread = None
+
+        # デコード済みフレームは最新フレームだけを保持する
+        self.frame_ring = FrameRing((FRAME_Y, FRAME_X, 3))
+        # 受信したパケットは1フレーム分まとめてからデコーダへ渡す
+        self.video_reassembler = H264Reassembler(self._on_access_unit)
+        # 映像の受信とデコードは、視聴者・顔検出・姿勢認識・記録のいずれかが使っている間だけ動かす
+        self._video_decoder_name = video_decoder
+        self.video_decoder = None
+        self._video_stop_flag = None
+        self._receive_video_thread = None
+        self.video_pipeline = VideoPipeline(self._start_video, self._stop_video,
+                                            idle_grace_period=settings.VIDEO_IDLE_GRACE_PERIOD,
+                                            name=drone_id or '')
+
+        if not os.path.exists(FACE_DETECT_XML_FILE):
+            raise ErrorNotFoundFaceDetectXmlFile(f'{FACE_DETECT_XML_FILE} is not exists')
+        # 顔検出器は顔検出を最初に有効にしたときに読み込む
+        # 指定された検出器と、読み込み済みの検出器がどの指定から作られたか。
+        # 使えない検出器はHaarカスケードにフォールバックするため、読み込んだ検出器の名前とは一致しないことがある
+        self._face_detector_name = settings.FACE_DETECTOR
+        self._loaded_face_detector_request = None
+        self._face_detector_lock = threading.Lock()
+        self._is_use_face_detect = False
+        self._is_use_pose_control = False
+        # 状態を受信していない場合に飛行中かを判定するための、最後に送った離着陸のコマンド
+        self._takeoff_sent = False
+        # 顔の追跡は飛行中だけ一定周期のrcコマンドで行う
+        self.tracking_controller = RcTrackingController(self.command_channel.send_unacknowledged, FRAME_X, FRAME_Y,
+                                                        is_flying=self.is_flying)
+        # 顔検出・姿勢認識の負荷が予算に収まるように、推論の間隔や検出の設定を調整する
+        self.inference_scheduler = InferenceScheduler(settings.INFERENCE_CPU_BUDGET, settings.INFERENCE_LATENCY_BUDGET)
+        # 顔検出は配信とは別のスレッドで最新フレームに対して行う
+        self.face_detector = FaceDetectionWorker(self.frame_ring, None,
+                                                 on_face=self._on_face,
+                                                 scheduler=self.inference_scheduler)
+        # 姿勢認識モード。骨格検知モデルは有効にしたときに読み込む
+        self.pose_controller = PoseControlWorker(self.frame_ring, self._create_person_kp_predictor,
+                                                 self._send_pose_command,
+                                                 num_workers=settings.POSE_INFERENCE_WORKERS,
+                                                 predictor_release=tflite_models.release_predictor,
+                                                 scheduler=self.inference_scheduler,
+                                                 on_result=self._on_pose_result,
+                                                 gesture_debouncer=GestureDebouncer(
+                                                     window=settings.GESTURE_WINDOW,
+                                                     enter_confidence=settings.GESTURE_ENTER_CONFIDENCE,
+                                                     exit_confidence=settings.GESTURE_EXIT_CONFIDENCE,
+                                                     cooldown=settings.GESTURE_COOLDOWN))
+        if settings.PRELOAD_PERSON_KEYPOINTS_MODEL:
+            TFLiteModelRegistry().preload(self._person_kp_model_key(), count=settings.POSE_INFERENCE_WORKERS)
+        # 検出結果を描画するフレーム。デコード済みフレームは他の処理と共有しているため書き換えない
+        self._overlay_frame = np.empty((FRAME_Y, FRAME_X, 3), dtype=np.uint8)
+
+        # 全ての視聴者で描画済みのフレームを共有し、JPEGは配信の設定ごとに1回だけエンコードする
+        self.jpeg_broadcaster = JpegFrameBroadcaster(self.video_frame_generator,
+                                                     create_jpeg_encoder(settings.JPEG_ENCODER),
+                                                     on_active=partial(self.video_pipeline.acquire, 'viewer'),
+                                                     on_idle=partial(self.video_pipeline.release, 'viewer'))
+
+        if fleet is not None:
+            fleet.attach(self)
+
+        # 初期化コマンドの応答は待たない。応答はhandshakeで確認する
+        self.handshake = None
+        self.connect()
+
+        if settings.RECORD_FLIGHTS:
+            self.start_recording()
+
+    def __del__(self):
+        self.stop()
+
+    def connect(self):
+        """
+        SDKモードに入る初期化コマンドを送信する。応答は待たない
+        Returns:
+            'command' の応答を結果に持つFuture
+        """
+        self.handshake = self.send_command('command', blocknig=False)
+        if self.video_port != TELLO_DEFAULT_VIDEO_PORT or self.state_port != TELLO_DEFAULT_STATE_PORT:
+            # 複数台の映像をポートで分けて受信する (SDK 3.0 の port コマンド)
+            self.send_command(f'port {self.state_port} {self.video_port}', blocknig=False)
+        # streamon は映像の利用者が来たときに送る
+        self.send_command(f'speed {self.move_speed}', blocknig=False)
+        return self.handshake
+
+    @property
+    def is_connected(self):
+        """
+        初期化コマンドにドローンが応答したか
+        """
+        handshake = self.handshake
+        return handshake is not None and handshake.done() and not handshake.cancelled() \
+            and handshake.exception() is None
+
+    def stop(self):
+        self.stop_flag.set()
+        self.face_detector.stop()
+        if self.face_detector.detector is not None:
+            self.face_detector.detector.close()
+        self.tracking_controller.stop()
+        self.pose_controller.stop()
+        self.command_channel.stop()
+        self.state_receiver.stop()
+        self.stop_recording()
+        self.jpeg_broadcaster.stop()
+        # 利用者が残っていても映像の受信を止め、ffmpegを終了する
+        self.video_pipeline.close()
+        if self.fleet is not None:
+            self.fleet.detach(self)
+        else:
+            self._receive_thread.join(timeout=2.0)
+            self.socket.close()
+
+    def _start_video(self):
+        """
+        映像の受信とデコードを開始する。VideoPipelineから最初の利用者が来たときに呼び出される
+        """
+        stop_flag = threading.Event()
+        self.video_decoder = create_video_decoder(self._video_decoder_name, self.frame_ring, stop_flag)
+        # 前回停止したときの組み立て途中のフレームは捨てる
+        self.video_reassembler.reset()
+        self._video_stop_flag = stop_flag
+        self.send_command('streamon', blocknig=False)
+        if self.fleet is not None:
+            try:
+                self.fleet.video_receiver.add(self.host_ip, self.video_port, self.video_reassembler)
+            except OSError:
+                # ソケットを用意できなかった。VideoPipelineは開始していない状態に戻る
+                stop_flag.set()
+                self.video_decoder.close()
+                self.video_decoder = None
+                raise
+        else:
+            self._receive_video_thread = threading.Thread(target=self.receive_drone_video,
+                                                          args=(stop_flag, self.video_reassembler,
+                                                                self.host_ip, self.video_port),
+                                                          daemon=True)
+            self._receive_video_thread.start()
+
+    def _stop_video(self):
+        """
+        映像の受信を止めてからデコーダを閉じる。VideoPipelineから利用者がいなくなったときに呼び出される
+        """
+        self._video_stop_flag.set()
+        # デコード中に閉じないよう、映像の受信が止まるのを待つ
+        if self.fleet is not None:
+            self.fleet.video_receiver.remove(self.video_port)
+        else:
+            self._receive_video_thread.join(timeout=2.0)
+            self._receive_video_thread = None
+        if not self.stop_flag.is_set():
+            # 見ていない間はドローンも映像を送らない
+            self.send_command('streamoff', blocknig=False)
+        video_decoder, self.video_decoder = self.video_decoder, None
+        video_decoder.close()
+
+    def receive_drone_response(self, stop_flag):
+        while not stop_flag.is_set():
+            try:
+                # Telloのサンプルコードと同様に3000
+                response, ip = self.socket.recvfrom(3000)
+                self.handle_command_response(response)
+            except socket.timeout:
+                # stop_flagを確認するために定期的に起きる
+                continue
+            except socket.error as ex:
+                logger.error(f'Caught exception socket.error: {ex} at receive_drone_response')
+                break
+
+    def handle_command_response(self, response):
+        """
+        コマンドの応答を応答待ちのコマンドに渡す
+        Args:
+            response: 受信したバイト列
+        """
+        logger.info(f'receive_thread: {response}')
+        recorder = self.flight_recorder
+        if recorder is not None:
+            recorder.record_response(response)
+        self.command_channel.handle_response(response)
+
+    def receive_drone_video(self, stop_flag, video_reassembler, host_ip,video_port):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as socket_video:
+            socket_video.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            socket_video.settimeout(.5)
+            socket_video.bind((host_ip, video_port))
+            video_packets = VIDEO_PACKETS.labels()
+            video_received_bytes = VIDEO_RECEIVED_BYTES.labels()
+
+            while not stop_flag.is_set():
+                try:
+                    data_size = video_reassembler.receive_from(socket_video)
+                    video_packets.inc()
+                    video_received_bytes.inc(data_size)
+                except socket.timeout as ex:
+                    logger.warning(f'Caught exception socket.timeout: {ex} at receive_drone_video')
+                    time.sleep(0.5)
+                    continue
+                except socket.error as ex:
+                    logger.error(f'Caught exception socket.error: {ex} at receive_drone_video')
+                    break
+                except Exception as ex:
+                    # デコードなどで起きた例外で映像の受信を止めない
+                    logger.error(f'Caught exception: {ex} at receive_drone_video')
+                    continue
+
+
+    def send_command(self, command, blocknig=True):
+        """
+        コマンドを送信する
+        Args:
+            command: コマンド文字列
+            blocknig: Trueの場合はドローンの応答を待つ
+        Returns:
+            blocknig=Trueの場合はドローンの応答 (タイムアウトした場合は None)
+            blocknig=Falseの場合は応答を結果に持つFuture
+        """
+        future = self.command_channel.submit(command)
+        if not blocknig:
+            return future
+
+        try:
+            return future.result()
+        except (ErrorCommand, CancelledError) as ex:
+            logger.warning(f'Caught exception: {ex} at send_command')
+            return None
+
+    def send_motion_command(self, command):
+        """
+        移動目標を送信する。送信前に次の移動目標が来た場合は古いものは送信されない
+        Returns:
+            応答を結果に持つFuture
+        """
+        return self.command_channel.submit_motion(command)
+
+    def command_metrics(self):
+        return self.command_channel.get_metrics()
+
+    def set_speed(self, speed):
+        return self.send_command(f'speed {speed}')
+
+    def takeoff(self):
+        return self.send_command('takeoff')
+
+    def land(self):
+        return self.send_command('land')
+
+    def emergency(self):
+        return self.send_command('emergency')
+    
+    def move(self, direction, distance):
+        distance = float(distance)
+        distance = int(round(distance * 100))
+        return self.send_command(f'{direction} {distance}')
+    
+    def move_forward(self, distance=DEFAULT_DRONE_MOVE_DISTANTE):
+        return self.move('forward', distance)
+    
+    def move_backward(self, distance=DEFAULT_DRONE_MOVE_DISTANTE):
+        return self.move('back', distance)
+    
+    def move_up(self, distance=DEFAULT_DRONE_MOVE_DISTANTE):
+        return self.move('up', distance)
+
+    def move_down(self, distance=DEFAULT_DRONE_MOVE_DISTANTE):
+        return self.move('down', distance)
+
+    def move_right(self, distance=DEFAULT_DRONE_MOVE_DISTANTE):
+        return self.move('right', distance)
+
+    def move_left(self, distance=DEFAULT_DRONE_MOVE_DISTANTE):
+        return self.move('left', distance)
+    
+    def rotate_clockwise(self, degrees=90):
+        return self.send_command(f'cw {degrees}')
+
+    def rotate_counter_clockwise(self, degrees=90):
+        return self.send_command(f'ccw {degrees}')
+
+    def flip(self, direction):
+        return self.send_command(f'flip {direction}')
+    
+    def flip_forward(self):
+        return self.flip('f')
+    
+    def flip_back(self):
+        return self.flip('b')
+    
+    def flip_right(self):
+        return self.flip('r')
+    
+    def flip_left(self):
+        return self.flip('l')
+    
+    def _on_access_unit(self, access_unit):
+        recorder = self.flight_recorder
+        if recorder is not None:
+            recorder.record_video(access_unit)
+        self.video_decoder.feed_access_unit(access_unit)
+
+    def _on_command_sent(self, command):
+        if command == 'takeoff':
+            self._takeoff_sent = True
+        elif command in ('land', 'emergency'):
+            self._takeoff_sent = False
+        recorder = self.flight_recorder
+        if recorder is not None:
+            recorder.record_command(command)
+
+    def _on_state(self, timestamp, values):
+        recorder = self.flight_recorder
+        if recorder is not None:
+            recorder.record_state(timestamp, values)
+
+    def _on_face(self, box, timestamp):
+        self.tracking_controller.update_target(box, timestamp)
+        recorder = self.flight_recorder
+        if recorder is not None:
+            recorder.record_detection('face', box)
+
+    def _on_pose_result(self, pose_result):
+        recorder = self.flight_recorder
+        if recorder is not None:
+            recorder.record_detection('pose', pose_result)
+
+    def start_recording(self):
+        """
+        フライトデータの記録を始める。記録は開始時刻のディレクトリに保存する。記録している間は映像も受信する
+        Returns:
+            記録先のディレクトリ
+        """
+        if self.flight_recorder is not None:
+            return self.flight_recorder.directory
+        name = time.strftime('%Y%m%d_%H%M%S')
+        if self.drone_id is not None:
+            name = f'{name}_{self.drone_id}'
+        directory = os.path.join(settings.FLIGHT_RECORDING_DIR, name)
+        recorder = FlightRecorder(directory)
+        recorder.start()
+        self.flight_recorder = recorder
+        self.video_pipeline.acquire('recording')
+        return directory
+
+    def stop_recording(self):
+        recorder = self.flight_recorder
+        self.flight_recorder = None
+        if recorder is not None:
+            self.video_pipeline.release('recording')
+            recorder.stop()
+
+    def is_flying(self):
+        """
+        状態を受信していれば高度(h)で判定し、受信していない場合は最後に送った離着陸のコマンドで判定する
+        """
+        state = self.state_receiver.latest()
+        if state is not None and time.time() - float(state['timestamp']) < STATE_STALE_SECONDS:
+            return float(state['h']) > 0
+        return self._takeoff_sent
+
+    def get_state(self):
+        """
+        Returns:
+            最新の状態の辞書。まだ受信していない場合は None
+        """
+        state = self.state_receiver.latest()
+        return None if state is None else state_to_dict(state)
+
+    def state_stats(self, seconds):
+        """
+        Returns:
+            直近seconds秒の状態の統計
+        """
+        return self.state_receiver.history.stats(seconds)
+
+    def state_generator(self, timeout=1.0):
+        """
+        状態が更新されるたびに最新の状態の辞書を返す。更新がない間は None を返す
+        """
+        seq = 0
+        while not self.stop_flag.is_set():
+            latest = self.state_receiver.history.wait_next(seq, timeout)
+            if latest is None:
+                yield None
+                continue
+            seq, state = latest
+            yield state_to_dict(state)
+
+    def start_video_receiver(self):
+        """
+        視聴者がいなくても映像を受信・デコードし続ける。stop_video_receiverを呼ぶまで停止しない
+        """
+        self.video_pipeline.acquire('receiver')
+
+    def stop_video_receiver(self):
+        self.video_pipeline.release('receiver')
+
+    def get_latest_frame(self):
+        """
+        Returns:
+            (seq, frame) 最新のフレームとシーケンス番号。フレームがない場合は (0, None)
+        """
+        return self.frame_ring.latest()
+
+    def inference_stats(self):
+        """
+        Returns:
+            推論の設定と計測した処理時間
+        """
+        stats = self.inference_scheduler.stats()
+        stats['face_detection'] = self.face_detector.stats()
+        stats['face_detector'] = self.face_detector_status()
+        stats['pose_control'] = self.pose_controller.stats()
+        return stats
+
+    def set_inference_budget(self, cpu_budget=None, latency_budget=None):
+        self.inference_scheduler.set_budget(cpu_budget, latency_budget)
+
+    def health(self):
+        """
+        Returns:
+            各部分の準備の状況。映像・顔検出・姿勢認識は使い始めたときに準備する
+        """
+        handshake = self.handshake
+        command = {'ready': self.is_connected, 'pending': handshake is not None and not handshake.done()}
+        if self.is_connected:
+            command['response'] = handshake.result()
+        elif handshake is not None and handshake.done() and not handshake.cancelled():
+            command['error'] = str(handshake.exception())
+        state = self.state_receiver.latest()
+        state_age = None if state is None else time.time() - float(state['timestamp'])
+        return {
+            'command': command,
+            'state': {'ready': state_age is not None and state_age < STATE_STALE_SECONDS, 'age': state_age},
+            'video': {'running': self.video_pipeline.running, 'frames': self.frame_ring.published_frames},
+            'face_detection': {
+                'loaded': self.face_detector.detector is not None,
+                'detector': self.face_detector_status(),
+                'running': self.face_detector.is_running,
+            },
+            'pose_control': {'running': self.pose_controller.is_running},
+        }
+
+    def video_stats(self):
+        return {
+            'decoder': self._video_decoder_name if self.video_decoder is None else self.video_decoder.name,
+            'pipeline': self.video_pipeline.stats(),
+            'packets': self.video_reassembler.stats(),
+            'frames': self.frame_ring.stats(),
+            'jpeg': self.jpeg_broadcaster.stats(),
+        }
+
+    def video_binary_generator(self, stop_flag=None):
+        """
+        Args:
+            stop_flag: 呼び出し側の停止用のthreading.Event。Noneの場合はドローンを停止するまで続ける
+        """
+        stop_flag = stop_flag or self.stop_flag
+        seq = 0
+        while not stop_flag.is_set() and not self.stop_flag.is_set():
+            latest = self.frame_ring.wait_next(seq, timeout=1.0)
+            if latest is None:
+                continue
+            seq, frame = latest
+            yield frame
+
+    def face_detector_status(self):
+        """
+        Returns:
+            指定された検出器 (selected)、実際に読み込んだ検出器 (loaded。未読み込みの場合は None)、
+            フォールバックしたか (fallback)、使える検出器の名前 (available) の辞書
+        """
+        detector = self.face_detector.detector
+        loaded = detector.name if detector is not None else None
+        return {
+            'selected': self._face_detector_name,
+            'loaded': loaded,
+            'fallback': loaded is not None and loaded != self._loaded_face_detector_request,
+            'available': list(FACE_DETECTORS),
+        }
+
+    def _load_face_detector(self):
+        with self._face_detector_lock:
+            if self.face_detector.detector is None:
+                start_time = time.perf_counter()
+                self.face_detector.set_detector(create_face_detector(self._face_detector_name))
+                self._loaded_face_detector_request = self._face_detector_name
+                logger.info(f'Loaded face detector {self.face_detector.detector.name} '
+                            f'in {time.perf_counter() - start_time:.3f} seconds')
+            return self.face_detector.detector
+
+    def set_face_detector(self, name):
+        """
+        顔検出器を切り替える。読み込み済みの場合はその場で入れ替え、まだの場合は次に顔検出を有効にしたときに読み込む
+        Args:
+            name: FACE_DETECTORSの名前
+        """
+        if name not in FACE_DETECTORS:
+            raise ValueError(f'unknown face detector: {name}')
+        with self._face_detector_lock:
+            self._face_detector_name = name
+            # フォールバックした場合も、同じ指定で作り直しても結果は変わらない
+            if self.face_detector.detector is not None and self._loaded_face_detector_request != name:
+                self.face_detector.set_detector(create_face_detector(name))
+                self._loaded_face_detector_request = name
+
+    def enable_face_detect(self):
+        self.disable_pose_control()
+        self._load_face_detector()
+        if not self._is_use_face_detect:
+            self.video_pipeline.acquire('face_detection')
+        self._is_use_face_detect = True
+        self.face_detector.start()
+        self.tracking_controller.start()
+
+    def disable_face_detect(self):
+        if self._is_use_face_detect:
+            self.video_pipeline.release('face_detection')
+        self._is_use_face_detect = False
+        self.face_detector.stop()
+        self.tracking_controller.stop()
+
+    @staticmethod
+    def _person_kp_model_key():
+        if settings.PERSON_KEYPOINTS_MODEL_TYPE == 'multipose':
+            return tflite_models.multi_person_kp_model_key(settings.MULTI_PERSON_KEYPOINTS_MODEL_FILE)
+        return tflite_models.person_kp_model_key(settings.PERSON_KEYPOINTS_MODEL_FILE)
+
+    def _create_person_kp_predictor(self):
+        # TFLiteのランタイムはモデルを最初に使うときに読み込まれる
+        if settings.PERSON_KEYPOINTS_MODEL_TYPE == 'multipose':
+            return tflite_models.get_multi_person_kp_predictor(settings.MULTI_PERSON_KEYPOINTS_MODEL_FILE)
+        return tflite_models.get_person_kp_predictor(settings.PERSON_KEYPOINTS_MODEL_FILE)
+
+    def _send_pose_command(self, command):
+        if command == 'land':
+            self.send_command(command, blocknig=False)
+        else:
+            self.send_motion_command(command)
+
+    def enable_pose_control(self):
+        self.disable_face_detect()
+        if not self._is_use_pose_control:
+            self.video_pipeline.acquire('pose_control')
+        self._is_use_pose_control = True
+        self.pose_controller.start()
+
+    def disable_pose_control(self):
+        if self._is_use_pose_control:
+            self.video_pipeline.release('pose_control')
+        self._is_use_pose_control = False
+        self.pose_controller.stop()
+        
+    def video_frame_generator(self, stop_flag=None):
+        """
+        検出結果を描画したフレームを返す。JPEGへのエンコードはjpeg_broadcasterで行う
+        """
+        for frame in self.video_binary_generator(stop_flag):
+            if self._is_use_face_detect:
+                # 検出を待たずに、最新の検出結果を描画する
+                face_track = self.face_detector.latest_track()
+                if face_track is not None:
+                    np.copyto(self._overlay_frame, frame)
+                    frame = self._overlay_frame
+                    x, y, w, h = face_track.box
+                    cv2.rectangle(frame, (x,y), (x+w, y+h), (255, 0, 0), 2)
+
+            pose_result = self.pose_controller.latest_result()
+            if pose_result is not None:
+                np.copyto(self._overlay_frame, frame)
+                frame = render(self._overlay_frame, pose_result.keypoints, pose_result.pose)
+
+            yield frame
+
+
+
+class ErrorNotFoundFaceDetectXmlFile(Exception):
     """Eroror no face detect xml file"""
\ No newline at end of file
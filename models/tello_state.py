@@ -0,0 +1,215 @@
+import logging
+import re
+import socket
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+STATE_PORT = 8890
+# Telloの状態パケットの項目 (SDK 1.3 / 2.0 共通の並び順)
+STATE_FIELDS = ('pitch', 'roll', 'yaw', 'vgx', 'vgy', 'vgz', 'templ', 'temph', 'tof', 'h', 'bat', 'baro', 'time',
+                'agx', 'agy', 'agz')
+STATE_DTYPE = np.dtype([('timestamp', np.float64)] + [(field, np.float32) for field in STATE_FIELDS])
+# SDK 2.0 では先頭に mid;x;y;z;mpry が付くため、pitch以降だけを読む
+STATE_PATTERN = re.compile(b''.join(field.encode('ascii') + rb':(-?[0-9.]+);' for field in STATE_FIELDS))
+# 約10Hzで10分間
+DEFAULT_HISTORY_SIZE = 6000
+MAX_STATE_PACKET_SIZE = 1024
+RECEIVE_TIMEOUT = 0.5
+
+
+class StateHistory:
+    """
+    状態の履歴を固定長の構造化配列のリングに保持する。
+    長時間飛行してもメモリ使用量は size 行分から増えない
+    """
+
+    def __init__(self, size=DEFAULT_HISTORY_SIZE):
+        self._ring = np.zeros(size, dtype=STATE_DTYPE)
+        self._condition = threading.Condition()
+        self._seq = 0
+
+    @property
+    def size(self):
+        return len(self._ring)
+
+    @property
+    def seq(self):
+        return self._seq
+
+    def append(self, timestamp, values):
+        """
+        Args:
+            timestamp: 受信した時刻 (time.time)
+            values: STATE_FIELDS の順の値
+        """
+        with self._condition:
+            self._ring[self._seq % len(self._ring)] = (timestamp, *values)
+            self._seq += 1
+            self._condition.notify_all()
+
+    def latest(self):
+        """
+        Returns:
+            最新の状態 (STATE_DTYPE のスカラー)。まだ受信していない場合は None
+        """
+        with self._condition:
+            if self._seq == 0:
+                return None
+            return self._ring[(self._seq - 1) % len(self._ring)].copy()
+
+    def wait_next(self, last_seq, timeout=None):
+        """
+        last_seqより新しい状態が届くまで待つ
+        Returns:
+            (seq, 最新の状態)。タイムアウトした場合は None
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._seq > last_seq, timeout):
+                return None
+            return self._seq, self._ring[(self._seq - 1) % len(self._ring)].copy()
+
+    def window(self, seconds):
+        """
+        Returns:
+            直近seconds秒の状態の配列 (古い順)
+        """
+        with self._condition:
+            count = min(self._seq, len(self._ring))
+            end = self._seq % len(self._ring)
+            if count < len(self._ring):
+                history = self._ring[:count].copy()
+            else:
+                history = np.concatenate((self._ring[end:], self._ring[:end]))
+        if count == 0:
+            return history
+        # 時刻は古い順に並んでいるため二分探索で切り出す
+        start = np.searchsorted(history['timestamp'], history['timestamp'][-1] - seconds, side='left')
+        return history[start:]
+
+    def stats(self, seconds, fields=STATE_FIELDS):
+        """
+        Returns:
+            {項目: {'mean', 'min', 'max'}} 直近seconds秒の統計
+        """
+        history = self.window(seconds)
+        if len(history) == 0:
+            return {}
+        return {field: {'mean': float(history[field].mean()),
+                        'min': float(history[field].min()),
+                        'max': float(history[field].max())}
+                for field in fields}
+
+
+def state_to_dict(state):
+    """
+    Args:
+        state: STATE_DTYPE のスカラー
+    """
+    return {name: state[name].item() for name in STATE_DTYPE.names}
+
+
+class TelloStateReceiver:
+    """
+    Telloが約10Hzで送ってくる状態パケットを受信し、StateHistoryに追加する
+    """
+
+    def __init__(self, host_ip, state_port=STATE_PORT, history_size=DEFAULT_HISTORY_SIZE, on_state=None):
+        """
+        Args:
+            host_ip, state_port: 状態パケットを受信するアドレス
+            history_size: 保持する履歴の行数
+            on_state: 状態を受信するたびに (timestamp, values) で呼び出す関数
+        """
+        self.host_ip = host_ip
+        self.state_port = state_port
+        self.history = StateHistory(history_size)
+        self.on_state = on_state
+
+        self._buffer = bytearray(MAX_STATE_PACKET_SIZE)
+        self._stop_flag = threading.Event()
+        self._thread = None
+
+        self.packets = 0
+        self.parse_errors = 0
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.is_running:
+            return
+        self._stop_flag.clear()
+        self._thread = threading.Thread(target=self._run, args=(self._stop_flag, ), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_flag.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+
+    def parse(self, data, size=None):
+        """
+        状態パケットを解析する
+        Args:
+            data: 受信したバイト列
+            size: dataの有効なバイト数
+        Returns:
+            STATE_FIELDS の順の値のタプル。解析できない場合は None
+        """
+        match = STATE_PATTERN.search(data, 0, len(data) if size is None else size)
+        if match is None:
+            return None
+        return tuple(map(float, match.groups()))
+
+    def _run(self, stop_flag):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as state_socket:
+            state_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            state_socket.settimeout(RECEIVE_TIMEOUT)
+            try:
+                state_socket.bind((self.host_ip, self.state_port))
+            except socket.error as ex:
+                logger.error(f'Caught exception socket.error: {ex} at TelloStateReceiver._run')
+                return
+
+            while not stop_flag.is_set():
+                try:
+                    size = state_socket.recv_into(self._buffer)
+                except socket.timeout:
+                    continue
+                except socket.error as ex:
+                    logger.error(f'Caught exception socket.error: {ex} at TelloStateReceiver._run')
+                    break
+                self.handle_packet(self._buffer, size)
+
+    def handle_packet(self, data, size=None):
+        """
+        受信した状態パケットを履歴に追加する。複数台で受信ソケットを共有する場合はTelloFleetから呼び出す
+        Args:
+            data: 受信したバイト列
+            size: dataの有効なバイト数
+        """
+        self.packets += 1
+        values = self.parse(data, size)
+        if values is None:
+            self.parse_errors += 1
+            return
+        timestamp = time.time()
+        self.history.append(timestamp, values)
+        if self.on_state is not None:
+            self.on_state(timestamp, values)
+
+    def latest(self):
+        return self.history.latest()
+
+    def stats(self):
+        return {
+            'packets': self.packets,
+            'parse_errors': self.parse_errors,
+            'history_size': self.history.size,
+        }
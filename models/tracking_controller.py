@@ -0,0 +1,196 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONTROL_RATE_HZ = 20
+# この時間(秒)顔が更新されなければ見失ったとみなして停止する
+DEFAULT_TARGET_LOSS_TIMEOUT = 0.5
+# 画面に対する顔の面積の目標割合
+DEFAULT_TARGET_FACE_RATIO = 0.08
+# rcの各軸の最大値 (Telloは-100〜100)
+DEFAULT_MAX_RC_VELOCITY = 40
+
+# (kp, ki, kd) 誤差は画面の半分を1とした値、顔の大きさは面積の平方根の差
+LATERAL_GAINS = (50.0, 0.0, 8.0)
+VERTICAL_GAINS = (50.0, 0.0, 8.0)
+FORWARD_GAINS = (200.0, 0.0, 20.0)
+
+
+class PIDController:
+    """
+    PID制御器
+    """
+
+    def __init__(self, kp, ki, kd, output_limit, integral_limit=None):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.output_limit = output_limit
+        self.integral_limit = output_limit if integral_limit is None else integral_limit
+        self.reset()
+
+    def reset(self):
+        self._integral = 0.0
+        self._last_error = None
+
+    def update(self, error, dt):
+        """
+        Args:
+            error: 目標値との誤差
+            dt: 前回の更新からの経過時間(秒)
+        Returns:
+            操作量 (-output_limit〜output_limit)
+        """
+        if self.ki:
+            self._integral += error * dt
+            self._integral = max(-self.integral_limit / self.ki, min(self.integral_limit / self.ki, self._integral))
+        derivative = 0.0
+        if self._last_error is not None and dt > 0:
+            derivative = (error - self._last_error) / dt
+        self._last_error = error
+
+        output = self.kp * error + self.ki * self._integral + self.kd * derivative
+        return max(-self.output_limit, min(self.output_limit, output))
+
+
+class RcTrackingController:
+    """
+    顔の位置と大きさから rc a b c d の速度指令を専用スレッドで一定周期に送信する。
+    映像のフレームレートとは独立して動作し、顔を見失った場合は速度0を送信する。
+    飛行していない間は送信しない
+    """
+
+    def __init__(self, send_rc, frame_width, frame_height, rate_hz=DEFAULT_CONTROL_RATE_HZ,
+                 target_loss_timeout=DEFAULT_TARGET_LOSS_TIMEOUT, target_face_ratio=DEFAULT_TARGET_FACE_RATIO,
+                 max_velocity=DEFAULT_MAX_RC_VELOCITY, is_flying=None):
+        """
+        Args:
+            send_rc: rcコマンド文字列を送信する関数
+            frame_width: 映像の幅
+            frame_height: 映像の高さ
+            rate_hz: 速度指令の送信周期(Hz)
+            target_loss_timeout: 顔を見失ったとみなすまでの時間(秒)
+            target_face_ratio: 画面に対する顔の面積の目標割合
+            max_velocity: rcの各軸の最大値
+            is_flying: 飛行中かを返す関数。Noneの場合は常に飛行中とみなす
+        """
+        self.send_rc = send_rc
+        self.frame_width = frame_width
+        self.frame_height = frame_height
+        self.interval = 1.0 / rate_hz
+        self.target_loss_timeout = target_loss_timeout
+        self.target_face_size = target_face_ratio ** 0.5
+        self.is_flying = is_flying
+
+        self.lateral_pid = PIDController(*LATERAL_GAINS, output_limit=max_velocity)
+        self.vertical_pid = PIDController(*VERTICAL_GAINS, output_limit=max_velocity)
+        self.forward_pid = PIDController(*FORWARD_GAINS, output_limit=max_velocity)
+
+        self._lock = threading.Lock()
+        self._target = None
+        self._target_time = 0.0
+
+        self._stop_flag = threading.Event()
+        self._thread = None
+        self.last_rc = (0, 0, 0, 0)
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.is_running:
+            return
+        self.clear_target()
+        self._stop_flag.clear()
+        self._thread = threading.Thread(target=self._control_loop, args=(self._stop_flag, ), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_flag.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+
+    def update_target(self, box, timestamp=None):
+        """
+        追跡する顔の位置を更新する
+        Args:
+            box: 顔の (x, y, w, h)
+            timestamp: 顔を検出したフレームの時刻 (time.perf_counter)
+        """
+        with self._lock:
+            self._target = box
+            self._target_time = time.perf_counter() if timestamp is None else timestamp
+
+    def clear_target(self):
+        with self._lock:
+            self._target = None
+
+    def _compute_rc(self, box, dt):
+        x, y, w, h = box
+        # 画面の中心からのずれ (画面の半分を1とする)
+        error_x = (x + w / 2 - self.frame_width / 2) / (self.frame_width / 2)
+        error_y = (self.frame_height / 2 - (y + h / 2)) / (self.frame_height / 2)
+        # 面積の平方根は距離にほぼ反比例する
+        error_size = self.target_face_size - ((w * h) / (self.frame_width * self.frame_height)) ** 0.5
+
+        left_right = self.lateral_pid.update(error_x, dt)
+        up_down = self.vertical_pid.update(error_y, dt)
+        forward_back = self.forward_pid.update(error_size, dt)
+        return int(round(left_right)), int(round(forward_back)), int(round(up_down)), 0
+
+    def _reset(self):
+        self.lateral_pid.reset()
+        self.vertical_pid.reset()
+        self.forward_pid.reset()
+
+    def _flying(self):
+        return self.is_flying is None or self.is_flying()
+
+    def _control_loop(self, stop_flag):
+        next_tick = time.perf_counter()
+        last_tick = next_tick
+        while not stop_flag.is_set():
+            now = time.perf_counter()
+            with self._lock:
+                box = self._target
+                target_age = now - self._target_time
+
+            if not self._flying():
+                # 地上ではrcを送らない。離陸したときに古い誤差で動き出さないように制御器も初期化する
+                rc = None
+                self._reset()
+                self.last_rc = (0, 0, 0, 0)
+            elif box is None or target_age > self.target_loss_timeout:
+                # フェイルセーフ: 顔を見失ったらその場で停止する
+                rc = (0, 0, 0, 0)
+                self._reset()
+            else:
+                rc = self._compute_rc(box, now - last_tick)
+            last_tick = now
+
+            if rc is not None:
+                try:
+                    self.send_rc('rc {} {} {} {}'.format(*rc))
+                    self.last_rc = rc
+                except OSError as ex:
+                    logger.error(f'Caught exception: {ex} at RcTrackingController._control_loop')
+
+            next_tick += self.interval
+            sleep_time = next_tick - time.perf_counter()
+            if sleep_time > 0:
+                stop_flag.wait(sleep_time)
+            else:
+                # 処理が遅れた場合は周期を詰めずにやり直す
+                next_tick = time.perf_counter()
+
+        if not self._flying():
+            return
+        try:
+            self.send_rc('rc 0 0 0 0')
+            self.last_rc = (0, 0, 0, 0)
+        except OSError as ex:
+            logger.error(f'Caught exception: {ex} at RcTrackingController._control_loop')
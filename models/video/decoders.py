@@ -0,0 +1,168 @@
+import logging
+import subprocess
+import time
+
+import numpy as np
+
+from models.video.frame_reader import PipeFrameReader
+
+logger = logging.getLogger(__name__)
+
+FFMPEG_COMMAND = ('ffmpeg -hwaccel auto -hwaccel_device opencl -i pipe:0 '
+                  '-pix_fmt bgr24 -s {width}x{height} -f rawvideo pipe:1')
+
+
+class VideoDecoder:
+    """
+    Telloから受信したH.264を受け取り、デコードしたフレームをFrameRingへ書き込むデコーダの基底クラス
+    """
+    name = None
+
+    def __init__(self, frame_ring, stop_flag):
+        """
+        Args:
+            frame_ring: デコード済みフレームの書き込み先
+            stop_flag: 停止用のthreading.Event
+        """
+        self.frame_ring = frame_ring
+        self.stop_flag = stop_flag
+        self.frame_height, self.frame_width, _ = frame_ring.writable_buffer().shape
+
+    def start(self):
+        pass
+
+    def feed(self, data):
+        """
+        H.264のバイト列を入力する
+        Args:
+            data: Annex B形式のバイト列 (bytes, bytearray, memoryview)
+        """
+        raise NotImplementedError
+
+    def feed_access_unit(self, data):
+        """
+        1フレーム分に組み立て済みのH.264を入力する
+        Args:
+            data: 1アクセスユニット分のバイト列。呼び出し後に再利用されるため保持しないこと
+        """
+        self.feed(data)
+
+    def close(self):
+        pass
+
+
+class FfmpegPipeDecoder(VideoDecoder):
+    """
+    ffmpegのサブプロセスにパイプ経由でH.264を渡し、rawvideoを読み出すデコーダ
+    """
+    name = 'ffmpeg'
+
+    def __init__(self, frame_ring, stop_flag):
+        super().__init__(frame_ring, stop_flag)
+        self.video_proc = None
+        self.video_proc_stdin = None
+        self._frame_reader = None
+
+    def start(self):
+        command = FFMPEG_COMMAND.format(width=self.frame_width, height=self.frame_height)
+        self.video_proc = subprocess.Popen(command.split(' '), stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.video_proc_stdin = self.video_proc.stdin
+        self._frame_reader = PipeFrameReader(self.video_proc.stdout, self.frame_ring, self.stop_flag)
+        self._frame_reader.start()
+
+    def feed(self, data):
+        self.video_proc_stdin.write(data)
+        self.video_proc_stdin.flush()
+
+    def close(self):
+        if self.video_proc is None:
+            return
+        try:
+            self.video_proc_stdin.close()
+        except Exception as ex:
+            logger.warning(f'Caught exception: {ex} at FfmpegPipeDecoder.close')
+        self.video_proc.terminate()
+        try:
+            self.video_proc.wait(timeout=2)
+        except subprocess.TimeoutExpired:
+            self.video_proc.kill()
+        logger.info('ffmpeg is stopped')
+
+
+class PyAVDecoder(VideoDecoder):
+    """
+    PyAV(libavcodec)でプロセス内デコードを行うデコーダ。
+    パイプの往復とパケットごとのflushが不要になる
+    """
+    name = 'pyav'
+
+    def __init__(self, frame_ring, stop_flag):
+        super().__init__(frame_ring, stop_flag)
+        try:
+            import av
+        except ImportError as ex:
+            raise ErrorVideoDecoderUnavailable(f'PyAV is not installed: {ex}')
+        self._av = av
+        self._codec = None
+
+    def start(self):
+        self._codec = self._av.CodecContext.create('h264', 'r')
+
+    def feed(self, data):
+        start_time = time.perf_counter()
+        # parseがNALユニットをアクセスユニット単位のパケットにまとめる
+        for packet in self._codec.parse(bytes(data)):
+            self._decode(packet, start_time)
+            start_time = time.perf_counter()
+
+    def feed_access_unit(self, data):
+        # 組み立て済みのフレームはパーサを通さずにデコードし、次のフレームを待つ遅延をなくす
+        self._decode(self._av.Packet(bytes(data)), time.perf_counter())
+
+    def _decode(self, packet, start_time):
+        try:
+            frames = self._codec.decode(packet)
+        except (self._av.error.FFmpegError, ValueError) as ex:
+            # 壊れたアクセスユニットは捨て、次のフレームからデコードを続ける
+            logger.warning(f'Caught exception: {ex} at PyAVDecoder._decode')
+            return
+        for frame in frames:
+            image = frame.to_ndarray(width=self.frame_width, height=self.frame_height, format='bgr24')
+            np.copyto(self.frame_ring.writable_buffer(), image)
+            self.frame_ring.publish(time.perf_counter() - start_time)
+
+    def close(self):
+        self._codec = None
+
+
+VIDEO_DECODERS = {
+    PyAVDecoder.name: PyAVDecoder,
+    FfmpegPipeDecoder.name: FfmpegPipeDecoder,
+}
+
+
+def create_video_decoder(name, frame_ring, stop_flag):
+    """
+    デコーダを生成する。指定のデコーダが使えない場合はffmpegのパイプにフォールバックする
+    Args:
+        name: デコーダ名 ('pyav' または 'ffmpeg')
+        frame_ring: デコード済みフレームの書き込み先
+        stop_flag: 停止用のthreading.Event
+    Returns:
+        開始済みのVideoDecoder
+    """
+    decoder_class = VIDEO_DECODERS.get(name)
+    if decoder_class is None:
+        raise ValueError(f'unknown video decoder: {name}')
+    try:
+        decoder = decoder_class(frame_ring, stop_flag)
+    except ErrorVideoDecoderUnavailable as ex:
+        logger.warning(f'{ex}. fall back to {FfmpegPipeDecoder.name}')
+        decoder = FfmpegPipeDecoder(frame_ring, stop_flag)
+    decoder.start()
+    logger.info(f'video decoder: {decoder.name}')
+    return decoder
+
+
+class ErrorVideoDecoderUnavailable(Exception):
+    """Error video decoder backend is not available"""
@@ -0,0 +1,177 @@
+import logging
+import threading
+import time
+
+import numpy as np
+
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+FRAMES_DECODED = metrics.counter('tello_video_frames_decoded_total', 'Frames decoded and published to the frame ring')
+FRAMES_DROPPED = metrics.counter('tello_video_frames_dropped_total', 'Decoded frames overwritten before any reader saw them')
+DECODE_SECONDS = metrics.histogram('tello_video_decode_seconds', 'Time to decode one video frame')
+
+DEFAULT_RING_SIZE = 4
+
+
+class FrameRing:
+    """
+    事前に確保したフレームバッファのリング。
+    書き込み側は常に次のスロットへ書き込み、読み出し側は最新フレームとシーケンス番号を受け取る。
+    誰にも読まれずに上書きされたフレームは破棄フレームとして数える。
+    読み出し側が受け取るのはスロットそのものなので、size-1回後の公開でスロットは再び書き込み側に渡る。
+    読むのに時間がかかる場合 (検出器の前処理など) は、読み終えた後にis_overwrittenで確認し、
+    上書きされていたら読んだ内容を捨てる。
+    """
+
+    def __init__(self, shape, size=DEFAULT_RING_SIZE, dtype=np.uint8):
+        """
+        Args:
+            shape: 1フレームの形状 (height, width, 3)
+            size: リングのスロット数 (2以上)
+            dtype: フレームのデータ型
+        """
+        if size < 2:
+            raise ValueError(f'size must be >= 2, got {size}')
+        self._buffers = [np.empty(shape, dtype=dtype) for _ in range(size)]
+        self._condition = threading.Condition()
+        self._write_index = 0
+        self._latest_index = None
+        self._seq = 0
+        self._consumed_seq = 0
+        self._latest_timestamp = None
+
+        self.published_frames = 0
+        self.dropped_frames = 0
+        self.last_decode_latency = 0.0
+        self.max_decode_latency = 0.0
+        self._total_decode_latency = 0.0
+
+    @property
+    def frame_nbytes(self):
+        return self._buffers[0].nbytes
+
+    def writable_buffer(self):
+        """
+        次に書き込むスロットを返す。最新フレームのスロットとは必ず異なる
+        """
+        return self._buffers[self._write_index]
+
+    def publish(self, decode_latency=0.0):
+        """
+        writable_bufferに書き込んだフレームを最新フレームとして公開する
+        Args:
+            decode_latency: そのフレームのデコードに掛かった時間(秒)
+        """
+        FRAMES_DECODED.inc()
+        DECODE_SECONDS.observe(decode_latency)
+        with self._condition:
+            if self._seq > self._consumed_seq:
+                # 前の最新フレームは誰にも読まれなかった
+                self.dropped_frames += 1
+                FRAMES_DROPPED.inc()
+            self._latest_index = self._write_index
+            self._write_index = (self._write_index + 1) % len(self._buffers)
+            self._seq += 1
+            self._latest_timestamp = time.time()
+
+            self.published_frames += 1
+            self.last_decode_latency = decode_latency
+            self.max_decode_latency = max(self.max_decode_latency, decode_latency)
+            self._total_decode_latency += decode_latency
+            self._condition.notify_all()
+
+    def latest(self):
+        """
+        Returns:
+            (seq, frame) フレームがまだない場合は (0, None)
+        """
+        with self._condition:
+            if self._latest_index is None:
+                return 0, None
+            self._consumed_seq = self._seq
+            return self._seq, self._buffers[self._latest_index]
+
+    def wait_next(self, last_seq, timeout=None):
+        """
+        last_seqより新しいフレームが公開されるまで待つ
+        Args:
+            last_seq: 呼び出し側が最後に受け取ったシーケンス番号
+            timeout: 最大待ち時間(秒)
+        Returns:
+            (seq, frame) タイムアウトした場合は None
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._seq > last_seq, timeout):
+                return None
+            self._consumed_seq = self._seq
+            return self._seq, self._buffers[self._latest_index]
+
+    def is_overwritten(self, seq):
+        """
+        seqのフレームのスロットが書き込み側に渡されたか。読み出し中に書き換えられた可能性がある
+        Args:
+            seq: latest/wait_nextで受け取ったシーケンス番号
+        """
+        with self._condition:
+            # 公開したフレームの次のスロットへ書き込むため、size-1回後の公開で書き込みが始まる
+            return self._seq - seq >= len(self._buffers) - 1
+
+    def stats(self):
+        with self._condition:
+            published = self.published_frames
+            return {
+                'seq': self._seq,
+                'published_frames': published,
+                'dropped_frames': self.dropped_frames,
+                'last_decode_latency': self.last_decode_latency,
+                'max_decode_latency': self.max_decode_latency,
+                'avg_decode_latency': self._total_decode_latency / published if published else 0.0,
+                'latest_timestamp': self._latest_timestamp,
+            }
+
+
+class PipeFrameReader:
+    """
+    ffmpegの標準出力を専用スレッドで読み続け、FrameRingへ直接readintoする。
+    読み出し側が遅れてもパイプに未読データが溜まらないため、遅延が増え続けない。
+    """
+
+    def __init__(self, pipe_out, frame_ring, stop_flag):
+        """
+        Args:
+            pipe_out: rawvideo(bgr24)を出力するパイプ
+            frame_ring: 書き込み先のFrameRing
+            stop_flag: 停止用のthreading.Event
+        """
+        self.pipe_out = pipe_out
+        self.frame_ring = frame_ring
+        self.stop_flag = stop_flag
+        self._thread = threading.Thread(target=self._read_frames, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _read_frames(self):
+        frame_size = self.frame_ring.frame_nbytes
+        while not self.stop_flag.is_set():
+            buffer = self.frame_ring.writable_buffer()
+            view = memoryview(buffer.reshape(-1))
+            filled = 0
+            start_time = None
+            while filled < frame_size:
+                try:
+                    read_size = self.pipe_out.readinto(view[filled:])
+                except Exception as ex:
+                    logger.error(f'Caught exception: {ex} at PipeFrameReader._read_frames')
+                    return
+                if not read_size:
+                    logger.warning('video pipe is closed at PipeFrameReader._read_frames')
+                    return
+                if start_time is None:
+                    # フレームの先頭が届いてから全体が揃うまでをデコード遅延とする
+                    start_time = time.perf_counter()
+                filled += read_size
+
+            self.frame_ring.publish(time.perf_counter() - start_time)
@@ -0,0 +1,103 @@
+# H.264 Annex B バイトストリームの簡易パーサ
+
+NAL_TYPE_SLICE = 1
+NAL_TYPE_IDR = 5
+NAL_TYPE_SEI = 6
+NAL_TYPE_SPS = 7
+NAL_TYPE_PPS = 8
+NAL_TYPE_AUD = 9
+
+SLICE_NAL_TYPES = (NAL_TYPE_SLICE, NAL_TYPE_IDR)
+# アクセスユニットの先頭に来るNALユニット
+AU_DELIMITER_NAL_TYPES = (NAL_TYPE_SEI, NAL_TYPE_SPS, NAL_TYPE_PPS, NAL_TYPE_AUD)
+
+START_CODE = b'\x00\x00\x01'
+
+
+def find_start_code(data, start=0, end=None):
+    """
+    Returns:
+        3バイトのスタートコード(00 00 01)の位置。見つからない場合は -1
+    """
+    if end is None:
+        end = len(data)
+    return data.find(START_CODE, start, end)
+
+
+def iter_nal_units(data):
+    """
+    スタートコードで区切られたNALユニットを列挙する
+    Args:
+        data: Annex B形式のバイト列
+    Returns:
+        (offset, nal_unit_type, payload_offset) のイテレータ。offsetはスタートコードの先頭
+    """
+    size = len(data)
+    position = find_start_code(data)
+    while position != -1:
+        payload_offset = position + 3
+        if payload_offset >= size:
+            return
+        # 4バイトのスタートコード(00 00 00 01)の先頭を含める
+        offset = position - 1 if position > 0 and data[position - 1] == 0 else position
+        yield offset, data[payload_offset] & 0x1F, payload_offset
+        position = find_start_code(data, payload_offset)
+
+
+def is_first_slice(data, payload_offset):
+    """
+    スライスヘッダの first_mb_in_slice が0か(= ピクチャの先頭スライスか)を判定する
+    first_mb_in_slice は ue(v) のため、0の場合は先頭ビットが1になる
+    """
+    header_offset = payload_offset + 1
+    return header_offset < len(data) and bool(data[header_offset] & 0x80)
+
+
+def split_access_units(data):
+    """
+    バイトストリームをアクセスユニット(1フレーム分)ごとに分割する
+    Args:
+        data: Annex B形式のバイト列
+    Returns:
+        アクセスユニットごとのbytesのリスト
+    """
+    access_units = []
+    au_start = None
+    has_slice = False
+    for offset, nal_type, payload_offset in iter_nal_units(data):
+        starts_new_au = (nal_type in AU_DELIMITER_NAL_TYPES or
+                         (nal_type in SLICE_NAL_TYPES and is_first_slice(data, payload_offset)))
+        if starts_new_au and has_slice:
+            access_units.append(bytes(data[au_start:offset]))
+            au_start = None
+            has_slice = False
+        if au_start is None:
+            au_start = offset
+        if nal_type in SLICE_NAL_TYPES:
+            has_slice = True
+
+    if au_start is not None and has_slice:
+        access_units.append(bytes(data[au_start:]))
+    return access_units
+
+
+def contains_nal_type(data, nal_types, start=0, end=None):
+    """
+    data[start:end] に指定したタイプのNALユニットが含まれるかを判定する
+    Args:
+        data: Annex B形式のバイト列 (bytes, bytearray)
+        nal_types: NALユニットタイプのタプル
+    """
+    if end is None:
+        end = len(data)
+    position = find_start_code(data, start, end)
+    while position != -1 and position + 3 < end:
+        if data[position + 3] & 0x1F in nal_types:
+            return True
+        position = find_start_code(data, position + 3, end)
+    return False
+
+
+def starts_with_start_code(data, start=0):
+    return (data[start:start + 3] == START_CODE or
+            data[start:start + 4] == b'\x00' + START_CODE)
@@ -0,0 +1,228 @@
+import logging
+import threading
+import time
+
+import cv2
+
+from models.video.jpeg_encoders import OpenCVJpegEncoder
+from models.video.stream_profiles import DEFAULT_PROFILE
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+JPEG_ENCODE_SECONDS = metrics.histogram('tello_jpeg_encode_seconds', 'Time to scale and encode a JPEG frame',
+                                        ('profile', ))
+
+# 視聴者がフレームを待つ最大時間(秒)。停止フラグを確認するために定期的に起きる
+SUBSCRIBER_WAIT_TIMEOUT = 1.0
+
+
+class _EncodedFrame:
+    """
+    1つの配信の設定でエンコードした最新のJPEG
+    """
+    __slots__ = ('lock', 'version', 'jpeg', 'encodes', 'encode_seconds')
+
+    def __init__(self, quality, scale):
+        self.lock = threading.Lock()
+        self.version = 0
+        self.jpeg = None
+        self.encodes = 0
+        self.encode_seconds = JPEG_ENCODE_SECONDS.labels(f'q{quality}_s{scale}')
+
+
+class JpegFrameBroadcaster:
+    """
+    1つのプロデューサースレッドで検出結果を描画したフレームを最新フレームバッファに格納し、全ての視聴者で共有する。
+    JPEGへのエンコードは配信の設定 (品質・縮小率) ごとに1フレーム1回だけ行い、同じ設定の視聴者で共有する。
+    遅い視聴者は古いフレームを読み飛ばし、常に最新のフレームのみを受け取る。
+    """
+
+    def __init__(self, frame_generator_factory, encoder=None, on_active=None, on_idle=None):
+        """
+        Args:
+            frame_generator_factory: 停止用のthreading.Eventを受け取り、配信するBGRのフレームをyieldするジェネレータを返す関数。
+                yieldしたフレームはコピーして共有するため、ジェネレータ側で再利用してよい。
+                Eventがセットされたらフレームが届かなくても終了すること
+            encoder: JpegEncoder。Noneの場合はOpenCVを使う
+            on_active: 最初の視聴者が来たときに呼び出す関数 (映像の受信の開始など)
+            on_idle: 最後の視聴者がいなくなったときに呼び出す関数
+        """
+        self._frame_generator_factory = frame_generator_factory
+        self.encoder = OpenCVJpegEncoder() if encoder is None else encoder
+        self._on_active = on_active
+        self._on_idle = on_idle
+
+        self._condition = threading.Condition()
+        self._frame = None
+        self._version = 0
+        # 配信の設定のencode_key -> _EncodedFrame
+        self._encoded_lock = threading.Lock()
+        self._encoded = {}
+
+        self._closed = threading.Event()
+        # 視聴者 (subscribeのジェネレータとlistener) の数。視聴者がいる間だけプロデューサースレッドを動かす
+        self._producer_lock = threading.Lock()
+        self._viewers = 0
+        self._producer_stop_flag = None
+        self._listeners = []
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def viewers(self):
+        return self._viewers
+
+    def _add_viewer(self):
+        with self._producer_lock:
+            self._viewers += 1
+            if self._viewers > 1 or self._closed.is_set():
+                return
+            if self._on_active is not None:
+                try:
+                    self._on_active()
+                except Exception:
+                    self._viewers -= 1
+                    raise
+            # 前のプロデューサースレッドは自分の停止フラグで終わるため、待たずに新しいスレッドを始める
+            self._producer_stop_flag = threading.Event()
+            threading.Thread(target=self._produce, args=(self._producer_stop_flag, ), daemon=True).start()
+
+    def _remove_viewer(self):
+        with self._producer_lock:
+            self._viewers -= 1
+            if self._viewers > 0 or self._producer_stop_flag is None:
+                return
+            self._producer_stop_flag.set()
+            self._producer_stop_flag = None
+            if self._on_idle is not None:
+                self._on_idle()
+
+    def stop(self):
+        """
+        配信を終了する。以降の視聴者にはフレームを送らない
+        """
+        self._closed.set()
+        with self._producer_lock:
+            if self._producer_stop_flag is not None:
+                self._producer_stop_flag.set()
+                self._producer_stop_flag = None
+        with self._condition:
+            self._condition.notify_all()
+
+    def _produce(self, stop_flag):
+        try:
+            for frame in self._frame_generator_factory(stop_flag):
+                if stop_flag.is_set():
+                    break
+                # エンコードは視聴者のスレッドで後から行うため、書き換えられないフレームとして公開する
+                frame = frame.copy()
+                with self._condition:
+                    self._frame = frame
+                    self._version += 1
+                    version = self._version
+                    self._condition.notify_all()
+                for listener, profile in self._listeners:
+                    listener(*self.encode(profile, version, frame))
+        except Exception as ex:
+            logger.error(f'Caught exception: {ex} at JpegFrameBroadcaster._produce')
+
+    def add_listener(self, listener, profile=DEFAULT_PROFILE):
+        """
+        新しいフレームごとにプロデューサースレッドから (version, jpeg) で呼び出す関数を登録する。
+        スレッドを使わない視聴者 (asyncioなど) に通知するために使う。listenerはすぐに戻ること。
+        登録している間は1人の視聴者として数える
+        Args:
+            profile: listenerに渡すJPEGの配信の設定
+        """
+        self._listeners = self._listeners + [(listener, profile)]
+        self._add_viewer()
+
+    def remove_listener(self, listener):
+        listeners = [(registered, profile) for registered, profile in self._listeners
+                     if registered is not listener]
+        removed = len(self._listeners) - len(listeners)
+        self._listeners = listeners
+        for _ in range(removed):
+            self._remove_viewer()
+
+    def wait_next(self, last_version, timeout=None):
+        """
+        last_versionより新しいフレームが届くまで待つ
+        Args:
+            last_version: 視聴者が最後に受け取ったフレームのバージョン
+            timeout: 最大待ち時間(秒)
+        Returns:
+            (version, frame) 新しいフレームがない場合は None
+        """
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._version > last_version or self._closed.is_set(), timeout)
+            if self._version <= last_version:
+                return None
+            return self._version, self._frame
+
+    def encode(self, profile, version, frame):
+        """
+        フレームを配信の設定でエンコードする。同じ設定で同じフレームをエンコード済みの場合はそれを返す
+        Args:
+            profile: StreamProfile
+            version, frame: wait_nextで受け取ったフレーム
+        Returns:
+            (version, jpeg) 他の視聴者が既に新しいフレームをエンコードしていた場合はそのフレーム
+        """
+        key = profile.encode_key
+        entry = self._encoded.get(key)
+        if entry is None:
+            with self._encoded_lock:
+                entry = self._encoded.setdefault(key, _EncodedFrame(*key))
+        # 同じ設定の視聴者は、先にエンコードを始めた視聴者の結果を待って使う
+        with entry.lock:
+            if entry.version < version:
+                start_time = time.perf_counter()
+                if profile.scale < 1.0:
+                    frame = cv2.resize(frame, None, fx=profile.scale, fy=profile.scale,
+                                       interpolation=cv2.INTER_AREA)
+                entry.jpeg = self.encoder.encode(frame, profile.quality)
+                entry.version = version
+                entry.encodes += 1
+                entry.encode_seconds.observe(time.perf_counter() - start_time)
+            return entry.version, entry.jpeg
+
+    def subscribe(self, profile=DEFAULT_PROFILE, adaptive=None):
+        """
+        視聴者ごとのジェネレータ。途中のフレームは読み飛ばし、最新のJPEGだけをyieldする。
+        ジェネレータを閉じる (クライアントが切断する) と視聴者から外れる
+        Args:
+            profile: 配信の設定
+            adaptive: AdaptiveStreamProfile。指定した場合はprofileの代わりにその時点の設定を使う
+        """
+        self._add_viewer()
+        try:
+            last_version = self._version
+            next_time = 0.0
+            while not self._closed.is_set():
+                current = profile if adaptive is None else adaptive.profile
+                wait = next_time - time.perf_counter()
+                if wait > 0:
+                    # 最大のフレームレートを超えないように待つ
+                    time.sleep(wait)
+                latest = self.wait_next(last_version, timeout=SUBSCRIBER_WAIT_TIMEOUT)
+                if latest is None:
+                    continue
+                last_version, jpeg = self.encode(current, *latest)
+                next_time = time.perf_counter() + current.frame_interval
+                yield jpeg
+        finally:
+            self._remove_viewer()
+
+    def stats(self):
+        with self._encoded_lock:
+            encoded = dict(self._encoded)
+        return {
+            'encoder': self.encoder.name,
+            'viewers': self._viewers,
+            'encodes': {f'q{quality}_s{scale}': entry.encodes for (quality, scale), entry in encoded.items()},
+        }
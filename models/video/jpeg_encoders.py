@@ -0,0 +1,105 @@
+import logging
+
+import cv2
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JPEG_QUALITY = 95
+
+
+class JpegEncoder:
+    """
+    BGRの画像をJPEGのバイト列にするエンコーダの基底クラス
+    """
+    name = None
+
+    def encode(self, image, quality=DEFAULT_JPEG_QUALITY):
+        """
+        Args:
+            image: BGRの画像 (H, W, 3)
+            quality: JPEGの品質 (1-100)
+        Returns:
+            JPEGのバイト列
+        """
+        raise NotImplementedError
+
+
+class OpenCVJpegEncoder(JpegEncoder):
+    """
+    cv2.imencodeによるエンコーダ。追加のライブラリなしで使える
+    """
+    name = 'opencv'
+
+    def encode(self, image, quality=DEFAULT_JPEG_QUALITY):
+        _, jpeg = cv2.imencode('.jpg', image, (cv2.IMWRITE_JPEG_QUALITY, int(quality)))
+        return jpeg.tobytes()
+
+
+class TurboJpegEncoder(JpegEncoder):
+    """
+    PyTurboJPEG (libjpeg-turboのバインディング) によるエンコーダ。
+    色差を4:2:0で間引き、高速なDCTを使う
+    """
+    name = 'turbojpeg'
+
+    def __init__(self):
+        try:
+            import turbojpeg
+            self._turbojpeg = turbojpeg.TurboJPEG()
+        except (ImportError, OSError, RuntimeError) as ex:
+            # OSError, RuntimeError: libturbojpeg の共有ライブラリが見つからない
+            raise ErrorJpegEncoderUnavailable(f'PyTurboJPEG is not available: {ex}')
+        self._pixel_format = turbojpeg.TJPF_BGR
+        self._subsample = turbojpeg.TJSAMP_420
+        self._flags = turbojpeg.TJFLAG_FASTDCT
+
+    def encode(self, image, quality=DEFAULT_JPEG_QUALITY):
+        return self._turbojpeg.encode(image, quality=int(quality), pixel_format=self._pixel_format,
+                                      jpeg_subsample=self._subsample, flags=self._flags)
+
+
+class SimpleJpegEncoder(JpegEncoder):
+    """
+    simplejpeg (libjpeg-turboを同梱したバインディング) によるエンコーダ
+    """
+    name = 'simplejpeg'
+
+    def __init__(self):
+        try:
+            import simplejpeg
+        except ImportError as ex:
+            raise ErrorJpegEncoderUnavailable(f'simplejpeg is not installed: {ex}')
+        self._simplejpeg = simplejpeg
+
+    def encode(self, image, quality=DEFAULT_JPEG_QUALITY):
+        return self._simplejpeg.encode_jpeg(image, quality=int(quality), colorspace='BGR',
+                                            colorsubsampling='420', fastdct=True)
+
+
+JPEG_ENCODERS = {
+    TurboJpegEncoder.name: TurboJpegEncoder,
+    SimpleJpegEncoder.name: SimpleJpegEncoder,
+    OpenCVJpegEncoder.name: OpenCVJpegEncoder,
+}
+
+
+def create_jpeg_encoder(name):
+    """
+    エンコーダを生成する。指定のエンコーダが使えない場合はOpenCVにフォールバックする
+    Args:
+        name: エンコーダ名 ('turbojpeg', 'simplejpeg' または 'opencv')
+    """
+    encoder_class = JPEG_ENCODERS.get(name)
+    if encoder_class is None:
+        raise ValueError(f'unknown jpeg encoder: {name}')
+    try:
+        encoder = encoder_class()
+    except ErrorJpegEncoderUnavailable as ex:
+        logger.warning(f'{ex}. fall back to {OpenCVJpegEncoder.name}')
+        encoder = OpenCVJpegEncoder()
+    logger.info(f'jpeg encoder: {encoder.name}')
+    return encoder
+
+
+class ErrorJpegEncoderUnavailable(Exception):
+    """Error jpeg encoder backend is not available"""
@@ -0,0 +1,133 @@
+import collections
+import logging
+import threading
+
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+VIDEO_PIPELINE_STARTS = metrics.counter('tello_video_pipeline_starts_total',
+                                        'Times the video receive/decode pipeline was started', ('drone', ))
+VIDEO_PIPELINE_STOPS = metrics.counter('tello_video_pipeline_stops_total',
+                                       'Times the video receive/decode pipeline was stopped', ('drone', ))
+
+# 最後の利用者がいなくなってから停止するまでの時間(秒)の既定値
+DEFAULT_IDLE_GRACE_PERIOD = 10.0
+
+
+class VideoPipeline:
+    """
+    映像の受信とデコードを、利用者 (視聴者, 顔検出, 姿勢認識, 記録など) がいる間だけ動かす。
+    最初の利用者で開始し、最後の利用者がいなくなってから idle_grace_period 秒後に停止する。
+    その間に利用者が戻った場合 (ページの再読み込みなど) は停止しない
+    """
+
+    def __init__(self, start, stop, idle_grace_period=DEFAULT_IDLE_GRACE_PERIOD, name=''):
+        """
+        Args:
+            start: 受信とデコードを開始する関数
+            stop: 受信とデコードを停止し、スレッドとデコーダを解放する関数
+            idle_grace_period: 利用者がいなくなってから停止するまでの時間(秒)
+            name: メトリクスのラベル
+        """
+        self._start = start
+        self._stop = stop
+        self.idle_grace_period = idle_grace_period
+        self._lock = threading.Lock()
+        # 利用者の名前 -> 数
+        self._consumers = collections.Counter()
+        self._running = False
+        self._stop_timer = None
+        # 停止の予約を取り消したかを見分けるための番号
+        self._generation = 0
+        self.starts = 0
+        self.stops = 0
+        self._starts_counter = VIDEO_PIPELINE_STARTS.labels(name)
+        self._stops_counter = VIDEO_PIPELINE_STOPS.labels(name)
+
+    @property
+    def running(self):
+        return self._running
+
+    def acquire(self, consumer):
+        """
+        利用者を追加する。停止していれば開始し、停止を予約していれば取り消す
+        Args:
+            consumer: 利用者の名前。同じ名前で複数回追加した場合は同じ回数releaseする
+        """
+        with self._lock:
+            self._cancel_stop_timer()
+            if self._running:
+                self._consumers[consumer] += 1
+                return
+            # 開始に失敗した場合は利用者に数えない。次のacquireで開始し直す
+            self._start()
+            self._consumers[consumer] += 1
+            self._running = True
+            self.starts += 1
+            self._starts_counter.inc()
+        logger.info(f'video pipeline is started by {consumer}')
+
+    def release(self, consumer):
+        """
+        利用者を取り除く。利用者がいなくなった場合は idle_grace_period 秒後に停止する
+        """
+        with self._lock:
+            if self._consumers[consumer] <= 0:
+                logger.warning(f'{consumer} is not using the video pipeline')
+                return
+            self._consumers[consumer] -= 1
+            if self._consumers[consumer] == 0:
+                del self._consumers[consumer]
+            if self._consumers or not self._running:
+                return
+            self._cancel_stop_timer()
+            timer = threading.Timer(self.idle_grace_period, self._stop_if_idle, args=(self._generation, ))
+            timer.daemon = True
+            timer.start()
+            self._stop_timer = timer
+
+    def _cancel_stop_timer(self):
+        self._generation += 1
+        if self._stop_timer is not None:
+            self._stop_timer.cancel()
+            self._stop_timer = None
+
+    def _stop_if_idle(self, generation):
+        with self._lock:
+            # 予約した後に利用者が戻った、または予約し直した
+            if generation != self._generation or self._consumers or not self._running:
+                return
+            self._stop_timer = None
+            self._stop_locked()
+        logger.info('video pipeline is stopped because no one is using it')
+
+    def _stop_locked(self):
+        self._running = False
+        self.stops += 1
+        self._stops_counter.inc()
+        try:
+            self._stop()
+        except Exception as ex:
+            logger.error(f'Caught exception: {ex} at VideoPipeline._stop_locked')
+
+    def close(self):
+        """
+        利用者に関わらずすぐに停止する
+        """
+        with self._lock:
+            self._cancel_stop_timer()
+            self._consumers.clear()
+            if self._running:
+                self._stop_locked()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'running': self._running,
+                'consumers': dict(self._consumers),
+                'stopping': self._stop_timer is not None,
+                'idle_grace_period': self.idle_grace_period,
+                'starts': self.starts,
+                'stops': self.stops,
+            }
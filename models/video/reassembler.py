@@ -0,0 +1,141 @@
+import logging
+
+from models.video.h264 import NAL_TYPE_IDR
+from models.video.h264 import NAL_TYPE_PPS
+from models.video.h264 import NAL_TYPE_SPS
+from models.video.h264 import contains_nal_type
+from models.video.h264 import starts_with_start_code
+
+logger = logging.getLogger(__name__)
+
+# Telloは1フレームを1460バイトのパケットに分割し、最後のパケットだけがそれより短い
+TELLO_VIDEO_PACKET_SIZE = 1460
+MAX_DATAGRAM_SIZE = 2048
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+PARAMETER_SET_NAL_TYPES = (NAL_TYPE_SPS, NAL_TYPE_PPS)
+
+
+class H264Reassembler:
+    """
+    Telloの映像パケットをアクセスユニット(1フレーム)単位に組み立て、1回の呼び出しでデコーダへ渡す。
+    パケットは事前に確保したバッファへ直接受信するため、パケットごとのコピーは発生しない。
+    欠けたフレームを検出した場合は、次のIDRフレームまでデコーダへ渡さない。
+    """
+
+    def __init__(self, on_access_unit, buffer_size=DEFAULT_BUFFER_SIZE, packet_size=TELLO_VIDEO_PACKET_SIZE):
+        """
+        Args:
+            on_access_unit: 完成したアクセスユニット(memoryview)を受け取る関数。呼び出し後はバッファが再利用される
+            buffer_size: 組み立て用バッファのサイズ
+            packet_size: 分割されたパケットのサイズ
+        """
+        self.on_access_unit = on_access_unit
+        self.packet_size = packet_size
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._length = 0
+        # 最初のフレームもIDRから始める
+        self._waiting_for_idr = True
+        self._discarding = False
+
+        self.packets = 0
+        self.bytes = 0
+        self.frames = 0
+        self.incomplete_frames = 0
+        self.skipped_frames = 0
+        self.overflows = 0
+
+    def receive_from(self, sock):
+        """
+        ソケットから1パケットをバッファへ直接受信する
+        Args:
+            sock: 映像用のUDPソケット
+        Returns:
+            受信したバイト数
+        """
+        if len(self._buffer) - self._length < MAX_DATAGRAM_SIZE:
+            logger.warning('video frame is too large. drop it')
+            self.overflows += 1
+            self._drop_frame()
+            self._discarding = True
+        data_size, _ = sock.recvfrom_into(self._view[self._length:self._length + MAX_DATAGRAM_SIZE])
+        self.push(data_size)
+        return data_size
+
+    def push(self, data_size):
+        """
+        バッファの末尾に書き込まれたdata_sizeバイトのパケットを処理する
+        """
+        packet_start = self._length
+        self.packets += 1
+        self.bytes += data_size
+
+        if starts_with_start_code(self._buffer, packet_start):
+            if packet_start > 0:
+                if packet_start % self.packet_size == 0:
+                    # 前のフレームの大きさがpacket_sizeのちょうど倍数で、短い最後のパケットがなかった。
+                    # 最後のパケットが丸ごと欠けた場合と区別できないため、完成したフレームとしてデコーダに任せる
+                    self._length = packet_start
+                    self._complete_frame()
+                else:
+                    # 前のフレームの最後のパケットが届かなかった
+                    self._drop_frame()
+                self._buffer[:data_size] = self._view[packet_start:packet_start + data_size]
+                packet_start = 0
+            self._discarding = False
+        elif packet_start == 0 and not self._discarding:
+            # フレームの先頭パケットが届かなかった
+            self._drop_frame()
+            self._discarding = True
+
+        is_frame_end = data_size < self.packet_size
+        if self._discarding:
+            # 欠けたフレームの残りのパケットは読み捨てる
+            self._length = 0
+            if is_frame_end:
+                self._discarding = False
+            return
+
+        self._length = packet_start + data_size
+        if is_frame_end:
+            self._complete_frame()
+
+    def _complete_frame(self):
+        length = self._length
+        self._length = 0
+        if self._waiting_for_idr:
+            if not contains_nal_type(self._buffer, (NAL_TYPE_IDR, ), 0, length):
+                # SPS/PPSだけのパケットはIDRのデコードに必要なので渡す
+                if contains_nal_type(self._buffer, PARAMETER_SET_NAL_TYPES, 0, length):
+                    self.on_access_unit(self._view[:length])
+                else:
+                    self.skipped_frames += 1
+                return
+            self._waiting_for_idr = False
+        self.frames += 1
+        self.on_access_unit(self._view[:length])
+
+    def reset(self):
+        """
+        組み立て中のフレームを捨て、次のIDRフレームから組み立て直す。映像の受信を再開するときに使う
+        """
+        self._length = 0
+        self._waiting_for_idr = True
+        self._discarding = False
+
+    def _drop_frame(self):
+        self.incomplete_frames += 1
+        self._length = 0
+        self._waiting_for_idr = True
+
+    def stats(self):
+        total_frames = self.frames + self.incomplete_frames
+        return {
+            'packets': self.packets,
+            'bytes': self.bytes,
+            'frames': self.frames,
+            'incomplete_frames': self.incomplete_frames,
+            'skipped_frames': self.skipped_frames,
+            'overflows': self.overflows,
+            'frame_loss_rate': self.incomplete_frames / total_frames if total_frames else 0.0,
+        }
@@ -0,0 +1,176 @@
+import logging
+import selectors
+import socket
+import threading
+
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+VIDEO_PACKETS = metrics.counter('tello_video_packets_total', 'UDP packets received from the video port')
+VIDEO_RECEIVED_BYTES = metrics.counter('tello_video_received_bytes_total', 'Bytes received from the video port')
+
+DEFAULT_NUM_WORKERS = 2
+# stop_flagを確認する間隔(秒)
+SELECT_TIMEOUT = 0.5
+# 1つのソケットから続けて受信する最大パケット数。他のドローンの映像を待たせすぎないようにする
+MAX_PACKETS_PER_WAKEUP = 64
+
+
+class _VideoReceiveWorker:
+    """
+    担当する映像ソケットを1つのスレッドで待ち受け、受信したスレッドでそのまま組み立てとデコードまで行う
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._selector = selectors.DefaultSelector()
+        # スレッドが select で待っている間にソケットを追加・削除するための起床用ソケット
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._wakeup_reader.setblocking(False)
+        self._selector.register(self._wakeup_reader, selectors.EVENT_READ, None)
+        self._lock = threading.Lock()
+        self._changes = []
+        self.sockets = 0
+
+        self.stop_flag = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(self.stop_flag, ), name=name, daemon=True)
+        self._thread.start()
+
+    def add(self, sock, reassembler):
+        with self._lock:
+            self._changes.append((sock, reassembler))
+            self.sockets += 1
+        self._wake()
+
+    def remove(self, sock):
+        """
+        ソケットの受信をやめて閉じる。受信中のパケットの処理が終わるまで待つ
+        """
+        removed = threading.Event()
+        with self._lock:
+            self._changes.append((sock, removed))
+            self.sockets -= 1
+        self._wake()
+        if threading.current_thread() is not self._thread:
+            removed.wait(timeout=2.0)
+
+    def stop(self):
+        self.stop_flag.set()
+        self._wake()
+        self._thread.join(timeout=2.0)
+        for key in list(self._selector.get_map().values()):
+            if key.data is not None:
+                key.fileobj.close()
+        self._selector.close()
+        self._wakeup_reader.close()
+        self._wakeup_writer.close()
+
+    def _wake(self):
+        try:
+            self._wakeup_writer.send(b'\0')
+        except OSError:
+            pass
+
+    def _apply_changes(self):
+        with self._lock:
+            changes = self._changes
+            self._changes = []
+        for sock, change in changes:
+            if not isinstance(change, threading.Event):
+                self._selector.register(sock, selectors.EVENT_READ, change)
+                continue
+            try:
+                self._selector.unregister(sock)
+            except KeyError:
+                pass
+            sock.close()
+            change.set()
+
+    def _run(self, stop_flag):
+        video_packets = VIDEO_PACKETS.labels()
+        video_received_bytes = VIDEO_RECEIVED_BYTES.labels()
+        while not stop_flag.is_set():
+            for key, _ in self._selector.select(SELECT_TIMEOUT):
+                reassembler = key.data
+                if reassembler is None:
+                    try:
+                        self._wakeup_reader.recv(4096)
+                    except BlockingIOError:
+                        pass
+                    continue
+                for _ in range(MAX_PACKETS_PER_WAKEUP):
+                    try:
+                        data_size = reassembler.receive_from(key.fileobj)
+                    except BlockingIOError:
+                        break
+                    except OSError as ex:
+                        logger.error(f'Caught exception socket.error: {ex} at VideoReceiverPool._run')
+                        break
+                    except Exception as ex:
+                        logger.error(f'Caught exception: {ex} at VideoReceiverPool._run')
+                        break
+                    video_packets.inc()
+                    video_received_bytes.inc(data_size)
+            self._apply_changes()
+
+
+class VideoReceiverPool:
+    """
+    複数のドローンの映像を少数のスレッドで受信・デコードする。
+    ドローンごとに映像の受信スレッドを作らず、担当するソケットの少ないスレッドに割り当てる
+    """
+
+    def __init__(self, num_workers=DEFAULT_NUM_WORKERS):
+        self.num_workers = num_workers
+        self._lock = threading.Lock()
+        self._workers = []
+        # 映像のポート -> (ソケット, 担当のワーカー)
+        self._receivers = {}
+
+    def add(self, host_ip, video_port, reassembler):
+        """
+        映像の受信を開始する
+        Args:
+            host_ip, video_port: 映像を受信するアドレス
+            reassembler: 受信したパケットを渡すH264Reassembler
+        """
+        with self._lock:
+            if video_port in self._receivers:
+                return
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                sock.bind((host_ip, video_port))
+            except OSError:
+                sock.close()
+                raise
+            sock.setblocking(False)
+            if len(self._workers) < self.num_workers:
+                # ワーカーはドローンの映像を受信し始めたときに作る
+                self._workers.append(_VideoReceiveWorker(f'video-receiver-{len(self._workers)}'))
+            worker = min(self._workers, key=lambda candidate: candidate.sockets)
+            worker.add(sock, reassembler)
+            self._receivers[video_port] = (sock, worker)
+
+    def remove(self, video_port):
+        with self._lock:
+            receiver = self._receivers.pop(video_port, None)
+        if receiver is not None:
+            sock, worker = receiver
+            worker.remove(sock)
+
+    def stop(self):
+        with self._lock:
+            workers = self._workers
+            self._workers = []
+            self._receivers = {}
+        for worker in workers:
+            worker.stop()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': len(self._workers),
+                'ports': {port: worker.name for port, (_, worker) in self._receivers.items()},
+            }
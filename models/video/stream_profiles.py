@@ -0,0 +1,158 @@
+import math
+import time
+
+from models.video.jpeg_encoders import DEFAULT_JPEG_QUALITY
+
+MIN_QUALITY = 10
+MAX_QUALITY = 100
+QUALITY_STEP = 5
+# フレームはデコード時の大きさより大きくしても情報が増えないため、縮小だけを行う
+MIN_SCALE = 0.1
+MAX_SCALE = 1.0
+SCALE_STEP = 0.05
+MAX_FPS = 30
+
+ADAPTIVE_PROFILE_NAME = 'auto'
+# 自動調整で使う段階 (負荷の高い順)
+ADAPTIVE_LEVELS = ('high', 'medium', 'low', 'minimum')
+# 送信にかかった時間の割合を見直す間隔(秒)
+ADAPTIVE_WINDOW = 2.0
+# 送信にかかった時間の割合がこれを超えたら1段階下げる
+DOWNGRADE_UTILIZATION = 0.7
+# この割合を下回る状態がUPGRADE_WINDOWS回続いたら1段階上げる
+UPGRADE_UTILIZATION = 0.25
+UPGRADE_WINDOWS = 3
+
+
+class StreamProfile:
+    """
+    配信の設定
+    """
+    __slots__ = ('name', 'quality', 'scale', 'max_fps')
+
+    def __init__(self, name, quality=DEFAULT_JPEG_QUALITY, scale=1.0, max_fps=0):
+        """
+        Args:
+            name: 設定の名前
+            quality: JPEGの品質 (1-100)
+            scale: デコードしたフレームに対する縮小率
+            max_fps: 最大のフレームレート。0の場合は全てのフレームを送る
+        """
+        self.name = name
+        self.quality = quality
+        self.scale = scale
+        self.max_fps = max_fps
+
+    @property
+    def encode_key(self):
+        """
+        エンコード結果を共有できる設定の組。フレームレートはエンコード結果に影響しない
+        """
+        return self.quality, self.scale
+
+    @property
+    def frame_interval(self):
+        return 1.0 / self.max_fps if self.max_fps else 0.0
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+# 従来どおり、全てのフレームをデコードした大きさのままOpenCVの既定の品質で送る
+DEFAULT_PROFILE = StreamProfile('default')
+PROFILES = {
+    'high': StreamProfile('high', quality=90, scale=1.0, max_fps=30),
+    'medium': StreamProfile('medium', quality=75, scale=1.0, max_fps=15),
+    'low': StreamProfile('low', quality=60, scale=0.5, max_fps=10),
+    'minimum': StreamProfile('minimum', quality=40, scale=0.5, max_fps=5),
+}
+
+
+def _quantize(value, step, lower, upper):
+    # 近い設定の視聴者でエンコード結果を共有できるように丸める
+    return min(max(round(value / step) * step, lower), upper)
+
+
+def make_stream_profile(name=None, quality=None, scale=None, fps=None):
+    """
+    クエリパラメータから配信の設定を作る
+    Args:
+        name: PROFILESの名前。Noneの場合はDEFAULT_PROFILEを元にする
+        quality, scale, fps: 指定した場合は元の設定を上書きする
+    Returns:
+        StreamProfile
+    """
+    if name is None:
+        base = DEFAULT_PROFILE
+    elif name in PROFILES:
+        base = PROFILES[name]
+    else:
+        raise ErrorUnknownStreamProfile(f'unknown stream profile: {name}')
+    for param, value in (('quality', quality), ('scale', scale), ('fps', fps)):
+        # クエリパラメータの 'nan' や 'inf' もfloatとして読めてしまう
+        if value is not None and not math.isfinite(value):
+            raise ErrorUnknownStreamProfile(f'{param} must be a finite number: {value}')
+    if quality is None and scale is None and fps is None:
+        return base
+    return StreamProfile(
+        'custom',
+        quality=base.quality if quality is None else int(_quantize(quality, QUALITY_STEP, MIN_QUALITY, MAX_QUALITY)),
+        scale=base.scale if scale is None else round(_quantize(scale, SCALE_STEP, MIN_SCALE, MAX_SCALE), 2),
+        max_fps=base.max_fps if fps is None else int(min(max(fps, 1), MAX_FPS)))
+
+
+class AdaptiveStreamProfile:
+    """
+    視聴者ごとに、送信にかかった時間の割合からその回線で送り切れる段階の設定を選ぶ。
+    送信が詰まってフレームを送る時間の大半を占めるようになったら下げ、余裕のある状態が続いたら上げる
+    """
+
+    def __init__(self, levels=ADAPTIVE_LEVELS, window=ADAPTIVE_WINDOW):
+        self.levels = [PROFILES[name] for name in levels]
+        self.window = window
+        self._level = 0
+        self._window_start = time.perf_counter()
+        self._busy = 0.0
+        self._idle_windows = 0
+        self.utilization = 0.0
+        self.adjustments = 0
+
+    @property
+    def profile(self):
+        return self.levels[self._level]
+
+    def record(self, send_seconds):
+        """
+        1フレームの送信にかかった時間を記録し、必要なら段階を切り替える
+        Returns:
+            段階を切り替えた場合は True
+        """
+        self._busy += send_seconds
+        now = time.perf_counter()
+        elapsed = now - self._window_start
+        if elapsed < self.window:
+            return False
+
+        self.utilization = self._busy / elapsed
+        self._window_start = now
+        self._busy = 0.0
+        level = self._level
+        if self.utilization > DOWNGRADE_UTILIZATION:
+            level = min(level + 1, len(self.levels) - 1)
+            self._idle_windows = 0
+        elif self.utilization < UPGRADE_UTILIZATION:
+            self._idle_windows += 1
+            if self._idle_windows >= UPGRADE_WINDOWS:
+                level = max(level - 1, 0)
+                self._idle_windows = 0
+        else:
+            self._idle_windows = 0
+        if level == self._level:
+            return False
+        self._level = level
+        self.adjustments += 1
+        return True
+
+
+class ErrorUnknownStreamProfile(Exception):
+    """Error no stream profile with the name"""
@@ -1,15 +1,68 @@
-import os
-
-from flask import Flask
-
-SERVER_ADDRESS = '0.0.0.0'
-SERVER_PORT = 5000
-PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
-TEMPLATES = os.path.join(PROJECT_ROOT, 'templates')
-STATIC_FOLDER = os.path.join(PROJECT_ROOT, 'static')
-DEBUG_MODE = True
-
-app = Flask(__name__, template_folder=TEMPLATES, static_folder=STATIC_FOLDER)
-
-if DEBUG_MODE:
+import os
+
+from flask import Flask
+
+SERVER_ADDRESS = '0.0.0.0'
+SERVER_PORT = int(os.environ.get('SERVER_PORT', 5000))
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+TEMPLATES = os.path.join(PROJECT_ROOT, 'templates')
+STATIC_FOLDER = os.path.join(PROJECT_ROOT, 'static')
+DEBUG_MODE = True
+# 'flask' (Flaskのスレッドサーバー) または 'asgi' (uvicorn。映像とコマンドをWebSocketでやり取りする)
+SERVER_MODE = 'flask'
+# Telloとの通信先。シミュレーター (benchmarks.tello_simulator) に繋ぐ場合は環境変数で上書きする
+TELLO_HOST_IP = os.environ.get('TELLO_HOST_IP', '192.168.10.2')
+TELLO_HOST_COMMAND_PORT = int(os.environ.get('TELLO_HOST_COMMAND_PORT', 8889))
+TELLO_DRONE_IP = os.environ.get('TELLO_DRONE_IP', '192.168.10.1')
+TELLO_COMMAND_PORT = int(os.environ.get('TELLO_COMMAND_PORT', 8889))
+TELLO_VIDEO_PORT = int(os.environ.get('TELLO_VIDEO_PORT', 11111))
+TELLO_STATE_PORT = int(os.environ.get('TELLO_STATE_PORT', 8890))
+# 複数台のTello (EDUのステーションモード) を操作する場合は、1台ずつ
+# {'id': 'tello1', 'drone_ip': '192.168.0.11', 'video_port': 11111} のように映像のポートを分けて並べる。
+# 空の場合は TELLO_DRONE_IP の1台を 'default' として操作する
+TELLO_FLEET = []
+# 全台の映像を受信・デコードするスレッドの数
+VIDEO_RECEIVE_WORKERS = 2
+# ドローン映像のデコーダ: 'pyav' (プロセス内デコード) または 'ffmpeg' (サブプロセスのパイプ)
+VIDEO_DECODER = 'pyav'
+# 映像の視聴者・顔検出・姿勢認識・記録がいなくなってから、映像の受信とデコードを止めるまでの時間(秒)
+VIDEO_IDLE_GRACE_PERIOD = 10.0
+# 配信するJPEGのエンコーダ: 'turbojpeg' (PyTurboJPEG), 'simplejpeg' または 'opencv'。使えない場合はOpenCV
+JPEG_ENCODER = 'turbojpeg'
+# 顔の追跡に使う検出器: 'haar' (Haarカスケード), 'yunet' (OpenCV DNNのYuNet), 'ssd' (OpenCV DNNのSSD)
+# または 'movenet' (骨格検知モデルの顔の骨格点)。モデルがない場合はHaarカスケードを使う
+FACE_DETECTOR = 'haar'
+# opencv_zoo の face_detection_yunet_2023mar.onnx
+FACE_YUNET_MODEL_FILE = os.path.join(PROJECT_ROOT, 'models', 'detection', 'face', 'face_detection_yunet_2023mar.onnx')
+# OpenCVのサンプルの res10_300x300_ssd_iter_140000.caffemodel と deploy.prototxt
+FACE_SSD_MODEL_FILE = os.path.join(PROJECT_ROOT, 'models', 'detection', 'face', 'res10_300x300_ssd_iter_140000.caffemodel')
+FACE_SSD_CONFIG_FILE = os.path.join(PROJECT_ROOT, 'models', 'detection', 'face', 'deploy.prototxt')
+# 姿勢認識モードで使う骨格検知モデルと推論スレッドの数
+# 'singlepose' (MoveNet SinglePose) または 'multipose' (MoveNet MultiPose, 最大6人)
+PERSON_KEYPOINTS_MODEL_TYPE = 'singlepose'
+PERSON_KEYPOINTS_MODEL_FILE = os.path.join(PROJECT_ROOT, 'models', 'detection', 'person_keypoints',
+                                           'movenet_singlepose_lightning.tflite')
+MULTI_PERSON_KEYPOINTS_MODEL_FILE = os.path.join(PROJECT_ROOT, 'models', 'detection', 'person_keypoints',
+                                                 'movenet_multipose_lightning.tflite')
+POSE_INFERENCE_WORKERS = 1
+# 姿勢認識の判定: 直近のフレーム数、姿勢を開始・終了する割合、同じ姿勢のコマンドを再び送るまでの時間(秒)
+GESTURE_WINDOW = 5
+GESTURE_ENTER_CONFIDENCE = 0.6
+GESTURE_EXIT_CONFIDENCE = 0.4
+GESTURE_COOLDOWN = 2.0
+# TFLiteの推論スレッド数と、使う場合はデリゲートの共有ライブラリ (例: 'libedgetpu.so.1')
+TFLITE_NUM_THREADS = 2
+TFLITE_DELEGATE = None
+# 顔検出・姿勢認識に使ってよいCPU (1コアに対する割合) と1フレームあたりの処理時間(秒)
+INFERENCE_CPU_BUDGET = 0.3
+INFERENCE_LATENCY_BUDGET = 0.05
+# フライトデータ (映像・コマンド・状態・検出結果) の記録先。RECORD_FLIGHTSがTrueの場合は起動時から記録する
+FLIGHT_RECORDING_DIR = os.path.join(PROJECT_ROOT, 'recordings')
+RECORD_FLIGHTS = False
+# Trueの場合は起動時にバックグラウンドで骨格検知モデルを読み込んでおく
+PRELOAD_PERSON_KEYPOINTS_MODEL = False
+
+app = Flask(__name__, template_folder=TEMPLATES, static_folder=STATIC_FOLDER)
+
+if DEBUG_MODE:
     app.debug = True
\ No newline at end of file
@@ -0,0 +1,240 @@
+import bisect
+import threading
+
+from utils.singleton import Singleton
+
+# 処理時間のヒストグラムの既定の区切り(秒)
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class _Shards:
+    """
+    スレッドごとの値の置き場所。
+    記録するスレッドは自分の置き場所だけを書き換えるため、記録時にロックを取らない
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+        # 終了したスレッドの値の合計
+        self._retired = [0] * size
+
+    def get(self):
+        """
+        Returns:
+            呼び出したスレッドの値のリスト
+        """
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = [0] * self.size
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+            self._local.shard = shard
+            return shard
+
+    def total(self):
+        """
+        Returns:
+            全てのスレッドの値の合計
+        """
+        with self._lock:
+            alive = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, shard))
+                else:
+                    # 終了したスレッドはもう書き込まないため、合計に移してよい
+                    self._retired = [retired + value for retired, value in zip(self._retired, shard)]
+            self._shards = alive
+            total = list(self._retired)
+            for _, shard in alive:
+                total = [value + current for value, current in zip(total, shard)]
+        return total
+
+
+class Counter:
+    """
+    増えるだけの値
+    """
+    type_name = 'counter'
+
+    def __init__(self):
+        self._shards = _Shards(1)
+
+    def inc(self, amount=1):
+        self._shards.get()[0] += amount
+
+    def collect(self):
+        return {'value': self._shards.total()[0]}
+
+
+class Histogram:
+    """
+    区切りの固定されたヒストグラム
+    """
+    type_name = 'histogram'
+
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        # 区切りごとの件数、+Infの件数、合計
+        self._shards = _Shards(len(self.buckets) + 2)
+
+    def observe(self, value):
+        shard = self._shards.get()
+        shard[bisect.bisect_left(self.buckets, value)] += 1
+        shard[-1] += value
+
+    def collect(self):
+        total = self._shards.total()
+        counts = total[:-1]
+        cumulative = 0
+        buckets = {}
+        for upper_bound, count in zip(self.buckets + (float('inf'), ), counts):
+            cumulative += count
+            buckets[upper_bound] = cumulative
+        return {'buckets': buckets, 'sum': total[-1], 'count': cumulative}
+
+
+class MetricFamily:
+    """
+    同じ名前でラベルの値ごとに分かれたメトリクス
+    """
+
+    def __init__(self, name, documentation, metric_class, label_names=(), **kwargs):
+        self.name = name
+        self.documentation = documentation
+        self.metric_class = metric_class
+        self.label_names = tuple(label_names)
+        self._kwargs = kwargs
+        self._lock = threading.Lock()
+        self._children = {}
+        if not self.label_names:
+            # ラベルがない場合は、まだ記録していなくても0として出力する
+            self._children[()] = metric_class(**kwargs)
+
+    @property
+    def type_name(self):
+        return self.metric_class.type_name
+
+    def labels(self, *label_values):
+        """
+        ラベルの値に対応するメトリクスを返す。ループの中で使う場合は事前に取得しておくこと
+        """
+        label_values = tuple(str(value) for value in label_values)
+        child = self._children.get(label_values)
+        if child is None:
+            if len(label_values) != len(self.label_names):
+                raise ValueError(f'{self.name} expects labels {self.label_names}')
+            with self._lock:
+                child = self._children.setdefault(label_values, self.metric_class(**self._kwargs))
+        return child
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def collect(self):
+        """
+        Returns:
+            (ラベルの辞書, 値の辞書) のリスト
+        """
+        with self._lock:
+            children = list(self._children.items())
+        return [(dict(zip(self.label_names, label_values)), child.collect()) for label_values, child in children]
+
+
+class MetricsRegistry(metaclass=Singleton):
+    """
+    アプリ全体のメトリクスの登録先
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._families = {}
+
+    def _register(self, name, documentation, metric_class, label_names, **kwargs):
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = MetricFamily(name, documentation, metric_class, label_names, **kwargs)
+                self._families[name] = family
+            elif family.metric_class is not metric_class or family.label_names != tuple(label_names):
+                raise ValueError(f'{name} is already registered as a different metric')
+            return family
+
+    def counter(self, name, documentation, label_names=()):
+        return self._register(name, documentation, Counter, label_names)
+
+    def histogram(self, name, documentation, label_names=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        return self._register(name, documentation, Histogram, label_names, buckets=buckets)
+
+    def to_dict(self):
+        with self._lock:
+            families = list(self._families.values())
+        metrics = {}
+        for family in families:
+            samples = []
+            for labels, values in family.collect():
+                if 'buckets' in values:
+                    values = dict(values, buckets={format_value(upper_bound): count
+                                                   for upper_bound, count in values['buckets'].items()})
+                samples.append(dict(values, labels=labels))
+            metrics[family.name] = {'type': family.type_name, 'help': family.documentation, 'samples': samples}
+        return metrics
+
+    def to_prometheus(self):
+        """
+        Returns:
+            Prometheusのテキスト形式
+        """
+        with self._lock:
+            families = list(self._families.values())
+        lines = []
+        for family in families:
+            lines.append(f'# HELP {family.name} {family.documentation}')
+            lines.append(f'# TYPE {family.name} {family.type_name}')
+            for labels, values in family.collect():
+                if 'buckets' not in values:
+                    lines.append(f'{family.name}{format_labels(labels)} {format_value(values["value"])}')
+                    continue
+                for upper_bound, count in values['buckets'].items():
+                    bucket_labels = dict(labels, le=format_value(upper_bound))
+                    lines.append(f'{family.name}_bucket{format_labels(bucket_labels)} {count}')
+                lines.append(f'{family.name}_sum{format_labels(labels)} {format_value(values["sum"])}')
+                lines.append(f'{family.name}_count{format_labels(labels)} {values["count"]}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label_value(value)}"' for name, value in labels.items()) + '}'
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def counter(name, documentation, label_names=()):
+    """
+    カウンターを登録する。同じ名前で登録済みの場合はそれを返す
+    """
+    return MetricsRegistry().counter(name, documentation, label_names)
+
+
+def histogram(name, documentation, label_names=(), buckets=DEFAULT_LATENCY_BUCKETS):
+    """
+    ヒストグラムを登録する。同じ名前で登録済みの場合はそれを返す
+    """
+    return MetricsRegistry().histogram(name, documentation, label_names, buckets)
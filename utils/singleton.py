@@ -1,9 +1,17 @@
-class Singleton(type):
-
-    _instances = {}
-
-    def __call__(cls, *args, **kwargs):
-        if cls not in cls._instances:
-            cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
-
+import threading
+
+
+class Singleton(type):
+
+    _instances = {}
+    # バックグラウンドの起動とリクエストから同時に生成されても、インスタンスを1つにする。
+    # 生成中に他のSingletonを生成できるように再入可能にする
+    _lock = threading.RLock()
+
+    def __call__(cls, *args, **kwargs):
+        if cls not in cls._instances:
+            with cls._lock:
+                if cls not in cls._instances:
+                    cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
+
         return cls._instances[cls]
\ No newline at end of file